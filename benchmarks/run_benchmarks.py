@@ -0,0 +1,460 @@
+"""Throughput and latency benchmarks for student_guardrails, against a local fake moderation API.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output benchmark-results.json
+    python benchmarks/run_benchmarks.py --quick --baseline benchmark-results.json
+
+Each benchmark moderates unique messages (so no cached results are used) and reports messages per second
+and p50/p99 per-message latency, in seconds. With --baseline, results are compared to an earlier results file
+and the exit code is 1 if any benchmark's throughput dropped by more than --regression-threshold.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.metadata
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections.abc import Awaitable, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from student_guardrails import fake_moderation_server, local_provider, moderation, word_matcher
+
+logger = logging.getLogger(__name__)
+
+RESULT_KEY_FIELDS = ["benchmark", "mode", "concurrency", "history_length", "word_list_size"]
+# run in a fresh interpreter; prints the seconds taken by the import and by the import plus a local-only check
+STARTUP_SCRIPT = """
+import json
+import time
+
+start_time = time.perf_counter()
+from student_guardrails import moderation
+
+import_duration = time.perf_counter() - start_time
+text = "can you help me with ~specialDisallowedInputWord~ fractions"
+moderation.apply_input_moderation_rules(text, moderation.get_input_moderation_data(text))
+print(json.dumps({"import": import_duration, "import_and_local_check": time.perf_counter() - start_time}))
+"""
+
+
+def get_messages(n_messages: int, prefix: str) -> list[str]:
+    return [f"{prefix} message {i}: can you help me simplify 3/4 + 5/8 please?" for i in range(n_messages)]
+
+
+def get_history(history_length: int) -> list[str]:
+    return [f"Previous message {i} in this conversation, about adding fractions." for i in range(history_length)]
+
+
+def summarize(latencies: list[float], wall_time: float, errors: int) -> dict:
+    return {
+        "messages": len(latencies),
+        "errors": errors,
+        "messages_per_second": len(latencies) / wall_time if wall_time > 0 else 0.0,
+        "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) > 0 else None,
+        "latency_p99": float(np.percentile(latencies, 99)) if len(latencies) > 0 else None,
+        "latency_mean": float(np.mean(latencies)) if len(latencies) > 0 else None,
+    }
+
+
+def run_sync(function: Callable[[str], object], texts: list[str], concurrency: int) -> dict:
+    errors = 0
+
+    def timed_call(text: str) -> float:
+        nonlocal errors
+        start_time = time.perf_counter()
+        try:
+            function(text)
+        except Exception as e:
+            logger.debug(f"Benchmark call failed: {e!r}")
+            errors += 1
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if concurrency == 1:
+        latencies = [timed_call(text) for text in texts]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed_call, texts))
+    return summarize(latencies, time.perf_counter() - start_time, errors)
+
+
+def run_async(function: Callable[[str], Awaitable[object]], texts: list[str], concurrency: int) -> dict:
+    async def run() -> dict:
+        semaphore = asyncio.Semaphore(concurrency)
+        errors = 0
+
+        async def timed_call(text: str) -> float:
+            nonlocal errors
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    await function(text)
+                except Exception as e:
+                    logger.debug(f"Benchmark call failed: {e!r}")
+                    errors += 1
+                return time.perf_counter() - start_time
+
+        try:
+            start_time = time.perf_counter()
+            latencies = await asyncio.gather(*[timed_call(text) for text in texts])
+            return summarize(list(latencies), time.perf_counter() - start_time, errors)
+        finally:
+            await moderation.close_async_openai_client()
+
+    return asyncio.run(run())
+
+
+@contextlib.contextmanager
+def use_word_list_size(word_list_size: int | None) -> Iterator[None]:
+    """Pad the disallowed word lists with synthetic terms, up to word_list_size terms; None uses the lists as-is."""
+    if word_list_size is None:
+        yield
+        return
+    original_functions = (moderation.get_disallowed_input_matcher, moderation.get_disallowed_output_matcher)
+    synthetic_terms = [f"synthetic{i}" for i in range(word_list_size)]
+    input_matcher = word_matcher.WordListMatcher(
+        list(moderation.get_disallowed_input_words())
+        + synthetic_terms[: word_list_size - len(moderation.get_disallowed_input_words())],
+    )
+    output_matcher = word_matcher.WordListMatcher(
+        list(moderation.get_disallowed_output_words())
+        + synthetic_terms[: word_list_size - len(moderation.get_disallowed_output_words())],
+    )
+    moderation.get_disallowed_input_matcher = lambda: input_matcher
+    moderation.get_disallowed_output_matcher = lambda: output_matcher
+    try:
+        yield
+    finally:
+        moderation.get_disallowed_input_matcher, moderation.get_disallowed_output_matcher = original_functions
+
+
+@contextlib.contextmanager
+def use_batching(enabled: bool) -> Iterator[None]:
+    original_value = moderation.OPENAI_MODERATION_BATCHING
+    moderation.OPENAI_MODERATION_BATCHING = enabled
+    try:
+        yield
+    finally:
+        moderation.OPENAI_MODERATION_BATCHING = original_value
+
+
+def run_moderation_benchmarks(
+    n_messages: int,
+    concurrency_levels: list[int],
+    history_lengths: list[int],
+    word_list_sizes: list[int | None],
+) -> list[dict]:
+    results = []
+    for word_list_size in word_list_sizes:
+        with use_word_list_size(word_list_size):
+            for history_length in history_lengths:
+                history = get_history(history_length)
+                for concurrency in concurrency_levels:
+                    for mode in ["sync", "async", "async_batched"]:
+                        texts = get_messages(n_messages, uuid.uuid4().hex)
+                        with use_batching(mode == "async_batched"):
+                            if mode == "sync":
+                                summary = run_sync(
+                                    lambda text: moderation.get_input_moderation_data(text, history),
+                                    texts,
+                                    concurrency,
+                                )
+                            else:
+                                summary = run_async(
+                                    lambda text: moderation.get_input_moderation_data_async(text, history),
+                                    texts,
+                                    concurrency,
+                                )
+                        results.append(
+                            {
+                                "benchmark": "get_input_moderation_data",
+                                "mode": mode,
+                                "concurrency": concurrency,
+                                "history_length": history_length,
+                                "word_list_size": word_list_size,
+                                **summary,
+                            },
+                        )
+                        logger.info(f"{results[-1]}")
+            for concurrency in concurrency_levels:
+                for mode in ["sync", "async"]:
+                    texts = get_messages(n_messages, uuid.uuid4().hex)
+                    if mode == "sync":
+                        summary = run_sync(moderation.get_output_moderation_data, texts, concurrency)
+                    else:
+                        summary = run_async(moderation.get_output_moderation_data_async, texts, concurrency)
+                    results.append(
+                        {
+                            "benchmark": "get_output_moderation_data",
+                            "mode": mode,
+                            "concurrency": concurrency,
+                            "history_length": 0,
+                            "word_list_size": word_list_size,
+                            **summary,
+                        },
+                    )
+                    logger.info(f"{results[-1]}")
+    return results
+
+
+def run_rule_benchmarks(n_messages: int, word_list_sizes: list[int | None]) -> list[dict]:
+    """The rules are local, so these run single-threaded against precomputed moderation data."""
+    results = []
+    texts = get_messages(n_messages, "rules")
+    # some generations contain a disallowed word, so redaction is exercised
+    generations = [text + (" ~specialDisallowedOutputWord~" if i % 10 == 0 else "") for i, text in enumerate(texts)]
+    input_moderation_data = {text: moderation.get_input_moderation_data(text) for text in texts}
+    for word_list_size in word_list_sizes:
+        with use_word_list_size(word_list_size):
+            output_moderation_data = {
+                generation: moderation.get_output_moderation_data(generation) for generation in generations
+            }
+            summary = run_sync(
+                lambda text: moderation.apply_input_moderation_rules(text, input_moderation_data[text]),
+                texts,
+                1,
+            )
+            results.append(
+                {
+                    "benchmark": "apply_input_moderation_rules",
+                    "mode": "sync",
+                    "concurrency": 1,
+                    "history_length": 0,
+                    "word_list_size": word_list_size,
+                    **summary,
+                },
+            )
+            summary = run_sync(
+                lambda generation: moderation.apply_output_moderation_rules(
+                    generation,
+                    output_moderation_data[generation],
+                ),
+                generations,
+                1,
+            )
+            results.append(
+                {
+                    "benchmark": "apply_output_moderation_rules",
+                    "mode": "sync",
+                    "concurrency": 1,
+                    "history_length": 0,
+                    "word_list_size": word_list_size,
+                    **summary,
+                },
+            )
+    return results
+
+
+def run_local_provider_benchmarks(n_messages: int) -> list[dict]:
+    """Scores with a local model trained on synthetic scores; only the scoring time matters here, not the accuracy."""
+    training_texts = get_messages(1000, "training")
+    training_scores = [
+        {
+            category: 0.9 if i % 10 == 0 and category == "violence" else 0.001
+            for category in moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST
+        }
+        for i in range(len(training_texts))
+    ]
+    provider = local_provider.LocalModerationProvider.train(training_texts, training_scores, epochs=1)
+    summary = run_sync(provider.score, get_messages(n_messages, "local"), 1)
+    return [
+        {
+            "benchmark": "local_provider",
+            "mode": "sync",
+            "concurrency": 1,
+            "history_length": 0,
+            "word_list_size": None,
+            **summary,
+        },
+    ]
+
+
+def run_startup_benchmarks(n_runs: int) -> list[dict]:
+    """Cold-start time of a new process: importing moderation, then moderating a message that the word list decides.
+
+    "messages" is the number of processes started; latencies are per process.
+    """
+    environ = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(path for path in sys.path if path != ""),
+        "MODERATION_WORD_LIST_SNAPSHOT_PATH": "",
+    }
+    for variable in ["MODERATION_LOCAL_TIER", "MODERATION_PROVIDER", "MODERATION_BACKGROUND_REMOTE_SCORING"]:
+        environ.pop(variable, None)
+
+    def get_durations(environ: dict[str, str]) -> dict[str, list[float]]:
+        durations = {}
+        for _ in range(n_runs):
+            process = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                capture_output=True,
+                text=True,
+                check=True,
+                env=environ,
+            )
+            for mode, duration in json.loads(process.stdout.strip().splitlines()[-1]).items():
+                durations.setdefault(mode, []).append(duration)
+        return durations
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        snapshot_path = os.path.join(snapshot_dir, "word_lists.pickle")
+        moderation.write_word_list_snapshot(snapshot_path)
+        durations = get_durations(environ)
+        snapshot_durations = get_durations({**environ, "MODERATION_WORD_LIST_SNAPSHOT_PATH": snapshot_path})
+    durations["import_and_local_check_snapshot"] = snapshot_durations["import_and_local_check"]
+    return [
+        {
+            "benchmark": "startup",
+            "mode": mode,
+            "concurrency": 1,
+            "history_length": 0,
+            "word_list_size": None,
+            **summarize(mode_durations, sum(mode_durations), 0),
+        }
+        for mode, mode_durations in durations.items()
+    ]
+
+
+def get_metadata(args: argparse.Namespace) -> dict:
+    try:
+        git_commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    try:
+        package_version = importlib.metadata.version("chatbot-safety")
+    except importlib.metadata.PackageNotFoundError:
+        package_version = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit,
+        "package_version": package_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "arguments": vars(args),
+    }
+
+
+def get_result_key(result: dict) -> tuple:
+    return tuple(result.get(field) for field in RESULT_KEY_FIELDS)
+
+
+def format_latency(latency: float | None) -> str:
+    """None (no measured messages) is shown as n/a."""
+    return "n/a" if latency is None else f"{latency:.4f}s"
+
+
+def compare_results(results: list[dict], baseline_results: list[dict], regression_threshold: float) -> list[dict]:
+    """Compare throughput to the baseline; returns the benchmarks that regressed by more than the threshold."""
+    baseline_by_key = {get_result_key(result): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline = baseline_by_key.get(get_result_key(result))
+        if baseline is None or baseline["messages_per_second"] <= 0:
+            continue
+        ratio = result["messages_per_second"] / baseline["messages_per_second"]
+        logger.info(
+            f"{get_result_key(result)}: {result['messages_per_second']:.1f} vs. "
+            f"{baseline['messages_per_second']:.1f} messages/second ({ratio:.2f}x), "
+            f"p99 {format_latency(result.get('latency_p99'))} vs. {format_latency(baseline.get('latency_p99'))}",
+        )
+        if ratio < 1 - regression_threshold:
+            regressions.append({"key": dict(zip(RESULT_KEY_FIELDS, get_result_key(result))), "ratio": ratio})
+    return regressions
+
+
+def parse_int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item.strip() != ""]
+
+
+def parse_word_list_sizes(value: str) -> list[int | None]:
+    """'default' means the word lists as shipped."""
+    return [None if item.strip() == "default" else int(item) for item in value.split(",") if item.strip() != ""]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark moderation against a local fake moderation API.")
+    parser.add_argument("--output", default="benchmark-results.json", help="Path for the JSON results.")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against.")
+    parser.add_argument("--regression-threshold", type=float, default=0.2)
+    parser.add_argument("--messages", type=int, default=200, help="Messages per benchmark.")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 8, 32])
+    parser.add_argument("--history-lengths", type=parse_int_list, default=[0, 10])
+    parser.add_argument("--word-list-sizes", type=parse_word_list_sizes, default=[None, 10000])
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake API mean response time in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--startup-runs", type=int, default=10, help="Processes started per startup benchmark.")
+    parser.add_argument("--quick", action="store_true", help="Fewer messages and configurations, for a smoke test.")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.messages = min(args.messages, 50)
+        args.concurrency = args.concurrency[:2]
+        args.history_lengths = args.history_lengths[:1]
+        args.word_list_sizes = args.word_list_sizes[:1]
+        args.startup_runs = min(args.startup_runs, 3)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # the OpenAI client logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # before the fake server's environment variables are set, so that they don't affect the new processes
+    startup_results = run_startup_benchmarks(args.startup_runs)
+    server = fake_moderation_server.FakeModerationServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=0,
+    )
+    with server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-api-key")
+        moderation.reset_openai_clients()
+        moderation.set_moderation_cache(None)
+        results = run_moderation_benchmarks(
+            args.messages,
+            args.concurrency,
+            args.history_lengths,
+            args.word_list_sizes,
+        )
+        results.extend(run_rule_benchmarks(args.messages, args.word_list_sizes))
+        results.extend(run_local_provider_benchmarks(args.messages))
+        results.extend(startup_results)
+        server_stats = {"requests": server.request_count, "status_counts": server.status_counts}
+    moderation.reset_openai_clients()
+
+    output = {"metadata": {**get_metadata(args), "fake_server": server_stats}, "results": results}
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline) as infile:
+            baseline_results = json.load(infile)["results"]
+        regressions = compare_results(results, baseline_results, args.regression_threshold)
+        output["regressions"] = regressions
+        if len(regressions) > 0:
+            logger.warning(f"{len(regressions)} benchmarks regressed by more than {args.regression_threshold:.0%}.")
+            exit_code = 1
+    with open(args.output, "w") as outfile:
+        json.dump(output, outfile, indent=2)
+    logger.info(f"Wrote {len(results)} benchmark results to {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
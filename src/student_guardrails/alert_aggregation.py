@@ -0,0 +1,219 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+from student_guardrails import config, email_alerts, metrics, moderation_responses
+
+logger = logging.getLogger(__name__)
+
+
+# seconds during which repeated alerts from the same activity session are folded into a digest; 0 disables grouping
+ALERT_AGGREGATION_WINDOW = config.get_config().alert_aggregation_window
+# maximum number of emails sent per ALERT_RATE_LIMIT_PERIOD, for each category and in total
+ALERT_CATEGORY_RATE_LIMIT = config.get_config().alert_category_rate_limit
+ALERT_GLOBAL_RATE_LIMIT = config.get_config().alert_global_rate_limit
+ALERT_RATE_LIMIT_PERIOD = config.get_config().alert_rate_limit_period
+
+
+class AlertGroup:
+    def __init__(self, opened_at: float):
+        self.opened_at = opened_at
+        self.pending_alerts: list[dict] = []
+        # categories already alerted on in this window
+        self.categories: set[str] = set()
+
+
+def is_end_conversation_category(category: str) -> bool:
+    actions = moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP.get(category, [])
+    return moderation_responses.ACTION_END_CONVERSATION in actions
+
+
+class AlertAggregator:
+    """Deduplicates and rate-limits alert emails.
+
+    The first alert from an activity session is sent immediately and opens a window of `window` seconds.
+    Follow-up alerts from that session within the window that repeat a category already alerted on are folded into
+    a single digest email that is sent when the window closes. Follow-ups in a new category, or in a category that
+    ends the conversation (e.g. self-harm/intent), are sent immediately, so an escalation isn't held for the window.
+    Alerts that would exceed the per-category or global rate limit are also folded into their session's digest
+    (alerts without an activity session share a digest), which is sent once the global rate limit allows.
+
+    Expired windows are flushed by a background thread; call flush() to send all pending digests immediately.
+    """
+
+    def __init__(
+        self,
+        window: float = 600,
+        category_rate_limit: int = 20,
+        global_rate_limit: int = 100,
+        rate_limit_period: float = 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = window
+        self.category_rate_limit = category_rate_limit
+        self.global_rate_limit = global_rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.clock = clock
+        self.groups: dict[str, AlertGroup] = {}
+        self._category_send_times: dict[str, deque[float]] = {}
+        self._global_send_times: deque[float] = deque()
+        self._lock = threading.Lock()
+        self._flush_thread: threading.Thread | None = None
+        self._stop_event = threading.Event()
+        self.immediate_count = 0
+        self.folded_count = 0
+        self.digest_count = 0
+
+    def submit(self, moderation_data: dict) -> bool:
+        """Send or fold an alert; moderation_data is as expected by email_alerts.create_alert_email().
+
+        Returns:
+            bool: True if the alert was sent immediately, False if it was folded into a digest.
+        """
+        # sends digests for closed windows first, so a new window doesn't replace a group with pending alerts
+        self.flush_expired()
+        now = self.clock()
+        activity_session_id = moderation_data.get("activity_session_id") or ""
+        category = moderation_data.get("category", "unknown")
+        alert = {**moderation_data, "alert_time": datetime.now(timezone.utc)}
+        with self._lock:
+            group = self.groups.get(activity_session_id)
+            in_window = group is not None and activity_session_id != "" and now < group.opened_at + self.window
+            if in_window and category in group.categories and not is_end_conversation_category(category):
+                group.pending_alerts.append(alert)
+                self.folded_count += 1
+                metrics.increment("guardrails_alerts_total", result="folded")
+                return False
+            if not self._within_rate_limits(category, now):
+                logger.warning(f"Alert rate limit reached; folding {category} alert into a digest.")
+                if group is None:
+                    group = self.groups[activity_session_id] = AlertGroup(now)
+                group.pending_alerts.append(alert)
+                self.folded_count += 1
+                metrics.increment("guardrails_alerts_total", result="rate_limited")
+                return False
+            self._record_send(category, now)
+            if activity_session_id != "" and self.window > 0:
+                if group is None:
+                    group = self.groups[activity_session_id] = AlertGroup(now)
+                group.categories.add(category)
+            self.immediate_count += 1
+        metrics.increment("guardrails_alerts_total", result="immediate")
+        subject, content = email_alerts.create_alert_email(dict(moderation_data))
+        email_alerts.dispatch_alert_email(subject, content)
+        return True
+
+    def flush_expired(self) -> int:
+        """Send digests for windows that have closed. Returns the number of digests sent."""
+        return self._flush(force=False)
+
+    def flush(self) -> int:
+        """Send all pending digests, regardless of their windows and the global rate limit."""
+        return self._flush(force=True)
+
+    def _flush(self, force: bool) -> int:
+        now = self.clock()
+        digests = []
+        with self._lock:
+            for activity_session_id, group in list(self.groups.items()):
+                if not force and activity_session_id != "" and now < group.opened_at + self.window:
+                    continue
+                if len(group.pending_alerts) > 0:
+                    if not force and not self._within_global_rate_limit(now):
+                        # try again at the next flush
+                        continue
+                    self._record_send(None, now)
+                    digests.append((activity_session_id, group.pending_alerts))
+                del self.groups[activity_session_id]
+            self.digest_count += len(digests)
+        if len(digests) > 0:
+            metrics.increment("guardrails_alert_digests_total", len(digests))
+        for activity_session_id, alerts in digests:
+            subject, content = email_alerts.create_alert_digest_email(activity_session_id, alerts)
+            email_alerts.dispatch_alert_email(subject, content)
+        return len(digests)
+
+    def _prune_send_times(self, send_times: deque[float], now: float) -> deque[float]:
+        while len(send_times) > 0 and send_times[0] <= now - self.rate_limit_period:
+            send_times.popleft()
+        return send_times
+
+    def _within_global_rate_limit(self, now: float) -> bool:
+        return len(self._prune_send_times(self._global_send_times, now)) < self.global_rate_limit
+
+    def _within_rate_limits(self, category: str, now: float) -> bool:
+        category_send_times = self._category_send_times.setdefault(category, deque())
+        return (
+            self._within_global_rate_limit(now)
+            and len(self._prune_send_times(category_send_times, now)) < self.category_rate_limit
+        )
+
+    def _record_send(self, category: str | None, now: float) -> None:
+        self._global_send_times.append(now)
+        if category is not None:
+            self._category_send_times.setdefault(category, deque()).append(now)
+
+    def get_stats(self) -> dict:
+        return {
+            "immediate": self.immediate_count,
+            "folded": self.folded_count,
+            "digests": self.digest_count,
+            "open_groups": len(self.groups),
+        }
+
+    def start(self, interval: float = 30) -> None:
+        """Start a background thread that sends digests as their windows close."""
+        with self._lock:
+            if self._flush_thread is None:
+                self._stop_event.clear()
+                self._flush_thread = threading.Thread(
+                    target=self._run,
+                    args=(interval,),
+                    name="alert-aggregator",
+                    daemon=True,
+                )
+                self._flush_thread.start()
+
+    def shutdown(self) -> None:
+        """Stop the background thread and send all pending digests."""
+        with self._lock:
+            thread, self._flush_thread = self._flush_thread, None
+        if thread is not None:
+            self._stop_event.set()
+            thread.join()
+        self.flush()
+
+    def _run(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                logger.error(f"Failed to flush alert digests: {e!r}")
+
+
+_alert_aggregator: AlertAggregator | None = None
+
+
+def get_alert_aggregator() -> AlertAggregator:
+    global _alert_aggregator
+    if _alert_aggregator is None:
+        _alert_aggregator = AlertAggregator(
+            window=ALERT_AGGREGATION_WINDOW,
+            category_rate_limit=ALERT_CATEGORY_RATE_LIMIT,
+            global_rate_limit=ALERT_GLOBAL_RATE_LIMIT,
+            rate_limit_period=ALERT_RATE_LIMIT_PERIOD,
+        )
+        _alert_aggregator.start(interval=min(30, max(ALERT_AGGREGATION_WINDOW / 4, 1)))
+        # registered after the alert dispatcher is created, so digests are queued before the dispatcher drains
+        email_alerts.get_alert_dispatcher()
+        atexit.register(_alert_aggregator.shutdown)
+    return _alert_aggregator
+
+
+def submit_alert(moderation_data: dict) -> bool:
+    """Send an alert email, subject to deduplication and rate limits; see AlertAggregator."""
+    return get_alert_aggregator().submit(moderation_data)
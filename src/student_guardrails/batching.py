@@ -0,0 +1,83 @@
+import asyncio
+import copy
+import logging
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ModerationBatcher:
+    """Collects concurrent moderation requests into multi-input API calls.
+
+    Pending inputs are flushed as a single call to batch_function when max_batch_size inputs are waiting,
+    or max_wait seconds after the first input of the batch arrived, whichever comes first.
+    Duplicate inputs within a batch are only sent once.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        batch_function: Callable[[list[str]], Awaitable[list[dict]]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}.")
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, input: str) -> dict:
+        start_time = datetime.now(timezone.utc)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((input, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush_pending)
+        output = await future
+        # request_duration reflects this caller's wait, not the duration of the shared request
+        elapsed_time = datetime.now(timezone.utc) - start_time
+        output["request_duration"] = elapsed_time.total_seconds()
+        return output
+
+    async def flush(self) -> None:
+        """Send any pending inputs immediately and wait for all in-flight batches to complete."""
+        self._flush_pending()
+        if len(self._tasks) > 0:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush_pending(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if len(batch) == 0:
+            return
+        task = asyncio.ensure_future(self._send_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        unique_inputs = list(dict.fromkeys(input for input, _ in batch))
+        try:
+            outputs = await self.batch_function(unique_inputs)
+            if len(outputs) != len(unique_inputs):
+                raise ValueError(f"Expected {len(unique_inputs)} moderation results, received {len(outputs)}.")
+        except Exception as e:
+            logger.error(f"Moderation batch of {len(unique_inputs)} inputs failed: {e!r}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        output_map = dict(zip(unique_inputs, outputs))
+        for input, future in batch:
+            if not future.done():
+                # each caller receives its own copy, since callers may modify the result
+                future.set_result(copy.deepcopy(output_map[input]))
@@ -0,0 +1,295 @@
+"""Re-score exported conversation logs with the current word lists, thresholds, and moderation model.
+
+Usage:
+    python -m student_guardrails.bulk_moderation data/raw/supabase_staging.jsonl data/derived/moderation.jsonl
+
+Input is a JSONL file of message records: either Django dump records like supabase_staging.jsonl
+({"model": "<app>.message", "pk": ..., "fields": {...}}),
+or flat records with the same fields ("id", "text", "direction", "activity_session").
+The file is streamed in chunks, so memory use doesn't depend on its size. Progress is checkpointed after every chunk;
+re-running the same command resumes where the previous run stopped.
+Each message is scored on its own, without previous messages as context, and no alert emails are sent.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from student_guardrails import moderation, moderation_responses
+
+logger = logging.getLogger(__name__)
+
+INPUT_DIRECTION = "I"
+OUTPUT_DIRECTION = "O"
+OUTPUT_ACTION_BAD_GENERATION = "bad_generation"
+OUTPUT_ACTION_REDACTED = "redacted"
+
+
+def parse_message_record(record: dict, model_name: str = "message") -> dict | None:
+    """Extract the fields needed for moderation, or None if the record isn't a message with text."""
+    if "model" in record and "fields" in record:
+        if record["model"].split(".")[-1] != model_name:
+            return None
+        fields = {"id": record.get("pk"), **record["fields"]}
+    else:
+        fields = record
+    text = fields.get("text")
+    if not isinstance(text, str) or text.strip() == "":
+        return None
+    return {
+        "id": fields.get("id"),
+        "activity_session": fields.get("activity_session"),
+        "direction": fields.get("direction", INPUT_DIRECTION),
+        "text": text,
+    }
+
+
+def get_result_row(message: dict, moderation_result: dict) -> dict:
+    text = message["text"]
+    category = None
+    if message["direction"] == OUTPUT_DIRECTION:
+        output_moderation_data = {
+            "disallowed_words_in_output": sorted(moderation.get_disallowed_words_in_output(text)),
+            "openai_moderation_result": moderation_result,
+        }
+        disallowed_words = output_moderation_data["disallowed_words_in_output"]
+        moderated_text = moderation.apply_output_moderation_rules(text, output_moderation_data)
+        if moderated_text == moderation_responses.BAD_GENERATION_RESPONSE:
+            action = OUTPUT_ACTION_BAD_GENERATION
+        elif moderated_text != text:
+            action = OUTPUT_ACTION_REDACTED
+        else:
+            action = moderation_responses.ACTION_NO_ACTION
+    else:
+        input_moderation_data = {
+            "disallowed_words_in_input": sorted(moderation.get_disallowed_words_in_input(text)),
+            "openai_moderation_result": moderation_result,
+        }
+        disallowed_words = input_moderation_data["disallowed_words_in_input"]
+        action, _, category = moderation.get_input_moderation_decision(input_moderation_data)
+    category_scores = moderation_result["category_scores"]
+    return {
+        "id": message["id"],
+        "activity_session": message["activity_session"],
+        "direction": message["direction"],
+        "action": action,
+        "category": category,
+        "disallowed_words": disallowed_words,
+        "max_moderation_score": max(category_scores.values(), default=0.0),
+        "category_scores": category_scores,
+        "flagged": moderation_result.get("flagged"),
+    }
+
+
+async def moderate_messages(messages: list[dict], batch_size: int) -> list[dict]:
+    """Moderate the messages concurrently, batch_size messages per API request."""
+    batches = [messages[i : i + batch_size] for i in range(0, len(messages), batch_size)]
+    batch_texts = [[message["text"] for message in batch] for batch in batches]
+    batch_results = await asyncio.gather(
+        *[moderation.get_openai_moderation_results_batch_async(texts) for texts in batch_texts],
+    )
+    rows = []
+    for batch, moderation_results in zip(batches, batch_results):
+        for message, moderation_result in zip(batch, moderation_results):
+            rows.append(get_result_row(message, moderation_result))
+    return rows
+
+
+class JsonlResultWriter:
+    def __init__(self, path: Path, resume_position: int):
+        self.path = path
+        if resume_position > 0:
+            # discard anything written after the last checkpoint
+            with open(path, "r+b") as outfile:
+                outfile.truncate(resume_position)
+        self.outfile = open(path, "ab" if resume_position > 0 else "wb")
+
+    def write(self, rows: list[dict]) -> int:
+        """Returns the position to resume from."""
+        for row in rows:
+            self.outfile.write(json.dumps(row).encode("utf-8") + b"\n")
+        self.outfile.flush()
+        return self.outfile.tell()
+
+    def close(self) -> None:
+        self.outfile.close()
+
+
+def get_part_index(path: Path) -> int | None:
+    """The index of a part file written by ParquetResultWriter, or None for any other file."""
+    prefix, _, index = path.stem.partition("-")
+    if prefix != "part" or path.suffix != ".parquet" or not index.isdigit():
+        return None
+    return int(index)
+
+
+def remove_parts(path: Path, first_part_index: int) -> None:
+    """Remove the part files in directory path from first_part_index on, e.g. those written after the last checkpoint."""
+    if not path.is_dir():
+        return
+    for part_path in path.iterdir():
+        part_index = get_part_index(part_path)
+        if part_index is not None and part_index >= first_part_index:
+            part_path.unlink()
+
+
+class ParquetResultWriter:
+    """Writes each chunk as a separate part file in the output directory.
+
+    Part files from resume_position on are removed first, so a restarted or resumed run doesn't mix in stale results.
+    """
+
+    def __init__(self, path: Path, resume_position: int):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                "Parquet output requires pyarrow; install the 'parquet' extra, or use JSONL output."
+            ) from e
+        self.pyarrow = pyarrow
+        self.pyarrow_parquet = pyarrow.parquet
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        remove_parts(self.path, resume_position)
+        self.part_index = resume_position
+
+    def write(self, rows: list[dict]) -> int:
+        table = self.pyarrow.Table.from_pylist(rows)
+        self.pyarrow_parquet.write_table(table, self.path / f"part-{self.part_index:06d}.parquet")
+        self.part_index += 1
+        return self.part_index
+
+    def close(self) -> None:
+        pass
+
+
+def load_checkpoint(checkpoint_path: Path, input_path: Path) -> dict:
+    checkpoint = {"input_path": str(input_path), "input_offset": 0, "output_position": 0, "messages_processed": 0}
+    if checkpoint_path.exists():
+        with open(checkpoint_path) as infile:
+            saved_checkpoint = json.load(infile)
+        if saved_checkpoint.get("input_path") != str(input_path):
+            raise ValueError(
+                f"Checkpoint {checkpoint_path} is for {saved_checkpoint.get('input_path')}, not {input_path}; "
+                "use --restart to discard it.",
+            )
+        checkpoint.update(saved_checkpoint)
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path: Path, checkpoint: dict) -> None:
+    temporary_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    with open(temporary_path, "w") as outfile:
+        json.dump(checkpoint, outfile)
+    os.replace(temporary_path, checkpoint_path)
+
+
+async def run_bulk_moderation(
+    input_path: Path,
+    output_path: Path,
+    output_format: str = "jsonl",
+    batch_size: int = 32,
+    concurrency: int = 8,
+    checkpoint_path: Path | None = None,
+    restart: bool = False,
+    max_messages: int | None = None,
+) -> dict:
+    """Moderate all messages in input_path, writing one result row per message to output_path.
+
+    Up to batch_size * concurrency messages are held in memory at a time.
+
+    Returns:
+        dict: The final checkpoint.
+    """
+    if checkpoint_path is None:
+        checkpoint_path = output_path.with_name(output_path.name + ".checkpoint.json")
+    if restart and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    checkpoint = load_checkpoint(checkpoint_path, input_path)
+    writer_class = ParquetResultWriter if output_format == "parquet" else JsonlResultWriter
+    writer = writer_class(output_path, checkpoint["output_position"])
+    chunk_size = batch_size * concurrency
+    start_time = time.monotonic()
+    messages_at_start = checkpoint["messages_processed"]
+    try:
+        with open(input_path, "rb") as infile:
+            infile.seek(checkpoint["input_offset"])
+            end_of_file = False
+            while not end_of_file:
+                if max_messages is not None and checkpoint["messages_processed"] >= max_messages:
+                    break
+                remaining = chunk_size
+                if max_messages is not None:
+                    remaining = min(remaining, max_messages - checkpoint["messages_processed"])
+                messages = []
+                while len(messages) < remaining:
+                    line = infile.readline()
+                    if line == b"":
+                        end_of_file = True
+                        break
+                    if line.strip() == b"":
+                        continue
+                    message = parse_message_record(json.loads(line))
+                    if message is not None:
+                        messages.append(message)
+                if len(messages) > 0:
+                    rows = await moderate_messages(messages, batch_size)
+                    checkpoint["output_position"] = writer.write(rows)
+                    checkpoint["messages_processed"] += len(messages)
+                checkpoint["input_offset"] = infile.tell()
+                save_checkpoint(checkpoint_path, checkpoint)
+                elapsed_time = time.monotonic() - start_time
+                rate = (checkpoint["messages_processed"] - messages_at_start) / max(elapsed_time, 1e-9)
+                logger.info(f"Moderated {checkpoint['messages_processed']} messages ({rate:.1f} messages/second).")
+    finally:
+        writer.close()
+        await moderation.close_async_openai_client()
+    return checkpoint
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-score exported conversation logs (JSONL) with moderation.")
+    parser.add_argument("input_path", type=Path, help="JSONL file of message records.")
+    parser.add_argument("output_path", type=Path, help="JSONL file, or a directory of Parquet files.")
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "parquet"],
+        default=None,
+        help="Output format; by default, Parquet if output_path ends in .parquet, otherwise JSONL.",
+    )
+    parser.add_argument("--batch-size", type=int, default=32, help="Messages per moderation API request.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Moderation API requests in flight.")
+    parser.add_argument("--checkpoint-path", type=Path, default=None, help="Defaults to <output_path>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint and start over.")
+    parser.add_argument("--max-messages", type=int, default=None, help="Stop after this many messages in total.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    output_format = args.format
+    if output_format is None:
+        output_format = "parquet" if args.output_path.suffix == ".parquet" else "jsonl"
+    if output_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("Parquet output requires pyarrow; install the 'parquet' extra, or use JSONL output.")
+    checkpoint = asyncio.run(
+        run_bulk_moderation(
+            args.input_path,
+            args.output_path,
+            output_format=output_format,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint_path,
+            restart=args.restart,
+            max_messages=args.max_messages,
+        ),
+    )
+    logger.info(f"Finished; {checkpoint['messages_processed']} messages moderated in total.")
+
+
+if __name__ == "__main__":
+    main()
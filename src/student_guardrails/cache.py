@@ -0,0 +1,224 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so that trivially different repeats ("Hi ", "hi") share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def get_cache_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class ModerationCache:
+    """Interface for moderation result caches.
+
+    Subclasses implement _get() and _set(); hit, miss, and eviction counts are tracked here.
+    Values are copied on the way in and out, so callers can freely modify them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        self._set(key, copy.deepcopy(value))
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self),
+        }
+
+    def _record_evictions(self, count: int) -> None:
+        with self._stats_lock:
+            self.evictions += count
+
+    def _get(self, key: str) -> dict | None:
+        raise NotImplementedError()
+
+    def _set(self, key: str, value: dict) -> None:
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+
+class InMemoryModerationCache(ModerationCache):
+    """Thread-safe LRU cache with a per-entry time-to-live."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self._record_evictions(1)
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def _set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted > 0:
+            self._record_evictions(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteModerationCache(ModerationCache):
+    """Persistent cache that can be shared by multiple worker processes on the same host.
+
+    Uses one connection per thread. Expired entries are removed on read; the size limit is enforced
+    every PRUNE_INTERVAL writes, to avoid counting rows on every write.
+    """
+
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, path: str | Path, max_size: int = 1000000, ttl: float = 86400 * 7):
+        super().__init__()
+        self.path = str(path)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes_since_prune = 0
+        with self._get_connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS moderation_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS moderation_cache_expires_at ON moderation_cache (expires_at)",
+            )
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get(self, key: str) -> dict | None:
+        connection = self._get_connection()
+        row = connection.execute(
+            "SELECT value, expires_at FROM moderation_cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= time.time():
+            with connection:
+                connection.execute("DELETE FROM moderation_cache WHERE key = ?", (key,))
+            self._record_evictions(1)
+            return None
+        return json.loads(value)
+
+    def _set(self, key: str, value: dict) -> None:
+        connection = self._get_connection()
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO moderation_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl),
+            )
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.PRUNE_INTERVAL:
+            self._writes_since_prune = 0
+            if len(self) > self.max_size:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        connection = self._get_connection()
+        with connection:
+            evicted = connection.execute("DELETE FROM moderation_cache WHERE expires_at <= ?", (now,)).rowcount
+            excess = len(self) - self.max_size
+            if excess > 0:
+                evicted += connection.execute(
+                    "DELETE FROM moderation_cache "
+                    "WHERE key IN (SELECT key FROM moderation_cache ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        self._record_evictions(evicted)
+
+    def __len__(self) -> int:
+        return self._get_connection().execute("SELECT COUNT(*) FROM moderation_cache").fetchone()[0]
+
+
+class TieredModerationCache(ModerationCache):
+    """An in-memory cache in front of a persistent cache; persistent hits are promoted to memory."""
+
+    def __init__(self, memory_cache: InMemoryModerationCache, persistent_cache: ModerationCache):
+        super().__init__()
+        self.memory_cache = memory_cache
+        self.persistent_cache = persistent_cache
+
+    def _get(self, key: str) -> dict | None:
+        value = self.memory_cache.get(key)
+        if value is None:
+            value = self.persistent_cache.get(key)
+            if value is not None:
+                self.memory_cache.set(key, value)
+        return value
+
+    def _set(self, key: str, value: dict) -> None:
+        self.memory_cache.set(key, value)
+        self.persistent_cache.set(key, value)
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        stats["evictions"] = self.memory_cache.evictions + self.persistent_cache.evictions
+        stats["memory"] = self.memory_cache.get_stats()
+        stats["persistent"] = self.persistent_cache.get_stats()
+        return stats
+
+    def __len__(self) -> int:
+        return len(self.persistent_cache)
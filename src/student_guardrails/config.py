@@ -0,0 +1,170 @@
+"""Moderation configuration, parsed once from the environment into an immutable ModerationConfig.
+
+moderation.py exposes each setting as a module-level constant (e.g. MODERATION_DEADLINE), initialized from get_config().
+"""
+
+import dataclasses
+import functools
+import logging
+import os
+from collections.abc import Mapping
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+DEFAULT_CATEGORY_THRESHOLDS = MappingProxyType(
+    {
+        "self-harm/intent": 0.5,
+        "self-harm/instructions": 0.5,
+        "self-harm": 0.5,
+        "sexual/minors": 0.5,
+        "sexual": 0.5,
+        "violence": 0.5,  # was: 0.1, the rest 0.5
+        "violence/graphic": 0.5,
+        "harassment": 0.5,
+        "harassment/threatening": 0.5,
+        "hate": 0.5,
+        "hate/threatening": 0.5,
+    },
+)
+
+
+def get_env_flag(environ: Mapping[str, str], name: str, default: bool = False) -> bool:
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in TRUE_VALUES
+
+
+def parse_threshold_overrides(env_string: str) -> dict[str, float]:
+    """Parse OVERRIDE_MODERATION_THRESHOLDS, e.g. "violence=0.3;hate=0.4"; malformed entries are logged and skipped."""
+    overrides = {}
+    for kv in env_string.split(";"):
+        if kv.strip() == "":
+            continue
+        try:
+            key, value = kv.strip().split("=")
+            overrides[key.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"Malformed override '{kv}', expected 'category=0.XXX'; ignoring.")
+    return overrides
+
+
+def get_category_thresholds(env_string: str) -> Mapping[str, float]:
+    thresholds = dict(DEFAULT_CATEGORY_THRESHOLDS)
+    for key, value in parse_threshold_overrides(env_string).items():
+        if key not in thresholds:
+            logger.warning(f"Override for unknown category '{key}'; ignoring.")
+            continue
+        thresholds[key] = value
+    return MappingProxyType(thresholds)
+
+
+@dataclasses.dataclass(frozen=True)
+class ModerationConfig:
+    """See moderation.py for what each setting does; the metrics_* and alert_* settings are used by metrics.py,
+    email_alerts.py, and alert_aggregation.py.
+    """
+
+    category_thresholds: Mapping[str, float] = dataclasses.field(default_factory=lambda: DEFAULT_CATEGORY_THRESHOLDS)
+    output_threshold: float = 0.999
+    openai_model: str = "text-moderation-latest"
+    openai_client_timeout: float = 10
+    deadline: float = 8
+    retry_initial_backoff: float = 0.25
+    retry_max_backoff: float = 2
+    circuit_failure_rate: float = 0.5
+    circuit_min_calls: int = 10
+    circuit_window: float = 30
+    circuit_open_duration: float = 30
+    fallback_mode: str = "fail_closed"
+    max_concurrency: int = 64
+    batching: bool = False
+    batch_max_size: int = 32
+    batch_max_wait: float = 0.005
+    cache_max_size: int = 0
+    cache_ttl: float = 86400
+    cache_sqlite_path: str | None = None
+    session_state_max_size: int = 0
+    session_state_sqlite_path: str | None = None
+    session_max_strikes: int = 0
+    session_throttle_duration: float = 300
+    session_review_token: str | None = None
+    background_remote_scoring: bool = False
+    provider: str = "openai"
+    local_model_path: str | None = None
+    local_tier: bool = False
+    local_tier_max_score: float = 0.01
+    word_list_snapshot_path: str | None = None
+    metrics_enabled: bool = False
+    sendgrid_api_key: str | None = dataclasses.field(default=None, repr=False)
+    alert_email_sender: str = "moderation-alerts@example.com"
+    alert_email_background_delivery: bool = True
+    alert_email_queue_size: int = 1000
+    alert_aggregation_window: float = 600
+    alert_category_rate_limit: int = 20
+    alert_global_rate_limit: int = 100
+    alert_rate_limit_period: float = 3600
+
+    @classmethod
+    def from_environ(cls, environ: Mapping[str, str]) -> "ModerationConfig":
+        defaults = cls()
+        return cls(
+            category_thresholds=get_category_thresholds(environ.get("OVERRIDE_MODERATION_THRESHOLDS", "")),
+            deadline=float(environ.get("MODERATION_DEADLINE", defaults.deadline)),
+            retry_initial_backoff=float(
+                environ.get("MODERATION_RETRY_INITIAL_BACKOFF", defaults.retry_initial_backoff),
+            ),
+            retry_max_backoff=float(environ.get("MODERATION_RETRY_MAX_BACKOFF", defaults.retry_max_backoff)),
+            circuit_failure_rate=float(environ.get("MODERATION_CIRCUIT_FAILURE_RATE", defaults.circuit_failure_rate)),
+            circuit_min_calls=int(environ.get("MODERATION_CIRCUIT_MIN_CALLS", defaults.circuit_min_calls)),
+            circuit_window=float(environ.get("MODERATION_CIRCUIT_WINDOW", defaults.circuit_window)),
+            circuit_open_duration=float(
+                environ.get("MODERATION_CIRCUIT_OPEN_DURATION", defaults.circuit_open_duration),
+            ),
+            fallback_mode=environ.get("MODERATION_FALLBACK_MODE", defaults.fallback_mode),
+            max_concurrency=int(environ.get("OPENAI_MODERATION_MAX_CONCURRENCY", defaults.max_concurrency)),
+            batching=get_env_flag(environ, "OPENAI_MODERATION_BATCHING", defaults.batching),
+            batch_max_size=int(environ.get("OPENAI_MODERATION_BATCH_MAX_SIZE", defaults.batch_max_size)),
+            batch_max_wait=float(environ.get("OPENAI_MODERATION_BATCH_MAX_WAIT", defaults.batch_max_wait)),
+            cache_max_size=int(environ.get("MODERATION_CACHE_MAX_SIZE", defaults.cache_max_size)),
+            cache_ttl=float(environ.get("MODERATION_CACHE_TTL", defaults.cache_ttl)),
+            cache_sqlite_path=environ.get("MODERATION_CACHE_SQLITE_PATH") or None,
+            session_state_max_size=int(
+                environ.get("MODERATION_SESSION_STATE_MAX_SIZE", defaults.session_state_max_size)
+            ),
+            session_state_sqlite_path=environ.get("MODERATION_SESSION_STATE_SQLITE_PATH") or None,
+            session_max_strikes=int(environ.get("MODERATION_SESSION_MAX_STRIKES", defaults.session_max_strikes)),
+            session_throttle_duration=float(
+                environ.get("MODERATION_SESSION_THROTTLE_DURATION", defaults.session_throttle_duration),
+            ),
+            session_review_token=environ.get("MODERATION_SESSION_REVIEW_TOKEN") or None,
+            background_remote_scoring=get_env_flag(environ, "MODERATION_BACKGROUND_REMOTE_SCORING"),
+            provider=environ.get("MODERATION_PROVIDER", defaults.provider),
+            local_model_path=environ.get("MODERATION_LOCAL_MODEL_PATH") or None,
+            local_tier=get_env_flag(environ, "MODERATION_LOCAL_TIER"),
+            local_tier_max_score=float(environ.get("MODERATION_LOCAL_TIER_MAX_SCORE", defaults.local_tier_max_score)),
+            word_list_snapshot_path=environ.get("MODERATION_WORD_LIST_SNAPSHOT_PATH") or None,
+            metrics_enabled=get_env_flag(environ, "GUARDRAILS_METRICS_ENABLED", defaults.metrics_enabled),
+            sendgrid_api_key=environ.get("SENDGRID_API_KEY") or None,
+            alert_email_sender=environ.get("ALERT_EMAIL_SENDER", defaults.alert_email_sender),
+            alert_email_background_delivery=get_env_flag(
+                environ,
+                "ALERT_EMAIL_BACKGROUND_DELIVERY",
+                defaults.alert_email_background_delivery,
+            ),
+            alert_email_queue_size=int(environ.get("ALERT_EMAIL_QUEUE_SIZE", defaults.alert_email_queue_size)),
+            alert_aggregation_window=float(environ.get("ALERT_AGGREGATION_WINDOW", defaults.alert_aggregation_window)),
+            alert_category_rate_limit=int(
+                environ.get("ALERT_CATEGORY_RATE_LIMIT", defaults.alert_category_rate_limit),
+            ),
+            alert_global_rate_limit=int(environ.get("ALERT_GLOBAL_RATE_LIMIT", defaults.alert_global_rate_limit)),
+            alert_rate_limit_period=float(environ.get("ALERT_RATE_LIMIT_PERIOD", defaults.alert_rate_limit_period)),
+        )
+
+
+@functools.cache
+def get_config() -> ModerationConfig:
+    """The configuration from os.environ, parsed on first use."""
+    return ModerationConfig.from_environ(os.environ)
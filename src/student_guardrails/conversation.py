@@ -0,0 +1,127 @@
+import logging
+from collections import deque
+from collections.abc import Callable
+
+from student_guardrails import moderation, pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationModerationSession:
+    """Moderates a conversation one turn at a time, with a bounded amount of context per turn.
+
+    Unlike get_input_moderation_data(input_text, previous_messages), which re-moderates the entire conversation,
+    each turn sends only the new message plus the most recent previous messages that fit within context_budget.
+    The budget is measured with length_function: characters by default, but a tokenizer's token count also works.
+    The new message is always sent in full, so a turn never costs more than its own length plus context_budget.
+
+    Scores are combined as follows: for each category, the turn's score is the maximum of
+    (a) the score of the new message moderated with its context window, and
+    (b) history_weight times the highest score of any earlier turn that no longer fits in the context window,
+        either because of later messages or because the new message left no room for it.
+    With the default history_weight of 0, only the context window counts.
+    The combined scores are compared to OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP as usual
+    by apply_input_moderation_rules().
+
+    If activity_session_id or user_id is given, turns from a blocked or throttled session aren't moderated;
+    see moderation.get_session_key().
+    """
+
+    def __init__(
+        self,
+        context_budget: int = 2000,
+        length_function: Callable[[str], int] = len,
+        history_weight: float = 0.0,
+        activity_session_id: str | None = None,
+        user_id: str | None = None,
+    ):
+        self.context_budget = context_budget
+        self.length_function = length_function
+        self.history_weight = history_weight
+        self.session_key = moderation.get_session_key(activity_session_id, user_id)
+        # (message, message length, category scores or None if the message was not moderated)
+        self.context_messages: deque[tuple[str, int, dict[str, float] | None]] = deque()
+        self.context_length = 0
+        # per-category maximum score of moderated messages that have left the context window
+        self.history_max_scores: dict[str, float] = {}
+        self.turn_category_scores: list[dict[str, float] | None] = []
+
+    def add_message(self, message: str, category_scores: dict[str, float] | None = None) -> None:
+        """Add a message to the conversation context without moderating it, e.g. a tutor message."""
+        message_length = self.length_function(message)
+        self.context_messages.append((message, message_length, category_scores))
+        self.context_length += message_length
+        self.evict_messages(self.context_budget)
+
+    def evict_messages(self, budget: int) -> None:
+        """Evict the oldest messages until the context fits in budget, keeping their scores in history_max_scores."""
+        while self.context_length > budget and len(self.context_messages) > 0:
+            _, evicted_length, evicted_scores = self.context_messages.popleft()
+            self.context_length -= evicted_length
+            if evicted_scores is not None:
+                for category, score in evicted_scores.items():
+                    self.history_max_scores[category] = max(score, self.history_max_scores.get(category, 0.0))
+
+    def get_context_window(self, input_text: str) -> list[str]:
+        """The most recent previous messages that fit within the budget remaining after input_text."""
+        remaining_budget = self.context_budget - self.length_function(input_text)
+        window = []
+        for message, message_length, _ in reversed(self.context_messages):
+            if message_length > remaining_budget:
+                break
+            window.append(message)
+            remaining_budget -= message_length
+        window.reverse()
+        return window
+
+    def get_input_moderation_data(self, input_text: str) -> dict:
+        """Moderate the next student message; see moderation.get_input_moderation_data()."""
+        previous_messages = self._prepare_context_window(input_text)
+        context = moderation.get_input_moderation_pipeline().run(
+            input_text,
+            moderation.get_input_moderation_text(input_text, previous_messages),
+            self.session_key,
+        )
+        return self._record_turn(context, previous_messages)
+
+    async def get_input_moderation_data_async(self, input_text: str) -> dict:
+        """Async version of get_input_moderation_data()."""
+        previous_messages = self._prepare_context_window(input_text)
+        context = await moderation.get_input_moderation_pipeline().run_async(
+            input_text,
+            moderation.get_input_moderation_text(input_text, previous_messages),
+            self.session_key,
+        )
+        return self._record_turn(context, previous_messages)
+
+    def combine_category_scores(self, category_scores: dict[str, float]) -> dict[str, float]:
+        if self.history_weight <= 0:
+            return dict(category_scores)
+        return {
+            category: max(score, self.history_weight * self.history_max_scores.get(category, 0.0))
+            for category, score in category_scores.items()
+        }
+
+    def _prepare_context_window(self, input_text: str) -> list[str]:
+        # messages that don't fit alongside input_text are evicted now, so their scores count towards this turn
+        self.evict_messages(self.context_budget - self.length_function(input_text))
+        return self.get_context_window(input_text)
+
+    def _record_turn(self, context: pipeline.ModerationContext, previous_messages: list[str]) -> dict:
+        moderation_result = context.moderation_result
+        window_category_scores = None
+        # no result if the pipeline was decided locally, e.g. by a disallowed word, or if scores were unavailable
+        if moderation_result is not None:
+            window_category_scores = dict(moderation_result["category_scores"])
+            moderation_result["window_category_scores"] = window_category_scores
+            moderation_result["category_scores"] = self.combine_category_scores(window_category_scores)
+        self.turn_category_scores.append(window_category_scores)
+        self.add_message(context.text, window_category_scores)
+        return {
+            "disallowed_words_in_input": sorted(context.disallowed_words),
+            "openai_moderation_result": moderation_result,
+            "moderation_stage": context.decided_by,
+            "moderation_unavailable": context.moderation_unavailable,
+            "session_status": context.session_status,
+            "context_message_count": len(previous_messages),
+        }
@@ -1,18 +1,29 @@
+import atexit
+import functools
 import json
 import logging
-import os
+import queue
+import threading
+import time
 from datetime import datetime, timezone
+from typing import TYPE_CHECKING
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from student_guardrails import config, metrics
+
+if TYPE_CHECKING:
+    # sendgrid is imported on first send, since most processes never send an alert email
+    from sendgrid import SendGridAPIClient
 
 logger = logging.getLogger(__name__)
 
 
 DATA_DASHBOARD_BASE_URL = "https://localhost/"
-SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY")
-ALERT_EMAIL_SENDER = os.environ.get("ALERT_EMAIL_SENDER", "moderation-alerts@example.com")
+SENDGRID_API_KEY = config.get_config().sendgrid_api_key
+ALERT_EMAIL_SENDER = config.get_config().alert_email_sender
 ALERT_EMAIL_RECIPIENTS = "example@example.com,example2@example.com"
+# when enabled, alert emails are sent by a background thread so that moderation doesn't wait on SendGrid
+ALERT_EMAIL_BACKGROUND_DELIVERY = config.get_config().alert_email_background_delivery
+ALERT_EMAIL_QUEUE_SIZE = config.get_config().alert_email_queue_size
 
 
 def create_alert_email(moderation_data: dict) -> tuple[str, str]:
@@ -54,12 +65,61 @@ def create_alert_email(moderation_data: dict) -> tuple[str, str]:
     return subject, content
 
 
+def create_alert_digest_email(activity_session_id: str, alerts: list[dict]) -> tuple[str, str]:
+    """Create a single email summarizing follow-up alerts from one activity session.
+
+    Args:
+        alerts (list[dict]): moderation data, as passed to create_alert_email(), with an added "alert_time" datetime.
+    """
+    date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    category_counts = {}
+    for alert in alerts:
+        category = alert.get("category", "unknown")
+        category_counts[category] = category_counts.get(category, 0) + 1
+    categories_str = ", ".join(f"{category} ({count})" for category, count in category_counts.items())
+    subject = f"Rori moderation alert digest: {len(alerts)} follow-up alerts ({date_str})"
+
+    url = DATA_DASHBOARD_BASE_URL + "/Public_Line"
+    query_params = (
+        f"?menu_index=4&gdwi=0&gf0column=message__activity_session__id&gf0value={activity_session_id}&gf0function="
+    )
+    delvin_url = url + query_params
+
+    alert_lines = []
+    for alert in alerts:
+        alert_time = alert.get("alert_time")
+        alert_time_str = alert_time.isoformat() if alert_time is not None else "unknown"
+        alert_lines.append(
+            f"{alert_time_str} - {alert.get('category', 'unknown')}: \"{alert.get('input_message', '')}\"",
+        )
+    content = (
+        f"Activity session: {activity_session_id}"
+        "<br><br>"
+        f"Categories: {categories_str}"
+        "<br><br>"
+        f"Messages that triggered alerts:<br>&nbsp;{'<br>&nbsp;'.join(alert_lines)}"
+        "<br><br>"
+        f"View in the Rori data dashboard: {delvin_url}<br>"
+    )
+    return subject, content
+
+
+@functools.cache
+def get_sendgrid_client(api_key: str) -> "SendGridAPIClient":
+    """Shared client, so that connections are reused across alert emails."""
+    import sendgrid
+
+    return sendgrid.SendGridAPIClient(api_key)
+
+
 def send_alert_email(subject: str, content: str) -> bool:
     if not SENDGRID_API_KEY or len(ALERT_EMAIL_RECIPIENTS) == 0:
         logger.warning(
             f"Would have sent alert email, but configuration invalid. Configured recipients: {ALERT_EMAIL_RECIPIENTS}",
         )
         return False
+    from sendgrid.helpers.mail import Mail
+
     message = Mail(
         from_email=ALERT_EMAIL_SENDER,
         to_emails=ALERT_EMAIL_RECIPIENTS,
@@ -67,8 +127,12 @@ def send_alert_email(subject: str, content: str) -> bool:
         html_content=content,
     )
     try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
+        sg = get_sendgrid_client(SENDGRID_API_KEY)
+        with metrics.timer(
+            "guardrails_alert_email_send_duration_seconds",
+            error_counter="guardrails_alert_email_send_errors_total",
+        ):
+            response = sg.send(message)
         if response.status_code >= 200 and response.status_code < 300:
             logger.info(f"Successfully sent alert email, receiving status code {response.status_code}.")
         else:
@@ -76,3 +140,136 @@ def send_alert_email(subject: str, content: str) -> bool:
         return True
     except Exception as e:
         raise e
+
+
+class AlertDispatcher:
+    """Sends alert emails from a bounded queue on a background thread.
+
+    Failed sends are retried with exponential backoff. If the queue is full, new alerts are dropped (and logged).
+    Call shutdown() to deliver any queued alerts and stop the worker; this is done automatically at exit.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 1000,
+        max_attempts: int = 5,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.dropped_count = 0
+        self.delivered_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+        self.delivery_latency_total = 0.0
+        self.delivery_latency_max = 0.0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self._thread.start()
+
+    def dispatch(self, subject: str, content: str) -> bool:
+        """Queue an alert email for delivery. Returns False if the alert was dropped."""
+        self.start()
+        try:
+            self._queue.put_nowait((subject, content, time.monotonic()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped_count += 1
+            metrics.increment("guardrails_alert_emails_total", result="dropped")
+            logger.error(f"Alert email queue is full; dropped alert email: {subject}")
+            return False
+
+    def join(self) -> None:
+        """Wait until every queued alert has been delivered or has failed."""
+        self._queue.join()
+
+    def shutdown(self, timeout: float | None = 30) -> None:
+        """Deliver queued alerts, then stop the worker thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        delivery_count = self.delivered_count + self.failed_count
+        return {
+            "queue_depth": self._queue.qsize(),
+            "dropped": self.dropped_count,
+            "delivered": self.delivered_count,
+            "failed": self.failed_count,
+            "retries": self.retry_count,
+            "delivery_latency_mean": self.delivery_latency_total / delivery_count if delivery_count > 0 else 0.0,
+            "delivery_latency_max": self.delivery_latency_max,
+        }
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                subject, content, enqueued_at = item
+                delivered = self._deliver(subject, content)
+                latency = time.monotonic() - enqueued_at
+                with self._lock:
+                    if delivered:
+                        self.delivered_count += 1
+                    else:
+                        self.failed_count += 1
+                    self.delivery_latency_total += latency
+                    self.delivery_latency_max = max(latency, self.delivery_latency_max)
+                metrics.increment("guardrails_alert_emails_total", result="delivered" if delivered else "failed")
+                metrics.observe("guardrails_alert_email_delivery_latency_seconds", latency)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, subject: str, content: str) -> bool:
+        backoff = self.initial_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return send_alert_email(subject, content)
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logger.error(f"Failed to send alert email after {attempt} attempts: {e!r}")
+                    return False
+                logger.warning(f"Failed to send alert email (attempt {attempt}), retrying in {backoff}s: {e!r}")
+                with self._lock:
+                    self.retry_count += 1
+                metrics.increment("guardrails_alert_email_retries_total")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        return False
+
+
+_alert_dispatcher: AlertDispatcher | None = None
+
+
+def get_alert_dispatcher() -> AlertDispatcher:
+    global _alert_dispatcher
+    if _alert_dispatcher is None:
+        _alert_dispatcher = AlertDispatcher(max_queue_size=ALERT_EMAIL_QUEUE_SIZE)
+        atexit.register(_alert_dispatcher.shutdown)
+    return _alert_dispatcher
+
+
+def dispatch_alert_email(subject: str, content: str) -> bool:
+    """Send an alert email without waiting for delivery, unless ALERT_EMAIL_BACKGROUND_DELIVERY is disabled.
+
+    Returns:
+        bool: False if the alert email was dropped or (when sent inline) not sent.
+    """
+    if not ALERT_EMAIL_BACKGROUND_DELIVERY:
+        delivered = send_alert_email(subject, content)
+        metrics.increment("guardrails_alert_emails_total", result="delivered" if delivered else "failed")
+        return delivered
+    return get_alert_dispatcher().dispatch(subject, content)
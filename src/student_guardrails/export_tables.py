@@ -0,0 +1,194 @@
+"""Load Django dump exports (e.g. supabase_staging.jsonl) as one DataFrame per model.
+
+Usage:
+    dfs = export_tables.load_export_tables(DATA_DIR / "raw" / "supabase_staging.jsonl")
+    dfs["message"]
+
+Records look like {"model": "<app>.<model>", "pk": ..., "fields": {...}}; each model's table has the fields as columns,
+plus "pk". Dict-valued fields listed in flatten_fields are expanded into one column per key, prefixed with the field
+name (e.g. properties_topic).
+
+The file is streamed, and records are converted to DataFrames chunk_size records at a time, so the raw file is never
+held in memory. If pyarrow is installed, the tables are cached as Parquet, keyed on a hash of the file's contents
+and the loading options; later loads of the same file read the cache instead.
+"""
+
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+from collections.abc import Iterable
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# bump when the table format changes, to invalidate existing caches
+EXPORT_TABLES_VERSION = 1
+DEFAULT_FLATTEN_FIELDS = {
+    "user": ["properties"],
+    "activitysession": ["properties"],
+}
+DEFAULT_CACHE_DIR_NAME = ".export_tables_cache"
+MANIFEST_FILENAME = "manifest.json"
+
+
+def get_file_hash(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as infile:
+        while chunk := infile.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def flatten_column(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """Replace a column of dicts with one column per key, named f"{column}_{key}"; non-dict values become NaN."""
+    values = [value if isinstance(value, dict) else {} for value in df[column]]
+    flat_df = pd.DataFrame.from_records(values, index=df.index)
+    flat_df = flat_df.rename(columns=lambda key: f"{column}_{key}")
+    return pd.concat([df.drop(columns=column), flat_df], axis=1)
+
+
+def parse_datetime_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse string columns named like created_at as UTC datetimes."""
+    for column in df.columns:
+        if column.endswith("_at") and df[column].dtype == object:
+            df[column] = pd.to_datetime(df[column], utc=True, format="ISO8601")
+    return df
+
+
+class ExportTableBuilder:
+    """Accumulates one model's records, converting them to a DataFrame every chunk_size records."""
+
+    def __init__(self, flatten_fields: Iterable[str], chunk_size: int):
+        self.flatten_fields = list(flatten_fields)
+        self.chunk_size = chunk_size
+        self.rows: list[dict] = []
+        self.chunks: list[pd.DataFrame] = []
+
+    def add(self, record: dict) -> None:
+        self.rows.append({**record["fields"], "pk": record.get("pk")})
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.rows) == 0:
+            return
+        df = pd.DataFrame.from_records(self.rows)
+        for field in self.flatten_fields:
+            if field in df.columns:
+                df = flatten_column(df, field)
+        self.chunks.append(df)
+        self.rows = []
+
+    def get_table(self) -> pd.DataFrame:
+        self.flush()
+        df = pd.concat(self.chunks, ignore_index=True) if len(self.chunks) > 1 else self.chunks[0]
+        # chunks may disagree on types, e.g. an int column that is all-missing in one chunk
+        return df.infer_objects()
+
+
+def read_export_tables(
+    path: str | Path,
+    flatten_fields: dict[str, list[str]] = DEFAULT_FLATTEN_FIELDS,
+    parse_datetimes: bool = False,
+    chunk_size: int = 50_000,
+) -> dict[str, pd.DataFrame]:
+    """Read the export without any caching; see load_export_tables()."""
+    builders: dict[str, ExportTableBuilder] = {}
+    skipped_count = 0
+    with open(path, "rb") as infile:
+        for line in infile:
+            if line.strip() == b"":
+                continue
+            record = json.loads(line)
+            if "model" not in record or not isinstance(record.get("fields"), dict):
+                skipped_count += 1
+                continue
+            model = record["model"].split(".")[-1]
+            if model not in builders:
+                builders[model] = ExportTableBuilder(flatten_fields.get(model, []), chunk_size)
+            builders[model].add(record)
+    if skipped_count > 0:
+        logger.warning(f"Skipped {skipped_count} records in {path} without a model and fields.")
+    tables = {model: builder.get_table() for model, builder in builders.items()}
+    if parse_datetimes:
+        tables = {model: parse_datetime_columns(df) for model, df in tables.items()}
+    return tables
+
+
+def is_parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def get_cache_key(path: str | Path, flatten_fields: dict[str, list[str]], parse_datetimes: bool) -> str:
+    options = json.dumps(
+        {"version": EXPORT_TABLES_VERSION, "flatten_fields": flatten_fields, "parse_datetimes": parse_datetimes},
+        sort_keys=True,
+    )
+    return hashlib.sha256((get_file_hash(path) + options).encode("utf-8")).hexdigest()
+
+
+def read_cached_tables(cache_path: Path) -> dict[str, pd.DataFrame] | None:
+    manifest_path = cache_path / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as infile:
+        manifest = json.load(infile)
+    return {model: pd.read_parquet(cache_path / f"{model}.parquet") for model in manifest["models"]}
+
+
+def write_cached_tables(cache_path: Path, tables: dict[str, pd.DataFrame]) -> None:
+    """Write to a temporary directory, then rename it, so an interrupted write never leaves a partial cache."""
+    temporary_path = cache_path.with_name(cache_path.name + ".tmp")
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    temporary_path.mkdir(parents=True)
+    try:
+        for model, df in tables.items():
+            df.to_parquet(temporary_path / f"{model}.parquet", index=False)
+        with open(temporary_path / MANIFEST_FILENAME, "w") as outfile:
+            json.dump({"models": list(tables.keys())}, outfile)
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.replace(temporary_path, cache_path)
+    except Exception:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+
+
+def load_export_tables(
+    path: str | Path,
+    flatten_fields: dict[str, list[str]] = DEFAULT_FLATTEN_FIELDS,
+    parse_datetimes: bool = False,
+    cache_dir: str | Path | None = None,
+    use_cache: bool = True,
+    chunk_size: int = 50_000,
+) -> dict[str, pd.DataFrame]:
+    """Load the export at path as {model name: DataFrame}, using the Parquet cache if possible.
+
+    Args:
+        flatten_fields (dict[str, list[str]]): For each model, the dict-valued fields to expand into columns.
+        parse_datetimes (bool): If True, string columns named like created_at are parsed as UTC datetimes.
+        cache_dir (str | Path | None): Where to keep cached tables; by default, a directory next to the export.
+        use_cache (bool): If False, the cache is neither read nor written.
+    """
+    path = Path(path)
+    if not use_cache or not is_parquet_available():
+        if use_cache:
+            logger.info("pyarrow is not installed, so export tables won't be cached.")
+        return read_export_tables(path, flatten_fields, parse_datetimes, chunk_size)
+    cache_dir = path.parent / DEFAULT_CACHE_DIR_NAME if cache_dir is None else Path(cache_dir)
+    cache_path = cache_dir / f"{path.stem}-{get_cache_key(path, flatten_fields, parse_datetimes)[:16]}"
+    tables = read_cached_tables(cache_path)
+    if tables is not None:
+        logger.info(f"Loaded {path} from the cache at {cache_path}.")
+        return tables
+    tables = read_export_tables(path, flatten_fields, parse_datetimes, chunk_size)
+    try:
+        write_cached_tables(cache_path, tables)
+    except Exception as e:
+        # e.g. a column mixing types that Parquet can't represent
+        logger.warning(f"Failed to cache the tables for {path}: {e!r}")
+    return tables
@@ -0,0 +1,216 @@
+"""A local stand-in for the OpenAI Moderation API, for benchmarks and integration tests.
+
+Usage:
+    python -m student_guardrails.fake_moderation_server --port 8089 --latency 0.05 --jitter 0.02 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake-api-key python ...
+
+Scores are 0.001 for every category, unless the input contains e.g. "violence=0.9".
+Each request waits latency +/- jitter seconds (uniformly), then fails with a 429 with probability rate_limit_rate,
+or with a 500 with probability error_rate.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODERATION_CATEGORIES = [
+    "harassment",
+    "harassment/threatening",
+    "hate",
+    "hate/threatening",
+    "illicit",
+    "illicit/violent",
+    "self-harm",
+    "self-harm/instructions",
+    "self-harm/intent",
+    "sexual",
+    "sexual/minors",
+    "violence",
+    "violence/graphic",
+]
+DEFAULT_SCORE = 0.001
+SCORE_OVERRIDE_PATTERN = re.compile(r"([a-z/-]+)=(\d*\.\d+)")
+
+
+def get_moderation_result(input: str) -> dict:
+    category_scores = {category: DEFAULT_SCORE for category in MODERATION_CATEGORIES}
+    for category, score in SCORE_OVERRIDE_PATTERN.findall(input):
+        if category in category_scores:
+            category_scores[category] = float(score)
+    categories = {category: score >= 0.5 for category, score in category_scores.items()}
+    return {
+        "flagged": any(categories.values()),
+        "categories": categories,
+        "category_scores": category_scores,
+        "category_applied_input_types": {category: ["text"] for category in MODERATION_CATEGORIES},
+    }
+
+
+class FakeModerationRequestHandler(BaseHTTPRequestHandler):
+    # keep connections open between requests, like the real API
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately; without this, Nagle's algorithm adds ~40ms to every response
+    disable_nagle_algorithm = True
+    server: "FakeModerationHTTPServer"
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/v1/moderations":
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        fake_server = self.server.fake_server
+        status = fake_server.simulate_request()
+        if status == 429:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (simulated).", "type": "requests", "code": "rate_limit"}},
+                {"Retry-After": f"{fake_server.retry_after:g}"},
+            )
+            return
+        if status == 500:
+            self._send_json(500, {"error": {"message": "Internal server error (simulated).", "type": "server_error"}})
+            return
+        inputs = json.loads(body).get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self._send_json(
+            200,
+            {
+                "id": f"modr-{uuid.uuid4().hex}",
+                "model": "text-moderation-fake",
+                "results": [get_moderation_result(input) for input in inputs],
+            },
+        )
+
+    def _send_json(self, status: int, content: dict, headers: dict[str, str] | None = None) -> None:
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FakeModerationHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    fake_server: "FakeModerationServer"
+
+
+class FakeModerationServer:
+    """Runs the fake API on a background thread; port 0 picks a free port.
+
+    Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.1,
+        seed: int | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._http_server: FakeModerationHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+        self.request_count = 0
+        self.status_counts: dict[int, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        """The value for OPENAI_BASE_URL."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def simulate_request(self) -> int:
+        """Wait for the simulated latency, then return the status code to respond with."""
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            outcome = self._random.random()
+        time.sleep(delay)
+        if outcome < self.rate_limit_rate:
+            status = 429
+        elif outcome < self.rate_limit_rate + self.error_rate:
+            status = 500
+        else:
+            status = 200
+        with self._lock:
+            self.request_count += 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return status
+
+    def start(self) -> str:
+        """Start serving; returns base_url."""
+        self._http_server = FakeModerationHTTPServer((self.host, self.port), FakeModerationRequestHandler)
+        self._http_server.fake_server = self
+        self.port = self._http_server.server_address[1]
+        self._thread = threading.Thread(target=self._http_server.serve_forever, name="fake-moderation", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._thread.join()
+            self._http_server = None
+
+    def __enter__(self) -> "FakeModerationServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI Moderation API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response time in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Response times vary uniformly by this much.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with a 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests that get a 429.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = FakeModerationServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+    print(f"Serving a fake moderation API at {server.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
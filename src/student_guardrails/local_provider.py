@@ -0,0 +1,320 @@
+"""LocalModerationProvider, a hashed n-gram linear model that runs in-process, trained on stored OpenAI scores.
+
+It's meant as a cheap first tier (see pipeline.LocalScoringStage), not as a replacement for the remote API.
+
+Usage:
+    python -m student_guardrails.local_provider data/derived/scored_messages.jsonl models/local_moderation.npz
+
+Training records need a text ("text" or "input_message") and its scores: "category_scores",
+"openai_moderation_result", or "input_moderation_data" (as in alert moderation data).
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import re
+import time
+import zlib
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from student_guardrails import providers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_FEATURES = 2**16
+TOKEN_PATTERN = re.compile(r"\w+")
+CHAR_NGRAM_SIZES = (3, 4)
+MODEL_FORMAT_VERSION = 1
+
+
+def get_hash(feature: str, n_features: int) -> int:
+    # zlib.crc32 rather than hash(), which differs between processes
+    return zlib.crc32(feature.encode("utf-8")) % n_features
+
+
+@functools.lru_cache(maxsize=65536)
+def get_token_feature_indices(token: str, n_features: int) -> tuple[int, ...]:
+    """The word feature and character n-gram features of one token; cached, since vocabularies are small."""
+    padded_token = f" {token} "
+    indices = [get_hash("w:" + token, n_features)]
+    for n in CHAR_NGRAM_SIZES:
+        for i in range(len(padded_token) - n + 1):
+            indices.append(get_hash("c:" + padded_token[i : i + n], n_features))
+    return tuple(indices)
+
+
+def get_feature_indices(text: str, n_features: int = DEFAULT_N_FEATURES) -> list[int]:
+    """Hashed word unigrams and bigrams and character 3- and 4-grams; character n-grams catch misspellings."""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    indices = []
+    for token in tokens:
+        indices.extend(get_token_feature_indices(token, n_features))
+    for first_token, second_token in zip(tokens, tokens[1:]):
+        indices.append(get_hash(f"b:{first_token} {second_token}", n_features))
+    return indices
+
+
+def get_feature_matrix(texts: list[str], n_features: int = DEFAULT_N_FEATURES) -> tuple[np.ndarray, ...]:
+    """Sparse features for the texts, in CSR form.
+
+    Values are log(1 + count), scaled to unit length per text.
+
+    Returns:
+        np.ndarray: indptr; the features of text i are at positions indptr[i] to indptr[i + 1]
+        np.ndarray: indices, the feature index at each position
+        np.ndarray: values, the feature value at each position
+    """
+    indptr = [0]
+    all_indices = []
+    all_values = []
+    for text in texts:
+        indices, counts = np.unique(np.array(get_feature_indices(text, n_features), dtype=np.int64), return_counts=True)
+        values = np.log1p(counts).astype(np.float32)
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        all_indices.append(indices)
+        all_values.append(values)
+        indptr.append(indptr[-1] + len(indices))
+    return (
+        np.array(indptr, dtype=np.int64),
+        np.concatenate(all_indices) if len(all_indices) > 0 else np.zeros(0, dtype=np.int64),
+        np.concatenate(all_values) if len(all_values) > 0 else np.zeros(0, dtype=np.float32),
+    )
+
+
+def get_sparse_product(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    values: np.ndarray,
+    weights: np.ndarray,
+) -> np.ndarray:
+    """The feature matrix times weights, shape (n_texts, weights.shape[1])."""
+    lengths = np.diff(indptr)
+    output = np.zeros((len(lengths), weights.shape[1]), dtype=np.float32)
+    nonempty = lengths > 0
+    if nonempty.any():
+        contributions = values[:, np.newaxis] * weights[indices]
+        output[nonempty] = np.add.reduceat(contributions, indptr[:-1][nonempty], axis=0)
+    return output
+
+
+def get_rows(indptr: np.ndarray, indices: np.ndarray, values: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, ...]:
+    """The given rows of a CSR feature matrix, as a new CSR feature matrix."""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    row_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    positions = np.repeat(starts - row_indptr[:-1], lengths) + np.arange(row_indptr[-1])
+    return row_indptr, indices[positions], values[positions]
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+class LocalModerationProvider(providers.ModerationProvider):
+    """One logistic regression per category over hashed n-gram features, fit to OpenAI scores as soft labels.
+
+    Scoring a short message takes tens of microseconds.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, categories: list[str]):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.categories = list(categories)
+        self.n_features = self.weights.shape[0]
+        weights_hash = hashlib.sha256(self.weights.tobytes() + self.bias.tobytes()).hexdigest()
+        self.model = f"local-hashed-ngram-{weights_hash[:12]}"
+
+    def score_batch(self, inputs: list[str]) -> list[dict]:
+        start_time = time.perf_counter()
+        scores = self.get_scores(inputs)
+        request_duration = (time.perf_counter() - start_time) / max(len(inputs), 1)
+        outputs = []
+        for row in scores.tolist():
+            category_scores = dict(zip(self.categories, row))
+            categories = {category: score >= 0.5 for category, score in category_scores.items()}
+            outputs.append(
+                {
+                    "flagged": any(categories.values()),
+                    "categories": categories,
+                    "category_scores": category_scores,
+                    "request_duration": request_duration,
+                    "model": self.model,
+                },
+            )
+        return outputs
+
+    def get_scores(self, texts: list[str]) -> np.ndarray:
+        """Scores as an array of shape (len(texts), len(self.categories))."""
+        indptr, indices, values = get_feature_matrix(texts, self.n_features)
+        return sigmoid(get_sparse_product(indptr, indices, values, self.weights) + self.bias)
+
+    @classmethod
+    def train(
+        cls,
+        texts: list[str],
+        category_scores: list[dict[str, float]],
+        categories: list[str] | None = None,
+        n_features: int = DEFAULT_N_FEATURES,
+        epochs: int = 10,
+        batch_size: int = 256,
+        learning_rate: float = 0.5,
+        l2: float = 1e-6,
+        seed: int = 0,
+    ) -> "LocalModerationProvider":
+        """Fit to the given scores with minibatch Adagrad on binary cross-entropy.
+
+        Categories default to every category in category_scores, in order of first appearance.
+        """
+        if categories is None:
+            categories = list(dict.fromkeys(category for scores in category_scores for category in scores))
+        targets = np.array(
+            [[scores.get(category, 0.0) for category in categories] for scores in category_scores],
+            dtype=np.float32,
+        ).reshape(-1, len(categories))
+        indptr, indices, values = get_feature_matrix(texts, n_features)
+        weights = np.zeros((n_features, len(categories)), dtype=np.float32)
+        # starting from the mean score makes the rare positive categories converge much faster
+        mean_targets = np.clip(targets.mean(axis=0), 1e-6, 1 - 1e-6) if len(texts) > 0 else 0.5
+        bias = np.log(mean_targets / (1 - mean_targets)).astype(np.float32)
+        weight_gradient_sums = np.full_like(weights, 1e-8)
+        bias_gradient_sums = np.full_like(bias, 1e-8)
+        rng = np.random.default_rng(seed)
+        for epoch in range(epochs):
+            order = rng.permutation(len(texts))
+            for start in range(0, len(texts), batch_size):
+                rows = order[start : start + batch_size]
+                batch_indptr, batch_indices, batch_values = get_rows(indptr, indices, values, rows)
+                predictions = sigmoid(get_sparse_product(batch_indptr, batch_indices, batch_values, weights) + bias)
+                logit_gradient = (predictions - targets[rows]) / len(rows)
+                # only the features present in the batch are updated
+                unique_indices, inverse = np.unique(batch_indices, return_inverse=True)
+                row_ids = np.repeat(np.arange(len(rows)), np.diff(batch_indptr))
+                contributions = batch_values[:, np.newaxis] * logit_gradient[row_ids]
+                weight_gradient = np.stack(
+                    [
+                        np.bincount(inverse, weights=contributions[:, i], minlength=len(unique_indices))
+                        for i in range(len(categories))
+                    ],
+                    axis=1,
+                ).astype(np.float32)
+                weight_gradient += l2 * weights[unique_indices]
+                weight_gradient_sums[unique_indices] += weight_gradient**2
+                weights[unique_indices] -= (
+                    learning_rate * weight_gradient / np.sqrt(weight_gradient_sums[unique_indices])
+                )
+                bias_gradient = logit_gradient.sum(axis=0)
+                bias_gradient_sums += bias_gradient**2
+                bias -= learning_rate * bias_gradient / np.sqrt(bias_gradient_sums)
+            logger.debug(f"Finished epoch {epoch + 1} of {epochs}.")
+        return cls(weights, bias, categories)
+
+    def save(self, path: str | Path) -> None:
+        with open(path, "wb") as outfile:
+            np.savez_compressed(
+                outfile,
+                version=np.array(MODEL_FORMAT_VERSION),
+                weights=self.weights,
+                bias=self.bias,
+                categories=np.array(self.categories),
+            )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "LocalModerationProvider":
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != MODEL_FORMAT_VERSION:
+                raise ValueError(f"{path} has model format version {int(data['version'])}, not {MODEL_FORMAT_VERSION}.")
+            return cls(data["weights"], data["bias"], data["categories"].tolist())
+
+
+def get_training_example(record: dict) -> tuple[str, dict[str, float]] | None:
+    """The text and category scores of a stored record, or None if it doesn't have both."""
+    text = record.get("text", record.get("input_message"))
+    if "category_scores" in record:
+        category_scores = record["category_scores"]
+    else:
+        moderation_result = record.get("openai_moderation_result")
+        if moderation_result is None and record.get("input_moderation_data") is not None:
+            moderation_result = record["input_moderation_data"].get("openai_moderation_result")
+        category_scores = moderation_result.get("category_scores") if moderation_result is not None else None
+    if not isinstance(text, str) or category_scores is None:
+        return None
+    return text, category_scores
+
+
+def read_training_examples(records: Iterable[dict]) -> tuple[list[str], list[dict[str, float]]]:
+    texts = []
+    category_scores = []
+    for record in records:
+        example = get_training_example(record)
+        if example is not None:
+            texts.append(example[0])
+            category_scores.append(example[1])
+    return texts, category_scores
+
+
+def get_tier_summary(local_scores: np.ndarray, remote_scores: np.ndarray, max_scores: list[float]) -> list[dict]:
+    """For each candidate local tier max_score: the fraction of messages it would decide without the remote API,
+    and how many of those the remote API scored at 0.5 or above in some category.
+    """
+    local_max = local_scores.max(axis=1)
+    remote_flagged = remote_scores.max(axis=1) >= 0.5
+    summary = []
+    for max_score in max_scores:
+        decided_locally = local_max < max_score
+        summary.append(
+            {
+                "max_score": max_score,
+                "decided_locally": float(decided_locally.mean()) if len(local_max) > 0 else 0.0,
+                "missed_flagged": int((decided_locally & remote_flagged).sum()),
+            },
+        )
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Train a local moderation model on stored moderation scores.")
+    parser.add_argument("input_path", type=Path, help="JSONL file of records with text and scores.")
+    parser.add_argument("model_path", type=Path, help="Where to save the model (.npz).")
+    parser.add_argument("--n-features", type=int, default=DEFAULT_N_FEATURES)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--holdout", type=float, default=0.1, help="Fraction of records to evaluate on.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.input_path) as infile:
+        texts, category_scores = read_training_examples(json.loads(line) for line in infile if line.strip() != "")
+    order = np.random.default_rng(args.seed).permutation(len(texts))
+    n_holdout = int(len(texts) * args.holdout)
+    holdout_rows, train_rows = order[:n_holdout], order[n_holdout:]
+    logger.info(f"Training on {len(train_rows)} records, evaluating on {n_holdout}.")
+    provider = LocalModerationProvider.train(
+        [texts[i] for i in train_rows],
+        [category_scores[i] for i in train_rows],
+        n_features=args.n_features,
+        epochs=args.epochs,
+        seed=args.seed,
+    )
+    provider.save(args.model_path)
+    logger.info(f"Saved model {provider.model} to {args.model_path}.")
+    if n_holdout > 0:
+        local_scores = provider.get_scores([texts[i] for i in holdout_rows])
+        remote_scores = np.array(
+            [[category_scores[i].get(category, 0.0) for category in provider.categories] for i in holdout_rows],
+        )
+        for row in get_tier_summary(local_scores, remote_scores, [0.001, 0.005, 0.01, 0.05, 0.1]):
+            logger.info(
+                f"max_score={row['max_score']:g}: {row['decided_locally']:.1%} decided locally, "
+                f"{row['missed_flagged']} of them flagged by the remote scores",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Counters and latency histograms for the moderation hot path.
+
+Metrics are disabled by default; set GUARDRAILS_METRICS_ENABLED=true or call enable().
+While disabled, increment(), observe(), and timer() return immediately, so instrumented code pays only a function call.
+
+Read metrics in-process with get_snapshot(), or register exporters and call export_metrics():
+
+    metrics.enable()
+    metrics.register_exporter(metrics.PrometheusTextExporter("/var/lib/node_exporter/guardrails.prom"))
+    ...
+    metrics.export_metrics()
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+
+from student_guardrails import config
+
+logger = logging.getLogger(__name__)
+
+GUARDRAILS_METRICS_ENABLED = config.get_config().metrics_enabled
+# upper bounds in seconds, from a fast local check up to a slow retried API request
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # one count per bucket, plus a final count for values above the largest bucket
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters and histograms, each identified by a name and a set of labels."""
+
+    def __init__(self):
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._histograms: dict[tuple[str, tuple[tuple[str, str], ...]], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1.0, labels: dict[str, str] | None = None) -> None:
+        key = (name, get_label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: dict[str, str] | None = None,
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        key = (name, get_label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def get_counter_value(self, name: str, labels: dict[str, str] | None = None) -> float:
+        with self._lock:
+            return self._counters.get((name, get_label_key(labels)), 0.0)
+
+    def get_snapshot(self) -> dict:
+        """A copy of all metrics.
+
+        Returns:
+            dict: {"counters": {name: [{"labels": dict, "value": float}]},
+                "histograms": {name: [{"labels": dict, "buckets": list, "bucket_counts": list, "sum", "count"}]}}.
+                bucket_counts are not cumulative, and have one more entry than buckets (for larger values).
+        """
+        snapshot = {"counters": {}, "histograms": {}}
+        with self._lock:
+            for (name, label_key), value in sorted(self._counters.items()):
+                snapshot["counters"].setdefault(name, []).append({"labels": dict(label_key), "value": value})
+            for (name, label_key), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                snapshot["histograms"].setdefault(name, []).append(
+                    {
+                        "labels": dict(label_key),
+                        "buckets": list(histogram.buckets),
+                        "bucket_counts": list(histogram.bucket_counts),
+                        "sum": histogram.sum,
+                        "count": histogram.count,
+                    },
+                )
+        return snapshot
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def get_label_key(labels: dict[str, str] | None) -> tuple[tuple[str, str], ...]:
+    if not labels:
+        return ()
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Timer:
+    """Context manager that records its duration in a histogram, and counts any exception by type."""
+
+    def __init__(self, name: str, error_counter: str | None, labels: dict[str, str]):
+        self.name = name
+        self.error_counter = error_counter
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _registry.observe(self.name, time.perf_counter() - self.start_time, self.labels)
+        if exc_type is not None and self.error_counter is not None:
+            _registry.increment(self.error_counter, labels={**self.labels, "error": exc_type.__name__})
+
+
+class NullTimer:
+    def __enter__(self) -> "NullTimer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NULL_TIMER = NullTimer()
+_registry = MetricsRegistry()
+_enabled = GUARDRAILS_METRICS_ENABLED
+_exporters: list["MetricsExporter"] = []
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+def increment(name: str, value: float = 1.0, **labels: str) -> None:
+    if not _enabled:
+        return
+    _registry.increment(name, value, labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    if not _enabled:
+        return
+    _registry.observe(name, value, labels)
+
+
+def timer(name: str, error_counter: str | None = None, **labels: str) -> Timer | NullTimer:
+    """Time a block of code: `with metrics.timer("guardrails_..._seconds", stage="cache"): ...`
+
+    If error_counter is given, an exception raised in the block increments that counter, with an added "error" label.
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return Timer(name, error_counter, labels)
+
+
+def get_snapshot() -> dict:
+    """See MetricsRegistry.get_snapshot()."""
+    return _registry.get_snapshot()
+
+
+def reset() -> None:
+    _registry.reset()
+
+
+class MetricsExporter:
+    """Base class for exporters; export() receives a snapshot from get_snapshot()."""
+
+    def export(self, snapshot: dict) -> None:
+        raise NotImplementedError()
+
+
+def format_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{key}="{format_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_prometheus_text(snapshot: dict) -> str:
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, samples in snapshot["counters"].items():
+        lines.append(f"# TYPE {name} counter")
+        for sample in samples:
+            lines.append(f"{name}{format_labels(sample['labels'])} {sample['value']:g}")
+    for name, samples in snapshot["histograms"].items():
+        lines.append(f"# TYPE {name} histogram")
+        for sample in samples:
+            cumulative_count = 0
+            for bucket, bucket_count in zip(sample["buckets"] + ["+Inf"], sample["bucket_counts"]):
+                cumulative_count += bucket_count
+                le = bucket if bucket == "+Inf" else f"{bucket:g}"
+                lines.append(f"{name}_bucket{format_labels({**sample['labels'], 'le': le})} {cumulative_count}")
+            lines.append(f"{name}_sum{format_labels(sample['labels'])} {sample['sum']:g}")
+            lines.append(f"{name}_count{format_labels(sample['labels'])} {sample['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusTextExporter(MetricsExporter):
+    """Writes metrics in the Prometheus text format, e.g. for the node_exporter textfile collector.
+
+    With no path, export() only keeps the text in self.text, e.g. to be returned from a /metrics endpoint.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.text = ""
+
+    def export(self, snapshot: dict) -> None:
+        self.text = format_prometheus_text(snapshot)
+        if self.path is not None:
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w") as outfile:
+                outfile.write(self.text)
+            os.replace(temporary_path, self.path)
+
+
+def register_exporter(exporter: MetricsExporter) -> None:
+    _exporters.append(exporter)
+
+
+def unregister_exporter(exporter: MetricsExporter) -> None:
+    _exporters.remove(exporter)
+
+
+def export_metrics() -> None:
+    """Pass the current metrics to every registered exporter."""
+    if len(_exporters) == 0:
+        return
+    snapshot = get_snapshot()
+    for exporter in _exporters:
+        try:
+            exporter.export(snapshot)
+        except Exception as e:
+            logger.error(f"Failed to export metrics with {type(exporter).__name__}: {e!r}")
@@ -1,27 +1,42 @@
+import asyncio
 import functools
+import hashlib
 import importlib.resources
 import logging
 import os
+import weakref
 from datetime import datetime, timezone
+from typing import TYPE_CHECKING
 
-import openai
-from tenacity import retry, stop_after_delay, wait_fixed
+from student_guardrails import (
+    batching,
+    cache,
+    config,
+    metrics,
+    moderation_responses,
+    pipeline,
+    providers,
+    resilience,
+    resources,
+    session_state,
+    word_matcher,
+)
 
-from student_guardrails import email_alerts, moderation_responses, resources
+if TYPE_CHECKING:
+    # openai and the local provider (numpy) are imported on first use, to keep importing this module fast
+    import openai
+
+    from student_guardrails import local_provider
 
 logger = logging.getLogger(__name__)
 
+# parsed once from the environment; the constants below are initialized from it
+CONFIG = config.get_config()
+
 
 def get_moderation_threshold_overrides() -> dict[str, float]:
-    override_moderation_thresholds = {}
-    env_string = os.environ.get("OVERRIDE_MODERATION_THRESHOLDS", default="")
-    for kv in env_string.split(";"):
-        try:
-            key, value = kv.strip().split("=")
-            override_moderation_thresholds[key] = float(value)
-        except:
-            logger.warning(f"Malformed override '{kv}', expected 'category=0.XXX'; ignoring.")
-    return override_moderation_thresholds
+    """The current OVERRIDE_MODERATION_THRESHOLDS; see config.parse_threshold_overrides()."""
+    return config.parse_threshold_overrides(os.environ.get("OVERRIDE_MODERATION_THRESHOLDS", ""))
 
 
 # this list should contain an ordering of ALL moderation categories
@@ -38,25 +53,61 @@ OPENAI_MODERATION_CATEGORY_PRIORITY_LIST = [
     "hate",
     "hate/threatening",
 ]
-OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP = {
-    "self-harm/intent": 0.5,
-    "self-harm/instructions": 0.5,
-    "self-harm": 0.5,
-    "sexual/minors": 0.5,
-    "sexual": 0.5,
-    "violence": 0.5,  # was: 0.1, the rest 0.5
-    "violence/graphic": 0.5,
-    "harassment": 0.5,
-    "harassment/threatening": 0.5,
-    "hate": 0.5,
-    "hate/threatening": 0.5,
-}
-# apply configuration overrides
-for key in OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP:
-    override_moderation_thresholds = get_moderation_threshold_overrides()
-    if key in override_moderation_thresholds:
-        OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP[key] = override_moderation_thresholds[key]
-OPENAI_MODERATION_CATEGORY_OUTPUT_THRESHOLD = 0.999
+# read-only; defaults in config.DEFAULT_CATEGORY_THRESHOLDS, overridden with OVERRIDE_MODERATION_THRESHOLDS
+OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP = CONFIG.category_thresholds
+OPENAI_MODERATION_CATEGORY_OUTPUT_THRESHOLD = CONFIG.output_threshold
+OPENAI_MODERATION_MODEL = CONFIG.openai_model
+OPENAI_CLIENT_TIMEOUT = CONFIG.openai_client_timeout
+# total time a moderation call may take, including retries; each attempt's timeout is the smaller of the time remaining
+# and OPENAI_CLIENT_TIMEOUT
+MODERATION_DEADLINE = CONFIG.deadline
+MODERATION_RETRY_INITIAL_BACKOFF = CONFIG.retry_initial_backoff
+MODERATION_RETRY_MAX_BACKOFF = CONFIG.retry_max_backoff
+# the circuit opens when at least this fraction of the calls in the window failed, for at least MIN_CALLS calls
+MODERATION_CIRCUIT_FAILURE_RATE = CONFIG.circuit_failure_rate
+MODERATION_CIRCUIT_MIN_CALLS = CONFIG.circuit_min_calls
+MODERATION_CIRCUIT_WINDOW = CONFIG.circuit_window
+MODERATION_CIRCUIT_OPEN_DURATION = CONFIG.circuit_open_duration
+# when scores are unavailable (the deadline passed or the circuit is open):
+# "fail_closed" asks the student to try again and replaces generations, "local_only" decides on word lists alone
+MODERATION_FALLBACK_FAIL_CLOSED = "fail_closed"
+MODERATION_FALLBACK_LOCAL_ONLY = "local_only"
+MODERATION_FALLBACK_MODE = CONFIG.fallback_mode
+# maximum number of in-flight moderation requests per event loop when using the async API
+OPENAI_MODERATION_MAX_CONCURRENCY = CONFIG.max_concurrency
+# when enabled, concurrent async moderation calls are combined into multi-input API requests
+OPENAI_MODERATION_BATCHING = CONFIG.batching
+OPENAI_MODERATION_BATCH_MAX_SIZE = CONFIG.batch_max_size
+OPENAI_MODERATION_BATCH_MAX_WAIT = CONFIG.batch_max_wait
+# result caching is disabled unless an in-memory size or a SQLite path is configured
+MODERATION_CACHE_MAX_SIZE = CONFIG.cache_max_size
+MODERATION_CACHE_TTL = CONFIG.cache_ttl
+MODERATION_CACHE_SQLITE_PATH = CONFIG.cache_sqlite_path
+# session states (see session_state) are kept if an in-memory size or a SQLite path is configured;
+# messages from sessions blocked pending review are then answered without moderating them
+MODERATION_SESSION_STATE_MAX_SIZE = CONFIG.session_state_max_size
+MODERATION_SESSION_STATE_SQLITE_PATH = CONFIG.session_state_sqlite_path
+# every MAX_STRIKES try_again actions in a session throttle it for THROTTLE_DURATION seconds; 0 disables throttling
+MODERATION_SESSION_MAX_STRIKES = CONFIG.session_max_strikes
+MODERATION_SESSION_THROTTLE_DURATION = CONFIG.session_throttle_duration
+# bearer token required to unblock a session through the service's POST /v1/sessions/review; unset disables it
+MODERATION_SESSION_REVIEW_TOKEN = CONFIG.session_review_token
+# when a message is decided locally (e.g. by a word list hit), still fetch its scores in the background for logging
+MODERATION_BACKGROUND_REMOTE_SCORING = CONFIG.background_remote_scoring
+# which provider scores messages: "openai" (the OpenAI Moderation API) or "local" (the model at MODERATION_LOCAL_MODEL_PATH)
+MODERATION_PROVIDER_OPENAI = "openai"
+MODERATION_PROVIDER_LOCAL = "local"
+MODERATION_PROVIDER = CONFIG.provider
+# a model trained and saved with local_provider.LocalModerationProvider, see `python -m student_guardrails.local_provider`
+MODERATION_LOCAL_MODEL_PATH = CONFIG.local_model_path
+# when enabled, messages whose local scores are all below MODERATION_LOCAL_TIER_MAX_SCORE are decided
+# without calling the configured provider
+MODERATION_LOCAL_TIER = CONFIG.local_tier
+MODERATION_LOCAL_TIER_MAX_SCORE = CONFIG.local_tier_max_score
+# precompiled word-list matchers, written with `python -m student_guardrails.compile_word_lists`;
+# ignored if missing or if the bundled word lists have changed since it was written
+MODERATION_WORD_LIST_SNAPSHOT_PATH = CONFIG.word_list_snapshot_path
+WORD_LIST_FILENAMES = ["disallowed_words_all.txt", "disallowed_words_input.txt", "disallowed_words_output.txt"]
 
 
 def load_resource_word_list(filename: str, case_insensitive: bool = True) -> set[str]:
@@ -87,48 +138,623 @@ def get_disallowed_output_words() -> set[str]:
     return load_resource_word_list("disallowed_words_output.txt") | get_disallowed_words_all()
 
 
-def get_input_moderation_data(input_text: str, previous_messages: list[str] = []) -> dict:
-    disallowed_words = get_disallowed_input_words()
-    input_words = {word.lower() for word in set(input_text.split())}
-    disallowed_words_in_input = input_words & disallowed_words
+def get_input_moderation_text(input_text: str, previous_messages: list[str] = []) -> str:
     if len(previous_messages) > 0:
         input_text = "\n".join(previous_messages) + "\n" + input_text
-    moderation_result = get_openai_moderation_results(input_text)
-    moderation_data = {
-        "disallowed_words_in_input": sorted(disallowed_words_in_input),
-        "openai_moderation_result": moderation_result,
+    return input_text
+
+
+def get_word_lists_hash() -> str:
+    word_lists_hash = hashlib.sha256()
+    for filename in WORD_LIST_FILENAMES:
+        word_lists_hash.update(filename.encode("utf-8"))
+        word_lists_hash.update((importlib.resources.files(resources) / filename).read_bytes())
+    return word_lists_hash.hexdigest()
+
+
+@functools.cache
+def get_word_list_snapshot() -> dict[str, word_matcher.WordListMatcher] | None:
+    """The matchers from MODERATION_WORD_LIST_SNAPSHOT_PATH, or None if there is no usable snapshot."""
+    if MODERATION_WORD_LIST_SNAPSHOT_PATH is None:
+        return None
+    try:
+        matchers = word_matcher.load_snapshot(MODERATION_WORD_LIST_SNAPSHOT_PATH, get_word_lists_hash())
+    except Exception as e:
+        logger.warning(f"Failed to load the word-list snapshot at {MODERATION_WORD_LIST_SNAPSHOT_PATH}: {e!r}")
+        return None
+    if matchers is None:
+        logger.warning(f"The word-list snapshot at {MODERATION_WORD_LIST_SNAPSHOT_PATH} is out of date; ignoring it.")
+    return matchers
+
+
+def write_word_list_snapshot(path: str) -> None:
+    matchers = {
+        "input": word_matcher.WordListMatcher(get_disallowed_input_words()),
+        "output": word_matcher.WordListMatcher(get_disallowed_output_words()),
     }
-    return moderation_data
+    word_matcher.save_snapshot(path, matchers, get_word_lists_hash())
 
 
-def get_output_moderation_data(output: str) -> dict:
-    disallowed_words = get_disallowed_output_words()
-    output_words = set(output.split())
-    disallowed_words_in_output = output_words & disallowed_words
-    moderation_result = get_openai_moderation_results(output)
-    moderation_data = {
-        "disallowed_words_in_output": sorted(disallowed_words_in_output),
-        "openai_moderation_result": moderation_result,
+@functools.cache
+def get_disallowed_input_matcher() -> word_matcher.WordListMatcher:
+    snapshot = get_word_list_snapshot()
+    if snapshot is not None:
+        return snapshot["input"]
+    return word_matcher.WordListMatcher(get_disallowed_input_words())
+
+
+@functools.cache
+def get_disallowed_output_matcher() -> word_matcher.WordListMatcher:
+    snapshot = get_word_list_snapshot()
+    if snapshot is not None:
+        return snapshot["output"]
+    return word_matcher.WordListMatcher(get_disallowed_output_words())
+
+
+def get_disallowed_words_in_input(input_text: str) -> set[str]:
+    return get_disallowed_input_matcher().find_terms(input_text)
+
+
+def get_disallowed_words_in_output(output: str) -> set[str]:
+    return get_disallowed_output_matcher().find_terms(output)
+
+
+def _get_local_stages() -> list[pipeline.ModerationStage]:
+    if not MODERATION_LOCAL_TIER:
+        return []
+    local_provider = get_local_moderation_provider()
+    if local_provider is None:
+        logger.warning("MODERATION_LOCAL_TIER is enabled, but MODERATION_LOCAL_MODEL_PATH is not set; skipping it.")
+        return []
+    return [pipeline.LocalScoringStage(local_provider.score, MODERATION_LOCAL_TIER_MAX_SCORE)]
+
+
+def _get_remote_stage() -> pipeline.RemoteStage:
+    # the lambdas look up the scoring functions at call time, so they can be replaced (e.g. in tests)
+    return pipeline.RemoteStage(
+        lambda text: get_openai_moderation_results(text, check_cache=False),
+        lambda text: get_openai_moderation_results_async(text, check_cache=False),
+    )
+
+
+@functools.cache
+def get_input_moderation_pipeline() -> pipeline.ModerationPipeline:
+    """Session state, then word list, then cache, then the local tier (if enabled), then the configured provider.
+
+    A blocked or throttled session is decisive, as is a disallowed word in the input,
+    since apply_input_moderation_rules() doesn't consider scores in those cases.
+    """
+    return pipeline.ModerationPipeline(
+        [
+            pipeline.SessionStateStage(lambda session_key: get_session_status(session_key)),
+            pipeline.WordListStage(lambda text: get_disallowed_words_in_input(text), decisive=True),
+            pipeline.CacheStage(lambda text: get_cached_moderation_results(text)),
+            *_get_local_stages(),
+            _get_remote_stage(),
+        ],
+        background_scoring_stage=_get_remote_stage() if MODERATION_BACKGROUND_REMOTE_SCORING else None,
+        name="input",
+    )
+
+
+@functools.cache
+def get_output_moderation_pipeline() -> pipeline.ModerationPipeline:
+    """Word list, then cache, then the local tier (if enabled), then the configured provider.
+
+    Disallowed words in the output are redacted rather than replacing the generation, so the scores are always needed.
+    """
+    return pipeline.ModerationPipeline(
+        [
+            pipeline.WordListStage(lambda text: get_disallowed_words_in_output(text), decisive=False),
+            pipeline.CacheStage(lambda text: get_cached_moderation_results(text)),
+            *_get_local_stages(),
+            _get_remote_stage(),
+        ],
+        name="output",
+    )
+
+
+def _get_input_moderation_data(context: pipeline.ModerationContext) -> dict:
+    return {
+        "disallowed_words_in_input": sorted(context.disallowed_words),
+        "openai_moderation_result": context.moderation_result,
+        "moderation_stage": context.decided_by,
+        "moderation_unavailable": context.moderation_unavailable,
+        "session_status": context.session_status,
     }
-    return moderation_data
 
 
-@retry(wait=wait_fixed(3), stop=stop_after_delay(15))
-def get_openai_moderation_results(input: str) -> dict:
-    start_time = datetime.now(timezone.utc)
-    client = openai.OpenAI(timeout=10)
-    response = client.moderations.create(
-        input=input,
-        model="text-moderation-latest",
+def _get_output_moderation_data(context: pipeline.ModerationContext) -> dict:
+    return {
+        "disallowed_words_in_output": sorted(context.disallowed_words),
+        "openai_moderation_result": context.moderation_result,
+        "moderation_stage": context.decided_by,
+        "moderation_unavailable": context.moderation_unavailable,
+    }
+
+
+def get_input_moderation_data(
+    input_text: str,
+    previous_messages: list[str] = [],
+    activity_session_id: str | None = None,
+    user_id: str | None = None,
+) -> dict:
+    """Moderate a user's input message.
+
+    If the input contains a disallowed word, the remote API is not called and openai_moderation_result is None.
+    If scores are unavailable (see MODERATION_FALLBACK_MODE), openai_moderation_result is None
+    and moderation_unavailable is True.
+    If the session (see get_session_key()) is blocked or throttled, nothing else is checked
+    and session_status is "blocked" or "throttled".
+    """
+    context = get_input_moderation_pipeline().run(
+        input_text,
+        get_input_moderation_text(input_text, previous_messages),
+        get_session_key(activity_session_id, user_id),
+    )
+    return _get_input_moderation_data(context)
+
+
+def get_output_moderation_data(output: str) -> dict:
+    context = get_output_moderation_pipeline().run(output)
+    return _get_output_moderation_data(context)
+
+
+async def get_input_moderation_data_async(
+    input_text: str,
+    previous_messages: list[str] = [],
+    activity_session_id: str | None = None,
+    user_id: str | None = None,
+) -> dict:
+    """Async version of get_input_moderation_data()."""
+    context = await get_input_moderation_pipeline().run_async(
+        input_text,
+        get_input_moderation_text(input_text, previous_messages),
+        get_session_key(activity_session_id, user_id),
     )
+    return _get_input_moderation_data(context)
+
+
+async def get_output_moderation_data_async(output: str) -> dict:
+    """Async version of get_output_moderation_data()."""
+    context = await get_output_moderation_pipeline().run_async(output)
+    return _get_output_moderation_data(context)
+
+
+@functools.cache
+def get_openai_client() -> "openai.OpenAI":
+    """Shared client, so that the underlying connection pool is reused across moderation calls."""
+    import openai
+
+    # retries are handled by get_retry_policy() instead
+    return openai.OpenAI(timeout=OPENAI_CLIENT_TIMEOUT, max_retries=0)
+
+
+# async clients, concurrency limits, and batchers are bound to the event loop that created them
+_async_client_state = weakref.WeakKeyDictionary()
+_async_batchers = weakref.WeakKeyDictionary()
+
+
+def _get_async_client_state() -> tuple["openai.AsyncOpenAI", asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    if loop not in _async_client_state:
+        import openai
+
+        _async_client_state[loop] = (
+            openai.AsyncOpenAI(timeout=OPENAI_CLIENT_TIMEOUT, max_retries=0),
+            asyncio.Semaphore(OPENAI_MODERATION_MAX_CONCURRENCY),
+        )
+    return _async_client_state[loop]
+
+
+def get_async_openai_client() -> "openai.AsyncOpenAI":
+    """Shared async client for the running event loop."""
+    return _get_async_client_state()[0]
+
+
+def get_moderation_batcher() -> batching.ModerationBatcher:
+    """Shared batcher for the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _async_batchers:
+        # the batcher only scores; callers have already checked the cache, and store the results themselves
+        _async_batchers[loop] = batching.ModerationBatcher(
+            lambda inputs: get_moderation_provider().score_batch_async(inputs),
+            max_batch_size=OPENAI_MODERATION_BATCH_MAX_SIZE,
+            max_wait=OPENAI_MODERATION_BATCH_MAX_WAIT,
+        )
+    return _async_batchers[loop]
+
+
+async def close_async_openai_client() -> None:
+    """Flush pending batches and close the running event loop's async client, e.g. on server shutdown."""
+    loop = asyncio.get_running_loop()
+    batcher = _async_batchers.pop(loop, None)
+    if batcher is not None:
+        await batcher.flush()
+    state = _async_client_state.pop(loop, None)
+    if state is not None:
+        await state[0].close()
+
+
+def is_retryable_openai_error(e: Exception) -> bool:
+    """Timeouts, connection errors, rate limits, and server errors are worth retrying; other errors won't go away."""
+    import openai
+
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in {408, 409, 429} or e.status_code >= 500
+    return False
+
+
+_circuit_breaker: resilience.CircuitBreaker | None = None
+
+
+def get_circuit_breaker() -> resilience.CircuitBreaker:
+    """Shared by all moderation calls in this process, so that once the API is failing, every caller fails fast."""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = resilience.CircuitBreaker(
+            failure_rate_threshold=MODERATION_CIRCUIT_FAILURE_RATE,
+            minimum_calls=MODERATION_CIRCUIT_MIN_CALLS,
+            window=MODERATION_CIRCUIT_WINDOW,
+            open_duration=MODERATION_CIRCUIT_OPEN_DURATION,
+        )
+    return _circuit_breaker
+
+
+@functools.cache
+def get_retry_policy() -> resilience.RetryPolicy:
+    return resilience.RetryPolicy(
+        deadline=MODERATION_DEADLINE,
+        attempt_timeout=OPENAI_CLIENT_TIMEOUT,
+        initial_backoff=MODERATION_RETRY_INITIAL_BACKOFF,
+        max_backoff=MODERATION_RETRY_MAX_BACKOFF,
+        is_retryable=is_retryable_openai_error,
+        circuit_breaker=get_circuit_breaker(),
+        name="openai_moderation",
+    )
+
+
+def reset_openai_clients() -> None:
+    """Discard the shared clients and circuit breaker, so the next call creates new ones, e.g. after changing OPENAI_BASE_URL.
+
+    Async clients are dropped without being closed; use close_async_openai_client() from a running event loop for that.
+    """
+    if get_openai_client.cache_info().currsize > 0:
+        get_openai_client().close()
+    get_openai_client.cache_clear()
+    _async_client_state.clear()
+    _async_batchers.clear()
+    # a new endpoint starts with a closed circuit
+    global _circuit_breaker
+    _circuit_breaker = None
+    get_retry_policy.cache_clear()
+
+
+class OpenAIModerationProvider(providers.ModerationProvider):
+    """The OpenAI Moderation API, with the shared clients and retry policy."""
+
+    def __init__(self, model: str = OPENAI_MODERATION_MODEL):
+        self.model = model
+
+    def score(self, input: str) -> dict:
+        return _request_openai_moderation_results(input, self.model)
+
+    def score_batch(self, inputs: list[str]) -> list[dict]:
+        return _request_openai_moderation_results_batch(inputs, self.model)
+
+    async def score_batch_async(self, inputs: list[str]) -> list[dict]:
+        return await _request_openai_moderation_results_batch_async(inputs, self.model)
+
+
+@functools.cache
+def get_local_moderation_provider() -> "local_provider.LocalModerationProvider | None":
+    """The model at MODERATION_LOCAL_MODEL_PATH, or None if it isn't set."""
+    if not MODERATION_LOCAL_MODEL_PATH:
+        return None
+    from student_guardrails import local_provider
+
+    return local_provider.LocalModerationProvider.load(MODERATION_LOCAL_MODEL_PATH)
+
+
+def create_moderation_provider() -> providers.ModerationProvider:
+    """Create the provider described by MODERATION_PROVIDER."""
+    if MODERATION_PROVIDER == MODERATION_PROVIDER_LOCAL:
+        local_provider = get_local_moderation_provider()
+        if local_provider is None:
+            raise ValueError("MODERATION_PROVIDER is 'local', but MODERATION_LOCAL_MODEL_PATH is not set.")
+        return local_provider
+    if MODERATION_PROVIDER != MODERATION_PROVIDER_OPENAI:
+        raise ValueError(f"Unknown MODERATION_PROVIDER '{MODERATION_PROVIDER}'.")
+    return OpenAIModerationProvider()
+
+
+_moderation_provider: providers.ModerationProvider | None = None
+
+
+def get_moderation_provider() -> providers.ModerationProvider:
+    global _moderation_provider
+    if _moderation_provider is None:
+        _moderation_provider = create_moderation_provider()
+    return _moderation_provider
+
+
+def set_moderation_provider(moderation_provider: providers.ModerationProvider | None) -> None:
+    """Replace the moderation provider; pass None to go back to the one described by MODERATION_PROVIDER."""
+    global _moderation_provider
+    _moderation_provider = moderation_provider
+
+
+def create_moderation_cache() -> cache.ModerationCache | None:
+    """Create the moderation result cache described by the MODERATION_CACHE_* configuration."""
+    memory_cache = None
+    if MODERATION_CACHE_MAX_SIZE > 0:
+        memory_cache = cache.InMemoryModerationCache(max_size=MODERATION_CACHE_MAX_SIZE, ttl=MODERATION_CACHE_TTL)
+    if MODERATION_CACHE_SQLITE_PATH:
+        persistent_cache = cache.SQLiteModerationCache(MODERATION_CACHE_SQLITE_PATH, ttl=MODERATION_CACHE_TTL)
+        if memory_cache is None:
+            return persistent_cache
+        return cache.TieredModerationCache(memory_cache, persistent_cache)
+    return memory_cache
+
+
+_moderation_cache: cache.ModerationCache | None = None
+_moderation_cache_initialized = False
+
+
+def get_moderation_cache() -> cache.ModerationCache | None:
+    global _moderation_cache, _moderation_cache_initialized
+    if not _moderation_cache_initialized:
+        _moderation_cache = create_moderation_cache()
+        _moderation_cache_initialized = True
+    return _moderation_cache
+
+
+def set_moderation_cache(moderation_cache: cache.ModerationCache | None) -> None:
+    """Replace the moderation result cache; pass None to disable caching."""
+    global _moderation_cache, _moderation_cache_initialized
+    _moderation_cache = moderation_cache
+    _moderation_cache_initialized = True
+
+
+def create_session_state_store() -> session_state.SessionStateStore | None:
+    """Create the session state store described by the MODERATION_SESSION_* configuration."""
+    if MODERATION_SESSION_STATE_SQLITE_PATH:
+        return session_state.SQLiteSessionStateStore(
+            MODERATION_SESSION_STATE_SQLITE_PATH,
+            max_strikes=MODERATION_SESSION_MAX_STRIKES,
+            throttle_duration=MODERATION_SESSION_THROTTLE_DURATION,
+        )
+    if MODERATION_SESSION_STATE_MAX_SIZE > 0:
+        return session_state.InMemorySessionStateStore(
+            max_size=MODERATION_SESSION_STATE_MAX_SIZE,
+            max_strikes=MODERATION_SESSION_MAX_STRIKES,
+            throttle_duration=MODERATION_SESSION_THROTTLE_DURATION,
+        )
+    return None
+
+
+_session_state_store: session_state.SessionStateStore | None = None
+_session_state_store_initialized = False
+
+
+def get_session_state_store() -> session_state.SessionStateStore | None:
+    global _session_state_store, _session_state_store_initialized
+    if not _session_state_store_initialized:
+        _session_state_store = create_session_state_store()
+        _session_state_store_initialized = True
+    return _session_state_store
+
+
+def set_session_state_store(session_state_store: session_state.SessionStateStore | None) -> None:
+    """Replace the session state store; pass None to disable session state."""
+    global _session_state_store, _session_state_store_initialized
+    _session_state_store = session_state_store
+    _session_state_store_initialized = True
+
+
+def get_session_key(activity_session_id: str | None = None, user_id: str | None = None) -> str | None:
+    """Session state is kept per activity session if its id is known, otherwise per user."""
+    if activity_session_id:
+        return f"activity_session:{activity_session_id}"
+    if user_id:
+        return f"user:{user_id}"
+    return None
+
+
+def get_session_status(session_key: str) -> str | None:
+    """ "blocked", "throttled", or None; also None if there's no store or the lookup fails."""
+    session_state_store = get_session_state_store()
+    if session_state_store is None:
+        return None
+    try:
+        return session_state_store.get_status(session_key)
+    except Exception as e:
+        # the message is moderated as usual instead
+        logger.warning(f"Failed to look up the state of session {session_key}: {e!r}")
+        return None
+
+
+def record_session_action(action: str, activity_session_id: str | None = None, user_id: str | None = None) -> None:
+    session_state_store = get_session_state_store()
+    session_key = get_session_key(activity_session_id, user_id)
+    if session_state_store is None or session_key is None or action == moderation_responses.ACTION_NO_ACTION:
+        return
+    try:
+        session_state_store.record_action(session_key, action)
+    except Exception as e:
+        logger.error(f"Failed to record {action=} for session {session_key}: {e!r}")
+
+
+def get_cached_moderation_results(input: str) -> dict | None:
+    """Look up a previous moderation result for this input.
+
+    Cached results have cache_hit=True; request_duration is the duration of the lookup,
+    while the duration of the original request is kept as cached_request_duration.
+    """
+    moderation_cache = get_moderation_cache()
+    if moderation_cache is None:
+        return None
+    start_time = datetime.now(timezone.utc)
+    output = moderation_cache.get(cache.get_cache_key(input, get_moderation_provider().model))
+    metrics.increment("guardrails_moderation_cache_lookups_total", result="miss" if output is None else "hit")
+    if output is not None:
+        elapsed_time = datetime.now(timezone.utc) - start_time
+        output["cached_request_duration"] = output.get("request_duration")
+        output["request_duration"] = elapsed_time.total_seconds()
+        output["cache_hit"] = True
+    return output
+
+
+def set_cached_moderation_results(input: str, output: dict) -> None:
+    moderation_cache = get_moderation_cache()
+    if moderation_cache is None:
+        return
+    moderation_cache.set(cache.get_cache_key(input, get_moderation_provider().model), output)
+    output["cache_hit"] = False
+
+
+def get_openai_moderation_results(input: str, check_cache: bool = True) -> dict:
+    """Moderate the input with the configured provider, by default the OpenAI Moderation API.
+
+    With check_cache=False, any cached result is ignored, but the new result is still stored in the cache.
+    """
+    output = get_cached_moderation_results(input) if check_cache else None
+    if output is None:
+        output = get_moderation_provider().score(input)
+        set_cached_moderation_results(input, output)
+    return output
+
+
+async def get_openai_moderation_results_async(input: str, check_cache: bool = True) -> dict:
+    """Async version of get_openai_moderation_results().
+
+    If OPENAI_MODERATION_BATCHING is enabled, the input is sent together with other concurrent inputs.
+    """
+    output = get_cached_moderation_results(input) if check_cache else None
+    if output is None:
+        if OPENAI_MODERATION_BATCHING:
+            output = await get_moderation_batcher().submit(input)
+        else:
+            output = await get_moderation_provider().score_async(input)
+        set_cached_moderation_results(input, output)
+    return output
+
+
+def get_openai_moderation_results_batch(inputs: list[str]) -> list[dict]:
+    """Moderate multiple inputs, sending any inputs without cached results as a single API request.
+
+    Returns:
+        list[dict]: One result per input, in the same order as the inputs.
+    """
+    outputs = [get_cached_moderation_results(input) for input in inputs]
+    uncached_indices = [i for i, output in enumerate(outputs) if output is None]
+    if len(uncached_indices) > 0:
+        uncached_outputs = get_moderation_provider().score_batch([inputs[i] for i in uncached_indices])
+        for i, output in zip(uncached_indices, uncached_outputs):
+            set_cached_moderation_results(inputs[i], output)
+            outputs[i] = output
+    return outputs
+
+
+async def get_openai_moderation_results_batch_async(inputs: list[str]) -> list[dict]:
+    """Async version of get_openai_moderation_results_batch()."""
+    outputs = [get_cached_moderation_results(input) for input in inputs]
+    uncached_indices = [i for i, output in enumerate(outputs) if output is None]
+    if len(uncached_indices) > 0:
+        uncached_outputs = await get_moderation_provider().score_batch_async([inputs[i] for i in uncached_indices])
+        for i, output in zip(uncached_indices, uncached_outputs):
+            set_cached_moderation_results(inputs[i], output)
+            outputs[i] = output
+    return outputs
+
+
+def _request_openai_moderation_results(input: str, model: str = OPENAI_MODERATION_MODEL) -> dict:
+    """Raises resilience.ModerationUnavailableError if the deadline passes or the circuit breaker is open."""
+    start_time = datetime.now(timezone.utc)
+    client = get_openai_client()
+
+    def request(timeout: float) -> "openai.types.ModerationCreateResponse":
+        with metrics.timer(
+            "guardrails_openai_request_duration_seconds",
+            error_counter="guardrails_openai_request_errors_total",
+            request="single",
+        ):
+            return client.moderations.create(
+                input=input,
+                model=model,
+                timeout=timeout,
+            )
+
+    response = get_retry_policy().call(request)
     output = response.results[0].model_dump(by_alias=True)
     elapsed_time = datetime.now(timezone.utc) - start_time
     output["request_duration"] = elapsed_time.total_seconds()
     return output
 
 
-def apply_input_moderation_rules(input_message: str, input_moderation_data: dict, **kwargs) -> tuple[str, str | None]:
-    """Apply moderation rules to a user's input message.
+def _request_openai_moderation_results_batch(inputs: list[str], model: str = OPENAI_MODERATION_MODEL) -> list[dict]:
+    start_time = datetime.now(timezone.utc)
+    client = get_openai_client()
+
+    def request(timeout: float) -> "openai.types.ModerationCreateResponse":
+        with metrics.timer(
+            "guardrails_openai_request_duration_seconds",
+            error_counter="guardrails_openai_request_errors_total",
+            request="batch",
+        ):
+            return client.moderations.create(
+                input=inputs,
+                model=model,
+                timeout=timeout,
+            )
+
+    response = get_retry_policy().call(request)
+    elapsed_time = datetime.now(timezone.utc) - start_time
+    outputs = []
+    for result in response.results:
+        output = result.model_dump(by_alias=True)
+        output["request_duration"] = elapsed_time.total_seconds()
+        outputs.append(output)
+    return outputs
+
+
+async def _request_openai_moderation_results_batch_async(
+    inputs: list[str],
+    model: str = OPENAI_MODERATION_MODEL,
+) -> list[dict]:
+    """At most OPENAI_MODERATION_MAX_CONCURRENCY requests are in flight per event loop;
+    request_duration includes any time spent waiting for a free slot, which also counts against the deadline.
+    """
+    start_time = datetime.now(timezone.utc)
+    client, semaphore = _get_async_client_state()
+
+    async def request(timeout: float) -> "openai.types.ModerationCreateResponse":
+        async with semaphore:
+            with metrics.timer(
+                "guardrails_openai_request_duration_seconds",
+                error_counter="guardrails_openai_request_errors_total",
+                request="batch_async",
+            ):
+                return await client.moderations.create(
+                    input=inputs,
+                    model=model,
+                    timeout=timeout,
+                )
+
+    response = await get_retry_policy().call_async(request)
+    elapsed_time = datetime.now(timezone.utc) - start_time
+    outputs = []
+    for result in response.results:
+        output = result.model_dump(by_alias=True)
+        output["request_duration"] = elapsed_time.total_seconds()
+        outputs.append(output)
+    return outputs
+
+
+def get_input_moderation_decision(input_moderation_data: dict) -> tuple[str, str | None, str | None]:
+    """Decide on a moderation action for a user's input message, without side effects.
 
     Args:
         input_moderation_data (dict): see get_input_moderation_data()
@@ -136,37 +762,82 @@ def apply_input_moderation_rules(input_message: str, input_moderation_data: dict
     Returns:
         str: Action to take
         str | None: Message to return to the user, or none if no moderation action is necessary.
+        str | None: The category whose threshold was crossed, if any.
     """
+    session_status = input_moderation_data.get("session_status")
+    if session_status == session_state.SESSION_STATUS_BLOCKED:
+        return moderation_responses.ACTION_END_CONVERSATION, moderation_responses.END_CONVERSATION_RESPONSE, None
+    if session_status == session_state.SESSION_STATUS_THROTTLED:
+        return moderation_responses.ACTION_TRY_AGAIN, moderation_responses.THROTTLED_RESPONSE, None
     if len(input_moderation_data["disallowed_words_in_input"]) > 0:
         return (
             moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP["disallowed_words"][0],
             moderation_responses.BAD_WORD_RESPONSE,
+            None,
         )
+    if input_moderation_data["openai_moderation_result"] is None:
+        # scores are unavailable
+        if MODERATION_FALLBACK_MODE == MODERATION_FALLBACK_LOCAL_ONLY:
+            return moderation_responses.ACTION_NO_ACTION, None, None
+        return moderation_responses.ACTION_TRY_AGAIN, moderation_responses.TRY_AGAIN_RESPONSE, None
     category_scores = input_moderation_data["openai_moderation_result"]["category_scores"]
     for category in OPENAI_MODERATION_CATEGORY_PRIORITY_LIST:
         score = category_scores[category]
         if score >= OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP[category]:
             # returned score over the moderation action threshold
             actions = moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP[category]
-            if moderation_responses.ACTION_EMAIL_ALERT in actions:
-                moderation_data = {
-                    "input_message": input_message,
-                    "category": category,
-                    "input_moderation_data": input_moderation_data,
-                    **kwargs,
-                }
-                subject, content = email_alerts.create_alert_email(moderation_data)
-                email_alerts.send_alert_email(subject, content)
             response_string = moderation_responses.OPENAI_MODERATION_CATEGORY_RESPONSE_MAP[category]
             if moderation_responses.ACTION_TRY_AGAIN in actions:
-                return moderation_responses.ACTION_TRY_AGAIN, response_string
+                return moderation_responses.ACTION_TRY_AGAIN, response_string, category
             elif moderation_responses.ACTION_END_CONVERSATION in actions:
-                return moderation_responses.ACTION_END_CONVERSATION, response_string
+                return moderation_responses.ACTION_END_CONVERSATION, response_string, category
             logging.warning(
                 f"No action configured for {category=}; taking no action, but this probably indicates a configuration error.",
             )
-            return moderation_responses.ACTION_NO_ACTION, response_string
-    return moderation_responses.ACTION_NO_ACTION, None
+            return moderation_responses.ACTION_NO_ACTION, response_string, category
+    return moderation_responses.ACTION_NO_ACTION, None, None
+
+
+def apply_input_moderation_rules(input_message: str, input_moderation_data: dict, **kwargs) -> tuple[str, str | None]:
+    """Apply moderation rules to a user's input message, sending an alert email if the category requires it.
+
+    If session state is enabled and kwargs include an activity_session_id or user_id, the action is recorded,
+    e.g. end_conversation blocks the session until it's reviewed.
+
+    Args:
+        input_moderation_data (dict): see get_input_moderation_data()
+
+    Returns:
+        str: Action to take
+        str | None: Message to return to the user, or none if no moderation action is necessary.
+    """
+    with metrics.timer("guardrails_moderation_rules_duration_seconds", direction="input"):
+        action, response_string, category = get_input_moderation_decision(input_moderation_data)
+    if metrics.is_enabled():
+        metrics.increment("guardrails_input_moderation_actions_total", action=action)
+        if category is not None:
+            metrics.increment("guardrails_input_moderation_category_triggers_total", category=category)
+        elif len(input_moderation_data["disallowed_words_in_input"]) > 0:
+            metrics.increment("guardrails_input_moderation_category_triggers_total", category="disallowed_words")
+    if (
+        category is not None
+        and moderation_responses.ACTION_EMAIL_ALERT
+        in moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP[category]
+    ):
+        moderation_data = {
+            "input_message": input_message,
+            "category": category,
+            "input_moderation_data": input_moderation_data,
+            **kwargs,
+        }
+        from student_guardrails import alert_aggregation
+
+        alert_aggregation.submit_alert(moderation_data)
+    # only actions caused by the message itself count against the session; not the fallback when moderation was
+    # unavailable (so an outage doesn't throttle students), nor the response to an already blocked or throttled session
+    if category is not None or len(input_moderation_data["disallowed_words_in_input"]) > 0:
+        record_session_action(action, kwargs.get("activity_session_id"), kwargs.get("user_id"))
+    return action, response_string
 
 
 def apply_output_moderation_rules(generation: str, output_moderation_data: dict) -> str:
@@ -179,13 +850,24 @@ def apply_output_moderation_rules(generation: str, output_moderation_data: dict)
     Returns:
         str: A moderation-approved text to use as the generation, potentially unchanged.
     """
-    category_scores = output_moderation_data["openai_moderation_result"]["category_scores"]
-    tripped_moderation_threshold = any(
-        [v >= OPENAI_MODERATION_CATEGORY_OUTPUT_THRESHOLD for v in category_scores.values()],
-    )
-    if tripped_moderation_threshold:
-        return moderation_responses.BAD_GENERATION_RESPONSE
-    if len(output_moderation_data["disallowed_words_in_output"]) > 0:
-        for word in output_moderation_data["disallowed_words_in_output"]:
-            generation = generation.replace(word, "")
-    return generation
+    with metrics.timer("guardrails_moderation_rules_duration_seconds", direction="output"):
+        moderation_result = output_moderation_data["openai_moderation_result"]
+        if moderation_result is None:
+            # scores are unavailable; with fail_closed, the generation can't be approved
+            tripped_moderation_threshold = MODERATION_FALLBACK_MODE != MODERATION_FALLBACK_LOCAL_ONLY
+        else:
+            tripped_moderation_threshold = any(
+                [
+                    v >= OPENAI_MODERATION_CATEGORY_OUTPUT_THRESHOLD
+                    for v in moderation_result["category_scores"].values()
+                ],
+            )
+        if tripped_moderation_threshold:
+            metrics.increment("guardrails_output_moderation_actions_total", action="bad_generation")
+            return moderation_responses.BAD_GENERATION_RESPONSE
+        if len(output_moderation_data["disallowed_words_in_output"]) > 0:
+            metrics.increment("guardrails_output_moderation_actions_total", action="redacted")
+            generation, _ = get_disallowed_output_matcher().redact(generation)
+            return generation
+        metrics.increment("guardrails_output_moderation_actions_total", action=moderation_responses.ACTION_NO_ACTION)
+        return generation
@@ -5,6 +5,8 @@ BAD_WORD_RESPONSE = (
 )
 TRY_AGAIN_RESPONSE = "That doesn't sound math-related or appropriate. Even though I'm not a real person, please be kind and respectful. Let's try that again."
 END_CONVERSATION_RESPONSE = "That sounds like a serious topic, and a real person needs to look at this.  They might try to contact you to check on you. Until someone has reviewed this, Rori will not reply."
+# for a session that got several try_again responses in a row, see session_state
+THROTTLED_RESPONSE = "Let's take a short break. Please come back in a few minutes, and we can keep practicing math."
 
 VULNERABLE_END_CONVERSATION_RESPONSE = "I’m sorry to hear that. This sounds like a serious topic, but I'm not a real person and I'm not designed to talk about these types of topics. I will alert the people who make Rori so they can check to make sure everything is OK. I have to end this conversation, but we can still practice math if you want."
 THREATENING_END_CONVERSATION_RESPONSE = "This sounds like a serious topic. I will alert the people who make Rori so they can check on this message and make sure everything is OK. Please remember that while I’m not a real person, you should still be respectful. I have to end this conversation, but we can still practice math if you want."
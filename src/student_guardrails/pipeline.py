@@ -0,0 +1,233 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from student_guardrails import metrics, resilience
+
+logger = logging.getLogger(__name__)
+
+
+class ModerationContext:
+    """State passed between the stages of a ModerationPipeline."""
+
+    def __init__(self, text: str, moderation_text: str | None = None, session_key: str | None = None):
+        # the message itself, checked against word lists
+        self.text = text
+        # the text sent for scoring, which may include previous messages
+        self.moderation_text = text if moderation_text is None else moderation_text
+        # identifies the conversation's session state, if known; see session_state
+        self.session_key = session_key
+        # "blocked" or "throttled" if the session's state ended the pipeline
+        self.session_status: str | None = None
+        self.disallowed_words: set[str] = set()
+        self.moderation_result: dict | None = None
+        # True if scoring failed with resilience.ModerationUnavailableError, so no result is available
+        self.moderation_unavailable = False
+        # name of the stage that ended the pipeline
+        self.decided_by: str | None = None
+
+
+class ModerationStage:
+    """A pipeline stage. run() returns True if no later stage needs to run."""
+
+    name = "stage"
+
+    def run(self, context: ModerationContext) -> bool:
+        raise NotImplementedError()
+
+    async def run_async(self, context: ModerationContext) -> bool:
+        return self.run(context)
+
+
+class SessionStateStage(ModerationStage):
+    """Ends the pipeline before any other work if the session is blocked or throttled."""
+
+    name = "session_state"
+
+    def __init__(self, get_status: Callable[[str], str | None]):
+        self.get_status = get_status
+
+    def run(self, context: ModerationContext) -> bool:
+        if context.session_key is None:
+            return False
+        context.session_status = self.get_status(context.session_key)
+        return context.session_status is not None
+
+
+class WordListStage(ModerationStage):
+    """Finds disallowed words in the message; if decisive, any hit ends the pipeline."""
+
+    name = "word_list"
+
+    def __init__(self, find_words: Callable[[str], set[str]], decisive: bool):
+        self.find_words = find_words
+        self.decisive = decisive
+
+    def run(self, context: ModerationContext) -> bool:
+        context.disallowed_words = self.find_words(context.text)
+        return self.decisive and len(context.disallowed_words) > 0
+
+
+class CacheStage(ModerationStage):
+    """Uses a previously-stored moderation result, if there is one."""
+
+    name = "cache"
+
+    def __init__(self, lookup: Callable[[str], dict | None]):
+        self.lookup = lookup
+
+    def run(self, context: ModerationContext) -> bool:
+        context.moderation_result = self.lookup(context.moderation_text)
+        return context.moderation_result is not None
+
+
+class LocalScoringStage(ModerationStage):
+    """Scores the text with an in-process model, as a first tier before the remote API.
+
+    If every local score is below max_score, the message is clearly benign and the local result is used;
+    otherwise later stages score it.
+    """
+
+    name = "local"
+
+    def __init__(self, score: Callable[[str], dict], max_score: float):
+        self.score = score
+        self.max_score = max_score
+
+    def run(self, context: ModerationContext) -> bool:
+        moderation_result = self.score(context.moderation_text)
+        if max(moderation_result["category_scores"].values(), default=0.0) < self.max_score:
+            context.moderation_result = moderation_result
+            return True
+        return False
+
+
+class RemoteStage(ModerationStage):
+    """Scores the text with the remote moderation API.
+
+    If the API is unavailable, the pipeline ends without a result and context.moderation_unavailable is set.
+    """
+
+    name = "remote"
+
+    def __init__(self, score: Callable[[str], dict], score_async: Callable[[str], Awaitable[dict]]):
+        self.score = score
+        self.score_async = score_async
+
+    def run(self, context: ModerationContext) -> bool:
+        try:
+            context.moderation_result = self.score(context.moderation_text)
+        except resilience.ModerationUnavailableError as e:
+            self._handle_unavailable(context, e)
+        return True
+
+    async def run_async(self, context: ModerationContext) -> bool:
+        try:
+            context.moderation_result = await self.score_async(context.moderation_text)
+        except resilience.ModerationUnavailableError as e:
+            self._handle_unavailable(context, e)
+        return True
+
+    def _handle_unavailable(self, context: ModerationContext, e: Exception) -> None:
+        logger.warning(f"Moderation scores unavailable, using the fallback: {e!r}")
+        metrics.increment("guardrails_moderation_fallbacks_total", error=type(e).__name__)
+        context.moderation_unavailable = True
+
+
+def log_background_moderation_result(context: ModerationContext, moderation_result: dict) -> None:
+    max_score = max(moderation_result["category_scores"].values(), default=0.0)
+    logger.info(f"Background moderation result for message decided by {context.decided_by}: {max_score=:.5f}")
+
+
+# shared by all pipelines; background scoring is only for logging, so a small pool is enough
+_background_executor: ThreadPoolExecutor | None = None
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    global _background_executor
+    if _background_executor is None:
+        _background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="moderation-background")
+    return _background_executor
+
+
+class ModerationPipeline:
+    """Runs stages in order until one of them is decisive.
+
+    If background_scoring_stage is provided, messages decided without a remote moderation result
+    (e.g. by a word list hit or by the local tier, but not by the session state) are still scored by that stage in the background,
+    and the result is passed to background_callback, for logging only.
+
+    The name labels this pipeline's stage latency and decision metrics.
+    """
+
+    def __init__(
+        self,
+        stages: list[ModerationStage],
+        background_scoring_stage: ModerationStage | None = None,
+        background_callback: Callable[[ModerationContext, dict], None] = log_background_moderation_result,
+        name: str = "moderation",
+    ):
+        self.stages = stages
+        self.name = name
+        self.background_scoring_stage = background_scoring_stage
+        self.background_callback = background_callback
+        self._background_tasks: set[asyncio.Task] = set()
+
+    def run(self, text: str, moderation_text: str | None = None, session_key: str | None = None) -> ModerationContext:
+        context = ModerationContext(text, moderation_text, session_key)
+        for stage in self.stages:
+            with metrics.timer("guardrails_moderation_stage_duration_seconds", pipeline=self.name, stage=stage.name):
+                decided = stage.run(context)
+            if decided:
+                context.decided_by = stage.name
+                break
+        metrics.increment("guardrails_moderation_decisions_total", pipeline=self.name, stage=str(context.decided_by))
+        if self._needs_background_scoring(context):
+            get_background_executor().submit(self._score_in_background, context)
+        return context
+
+    async def run_async(
+        self,
+        text: str,
+        moderation_text: str | None = None,
+        session_key: str | None = None,
+    ) -> ModerationContext:
+        context = ModerationContext(text, moderation_text, session_key)
+        for stage in self.stages:
+            with metrics.timer("guardrails_moderation_stage_duration_seconds", pipeline=self.name, stage=stage.name):
+                decided = await stage.run_async(context)
+            if decided:
+                context.decided_by = stage.name
+                break
+        metrics.increment("guardrails_moderation_decisions_total", pipeline=self.name, stage=str(context.decided_by))
+        if self._needs_background_scoring(context):
+            task = asyncio.create_task(self._score_in_background_async(context))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        return context
+
+    def _needs_background_scoring(self, context: ModerationContext) -> bool:
+        return (
+            self.background_scoring_stage is not None
+            and (context.moderation_result is None or context.decided_by == LocalScoringStage.name)
+            and not context.moderation_unavailable
+            # messages from blocked or throttled sessions aren't worth scoring
+            and context.decided_by != SessionStateStage.name
+        )
+
+    def _score_in_background(self, context: ModerationContext) -> None:
+        background_context = ModerationContext(context.text, context.moderation_text)
+        try:
+            self.background_scoring_stage.run(background_context)
+            self.background_callback(context, background_context.moderation_result)
+        except Exception as e:
+            logger.warning(f"Background moderation scoring failed: {e!r}")
+
+    async def _score_in_background_async(self, context: ModerationContext) -> None:
+        background_context = ModerationContext(context.text, context.moderation_text)
+        try:
+            await self.background_scoring_stage.run_async(background_context)
+            self.background_callback(context, background_context.moderation_result)
+        except Exception as e:
+            logger.warning(f"Background moderation scoring failed: {e!r}")
@@ -0,0 +1,27 @@
+"""Moderation providers: anything that scores text with the same result shape as the OpenAI Moderation API.
+
+See moderation.OpenAIModerationProvider and local_provider.LocalModerationProvider.
+"""
+
+
+class ModerationProvider:
+    """Scores text for moderation.
+
+    Results are dicts with at least "category_scores" ({category: score between 0 and 1}),
+    plus "flagged", "categories", and "request_duration", like OpenAI Moderation API results.
+    The model identifies the provider's scores, e.g. in cache keys.
+    """
+
+    model = "provider"
+
+    def score_batch(self, inputs: list[str]) -> list[dict]:
+        raise NotImplementedError()
+
+    def score(self, input: str) -> dict:
+        return self.score_batch([input])[0]
+
+    async def score_batch_async(self, inputs: list[str]) -> list[dict]:
+        return self.score_batch(inputs)
+
+    async def score_async(self, input: str) -> dict:
+        return (await self.score_batch_async([input]))[0]
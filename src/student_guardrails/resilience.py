@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from student_guardrails import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class ModerationUnavailableError(Exception):
+    """A call could not be completed within its deadline, or was rejected by an open circuit breaker."""
+
+
+class CircuitOpenError(ModerationUnavailableError):
+    pass
+
+
+class DeadlineExceededError(ModerationUnavailableError):
+    pass
+
+
+class Deadline:
+    def __init__(self, timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self.clock())
+
+
+def get_backoff_delay(attempt: int, initial_backoff: float, max_backoff: float, rng: random.Random = random) -> float:
+    """Exponential backoff with full jitter: uniform between 0 and min(max_backoff, initial_backoff * 2 ** attempt).
+
+    The jitter keeps clients that failed at the same time from retrying at the same time.
+    """
+    return rng.uniform(0, min(max_backoff, initial_backoff * 2**attempt))
+
+
+class CircuitBreaker:
+    """Fails fast while the recent failure rate is high, instead of letting every caller wait on a failing service.
+
+    Closed: calls are allowed; outcomes from the last `window` seconds are tracked.
+    Once at least minimum_calls outcomes are tracked and failure_rate_threshold of them are failures, the circuit opens.
+    Open: calls are rejected for open_duration seconds, then the circuit is half-open.
+    Half-open: up to half_open_max_calls trial calls are allowed; a success closes the circuit, a failure reopens it.
+
+    Every allowed call must end in record_success(), record_failure(), or record_ignored(),
+    otherwise its half-open slot is never released.
+    """
+
+    def __init__(
+        self,
+        failure_rate_threshold: float = 0.5,
+        minimum_calls: int = 10,
+        window: float = 30,
+        open_duration: float = 30,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self.state = CIRCUIT_CLOSED
+        # (time, failed) for each call in the window
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._failure_count = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        self.rejected_count = 0
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                if self.clock() < self._opened_at + self.open_duration:
+                    self.rejected_count += 1
+                    return False
+                self._transition(CIRCUIT_HALF_OPEN)
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self.rejected_count += 1
+                    return False
+                self._half_open_calls += 1
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self._transition(CIRCUIT_CLOSED)
+            elif self.state == CIRCUIT_CLOSED:
+                self._record_outcome(False)
+
+    def record_ignored(self) -> None:
+        """The call ended without saying anything about the service's health, e.g. with a 400 response."""
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self._transition(CIRCUIT_OPEN)
+            elif self.state == CIRCUIT_CLOSED:
+                self._record_outcome(True)
+                call_count = len(self._outcomes)
+                if call_count >= self.minimum_calls and self._failure_count / call_count >= self.failure_rate_threshold:
+                    self._transition(CIRCUIT_OPEN)
+
+    def _record_outcome(self, failed: bool) -> None:
+        now = self.clock()
+        self._outcomes.append((now, failed))
+        self._failure_count += failed
+        while len(self._outcomes) > 0 and self._outcomes[0][0] <= now - self.window:
+            _, evicted_failed = self._outcomes.popleft()
+            self._failure_count -= evicted_failed
+
+    def _transition(self, state: str) -> None:
+        if state == CIRCUIT_OPEN:
+            logger.warning(f"Circuit breaker opened; failing fast for {self.open_duration}s.")
+            self._opened_at = self.clock()
+        elif state == CIRCUIT_HALF_OPEN:
+            self._half_open_calls = 0
+        elif state == CIRCUIT_CLOSED:
+            logger.info("Circuit breaker closed.")
+        self._outcomes.clear()
+        self._failure_count = 0
+        self.state = state
+        metrics.increment("guardrails_circuit_breaker_transitions_total", state=state)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls_in_window": len(self._outcomes),
+                "failures_in_window": self._failure_count,
+                "rejected": self.rejected_count,
+            }
+
+
+class RetryPolicy:
+    """Retries a call with jittered exponential backoff, within an overall deadline.
+
+    The function is called with the time remaining before the deadline (capped at attempt_timeout),
+    which it should use as its own timeout. Only errors for which is_retryable() is True are retried;
+    other errors are raised immediately. If the deadline passes, or would pass during the next backoff,
+    DeadlineExceededError is raised; if the circuit breaker rejects a call, CircuitOpenError is raised.
+    """
+
+    def __init__(
+        self,
+        deadline: float = 8.0,
+        attempt_timeout: float = 10.0,
+        initial_backoff: float = 0.25,
+        max_backoff: float = 2.0,
+        is_retryable: Callable[[Exception], bool] = lambda e: True,
+        circuit_breaker: CircuitBreaker | None = None,
+        name: str = "call",
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        sleep_async: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.is_retryable = is_retryable
+        self.circuit_breaker = circuit_breaker
+        self.name = name
+        self.clock = clock
+        self.sleep = sleep
+        self.sleep_async = sleep_async
+
+    def call(self, function: Callable[[float], T]) -> T:
+        deadline = Deadline(self.deadline, self.clock)
+        attempt = 0
+        while True:
+            timeout = self._start_attempt(deadline)
+            try:
+                result = function(timeout)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt, deadline)
+                self.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self._handle_interruption()
+                raise
+            self._handle_success()
+            return result
+
+    async def call_async(self, function: Callable[[float], Awaitable[T]]) -> T:
+        deadline = Deadline(self.deadline, self.clock)
+        attempt = 0
+        while True:
+            timeout = self._start_attempt(deadline)
+            try:
+                # also bounds time spent outside the request itself, e.g. waiting for a concurrency slot
+                result = await asyncio.wait_for(function(timeout), timeout=timeout)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt, deadline)
+                await self.sleep_async(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # e.g. asyncio.CancelledError when the caller disconnects or an outer timeout fires
+                self._handle_interruption()
+                raise
+            self._handle_success()
+            return result
+
+    def _start_attempt(self, deadline: Deadline) -> float:
+        timeout = deadline.remaining()
+        if timeout <= 0:
+            raise DeadlineExceededError(f"{self.name}: deadline of {self.deadline}s exceeded.")
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            metrics.increment("guardrails_circuit_breaker_rejections_total", call=self.name)
+            raise CircuitOpenError(f"{self.name}: circuit breaker is open.")
+        return min(timeout, self.attempt_timeout)
+
+    def _handle_success(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+    def _handle_interruption(self) -> None:
+        """The attempt was cancelled or interrupted, e.g. by the caller; that says nothing about the service's health.
+
+        It's still recorded, to release the attempt's half-open slot, which would otherwise stay taken forever.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_ignored()
+
+    def _handle_failure(self, e: Exception, attempt: int, deadline: Deadline) -> float:
+        """Re-raise e if it shouldn't be retried; otherwise return the delay before the next attempt."""
+        timed_out = isinstance(e, asyncio.TimeoutError)
+        if not timed_out and not self.is_retryable(e):
+            # the service responded, so this doesn't count against it; but it isn't a success either,
+            # e.g. a 401 during a half-open trial shouldn't close the circuit
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_ignored()
+            raise e
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+        delay = get_backoff_delay(attempt, self.initial_backoff, self.max_backoff)
+        if deadline.remaining() <= delay:
+            raise DeadlineExceededError(
+                f"{self.name}: deadline of {self.deadline}s exceeded after {attempt + 1} attempts.",
+            ) from e
+        logger.warning(f"{self.name} failed (attempt {attempt + 1}), retrying in {delay:.2f}s: {e!r}")
+        metrics.increment("guardrails_retries_total", call=self.name)
+        return delay
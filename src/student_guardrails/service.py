@@ -0,0 +1,498 @@
+"""An HTTP moderation service, so frontends can share one set of word lists, clients, and caches.
+
+Usage:
+    python -m student_guardrails.service --port 8080 --workers 4 --cache-path moderation-cache.sqlite3
+
+Endpoints (all POST bodies and responses are JSON):
+    POST /v1/moderation/input   {"input_text": str, "previous_messages": [str], "activity_session_id": str,
+                                "user_id": str} -> see get_input_moderation_data(); the ids are optional
+    POST /v1/moderation/output  {"output": str} -> see get_output_moderation_data()
+    POST /v1/rules/input        {"input_message": str, "input_moderation_data": dict, ...}
+                                -> {"action": str, "response": str | None}; other keys, except "category",
+                                are passed to the alert
+    POST /v1/rules/output       {"generation": str, "output_moderation_data": dict} -> {"generation": str}
+    POST /v1/sessions/review    {"activity_session_id": str} or {"user_id": str} -> {"session_state": dict};
+                                unblocks a session blocked pending review, see session_state. Requires an
+                                "Authorization: Bearer <token>" header matching MODERATION_SESSION_REVIEW_TOKEN,
+                                and is disabled if that isn't set
+    GET  /health                -> {"status": "ok", "pid": int}
+    GET  /metrics               -> this worker's metrics, in the Prometheus text format
+
+A POST body may also be a list of such objects. Every item is validated before any is handled, so an invalid item
+fails the whole batch without side effects; the items are then handled concurrently, and the response is a list of
+results in the same order. An item that fails while being handled gets {"error": str} in place of its result, so the
+other items' results (and side effects, such as alert emails) aren't lost to a retry.
+Other errors are returned as {"error": str} with a 4xx or 5xx status.
+
+Apart from session review, the endpoints aren't authenticated: the service is meant to be reached only by trusted
+frontends, so it binds to 127.0.0.1 by default. Put it behind an authenticating proxy before exposing it further.
+
+Workers are separate processes accepting connections from the same listening socket. They share results through
+a SQLite cache (see cache.SQLiteModerationCache), plus a per-worker in-memory cache if MODERATION_CACHE_MAX_SIZE is set.
+Pass --session-state-path to share session state between workers as well.
+Other configuration, such as OPENAI_MODERATION_BATCHING, is read from the environment as usual.
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections.abc import Awaitable, Callable
+
+from student_guardrails import cache, metrics, moderation, session_state
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_BODY_SIZE = 1 << 20
+MAX_BATCH_SIZE = 256
+HTTP_STATUS_PHRASES = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+# a handler validates its request item, and returns the call that handles it
+Handler = Callable[[dict], Callable[[], Awaitable[dict]]]
+
+
+class InvalidRequestError(ValueError):
+    pass
+
+
+def get_field(item: dict, name: str, field_type: type, default=None):
+    value = item.get(name, default)
+    if not isinstance(value, field_type):
+        raise InvalidRequestError(f"'{name}' must be a {field_type.__name__}.")
+    return value
+
+
+def get_moderation_data(item: dict, name: str, required_keys: list[str]) -> dict:
+    moderation_data = get_field(item, name, dict)
+    for key in required_keys:
+        if key not in moderation_data:
+            raise InvalidRequestError(f"'{name}' is missing '{key}'.")
+    return moderation_data
+
+
+def get_session_ids(item: dict) -> dict[str, str | None]:
+    """The optional activity_session_id and user_id; integer ids are accepted too."""
+    session_ids = {}
+    for name in ["activity_session_id", "user_id"]:
+        value = item.get(name)
+        if value is not None and (not isinstance(value, (str, int)) or isinstance(value, bool)):
+            raise InvalidRequestError(f"'{name}' must be a str or an int.")
+        session_ids[name] = None if value is None else str(value)
+    return session_ids
+
+
+class ModerationService:
+    """Routes HTTP requests to the moderation functions.
+
+    review_token is the bearer token required by POST /v1/sessions/review; session review is disabled without one.
+    """
+
+    def __init__(self, review_token: str | None = None):
+        self.review_token = review_token
+        self.routes: dict[str, dict[str, Handler]] = {
+            "/v1/moderation/input": {"POST": self.moderate_input},
+            "/v1/moderation/output": {"POST": self.moderate_output},
+            "/v1/rules/input": {"POST": self.apply_input_rules},
+            "/v1/rules/output": {"POST": self.apply_output_rules},
+            "/v1/sessions/review": {"POST": self.review_session},
+        }
+        self.authenticated_paths = {"/v1/sessions/review"}
+
+    def moderate_input(self, item: dict) -> Callable[[], Awaitable[dict]]:
+        input_text = get_field(item, "input_text", str)
+        previous_messages = get_field(item, "previous_messages", list, default=[])
+        if not all(isinstance(message, str) for message in previous_messages):
+            raise InvalidRequestError("'previous_messages' must be a list of strings.")
+        session_ids = get_session_ids(item)
+
+        async def call() -> dict:
+            return await moderation.get_input_moderation_data_async(input_text, previous_messages, **session_ids)
+
+        return call
+
+    def moderate_output(self, item: dict) -> Callable[[], Awaitable[dict]]:
+        output = get_field(item, "output", str)
+
+        async def call() -> dict:
+            return await moderation.get_output_moderation_data_async(output)
+
+        return call
+
+    def apply_input_rules(self, item: dict) -> Callable[[], Awaitable[dict]]:
+        input_message = get_field(item, "input_message", str)
+        input_moderation_data = get_moderation_data(
+            item,
+            "input_moderation_data",
+            ["disallowed_words_in_input", "openai_moderation_result"],
+        )
+        if "category" in item:
+            # the alert's category is decided by the rules, not by the client
+            raise InvalidRequestError("'category' can't be set.")
+        kwargs = {key: value for key, value in item.items() if key not in {"input_message", "input_moderation_data"}}
+
+        async def call() -> dict:
+            action, response = moderation.apply_input_moderation_rules(input_message, input_moderation_data, **kwargs)
+            return {"action": action, "response": response}
+
+        return call
+
+    def apply_output_rules(self, item: dict) -> Callable[[], Awaitable[dict]]:
+        generation = get_field(item, "generation", str)
+        output_moderation_data = get_moderation_data(
+            item,
+            "output_moderation_data",
+            ["disallowed_words_in_output", "openai_moderation_result"],
+        )
+
+        async def call() -> dict:
+            return {"generation": moderation.apply_output_moderation_rules(generation, output_moderation_data)}
+
+        return call
+
+    def review_session(self, item: dict) -> Callable[[], Awaitable[dict]]:
+        session_key = moderation.get_session_key(**get_session_ids(item))
+        if session_key is None:
+            raise InvalidRequestError("'activity_session_id' or 'user_id' is required.")
+        session_state_store = moderation.get_session_state_store()
+        if session_state_store is None:
+            raise InvalidRequestError("Session state is not enabled, see MODERATION_SESSION_STATE_SQLITE_PATH.")
+
+        async def call() -> dict:
+            return {"session_state": session_state_store.mark_reviewed(session_key)}
+
+        return call
+
+    def is_authorized(self, headers: dict[str, str]) -> bool:
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        return (
+            self.review_token is not None
+            and scheme.lower() == "bearer"
+            and hmac.compare_digest(token.strip().encode("utf-8"), self.review_token.encode("utf-8"))
+        )
+
+    async def handle_request(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+        headers: dict[str, str] | None = None,
+    ) -> tuple[int, dict | list | str]:
+        """Returns the status code and the response content; strings are sent as plain text.
+
+        headers are the request's headers, with lowercase names.
+        """
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok", "pid": os.getpid()}
+        if path == "/metrics" and method == "GET":
+            return 200, metrics.format_prometheus_text(metrics.get_snapshot())
+        if path not in self.routes:
+            return 404, {"error": f"Unknown path {path}."}
+        handler = self.routes[path].get(method)
+        if handler is None:
+            return 405, {"error": f"{method} is not allowed for {path}."}
+        if path in self.authenticated_paths:
+            if self.review_token is None:
+                return 403, {"error": f"{path} is disabled; set MODERATION_SESSION_REVIEW_TOKEN to enable it."}
+            if not self.is_authorized(headers or {}):
+                return 401, {"error": "A valid 'Authorization: Bearer <token>' header is required."}
+        try:
+            content = json.loads(body)
+            if isinstance(content, list):
+                if len(content) > MAX_BATCH_SIZE:
+                    raise InvalidRequestError(f"Batches are limited to {MAX_BATCH_SIZE} items.")
+                if not all(isinstance(item, dict) for item in content):
+                    raise InvalidRequestError("Each batch item must be an object.")
+                # validate every item before handling any, so that an invalid item can't leave the batch half-done
+                calls = [handler(item) for item in content]
+                results = await asyncio.gather(*[call() for call in calls], return_exceptions=True)
+                for result in results:
+                    if isinstance(result, BaseException) and not isinstance(result, Exception):
+                        raise result
+                    if isinstance(result, Exception):
+                        logger.error(f"Failed to handle a batch item for {method} {path}", exc_info=result)
+                return 200, [{"error": repr(result)} if isinstance(result, Exception) else result for result in results]
+            if not isinstance(content, dict):
+                raise InvalidRequestError("The body must be an object or a list of objects.")
+            return 200, await handler(content)()
+        except (InvalidRequestError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            logger.exception(f"Failed to handle {method} {path}")
+            return 500, {"error": repr(e)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves HTTP/1.1 requests on one connection, keeping it open between requests unless asked to close it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if request_line == b"":
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+                except ValueError:
+                    await self.write_response(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in {b"\r\n", b"\n", b""}:
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                if "transfer-encoding" in headers:
+                    await self.write_response(writer, 411, {"error": "Content-Length is required."}, keep_alive=False)
+                    break
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError()
+                except ValueError:
+                    # without a valid length, the body can't be told apart from the next request
+                    await self.write_response(writer, 400, {"error": "Invalid Content-Length."}, keep_alive=False)
+                    break
+                if content_length > MAX_REQUEST_BODY_SIZE:
+                    await self.write_response(writer, 413, {"error": "Request body too large."}, keep_alive=False)
+                    break
+                body = await reader.readexactly(content_length)
+                path = target.split("?", 1)[0]
+                start_time = time.perf_counter()
+                status, content = await self.handle_request(method, path, body, headers)
+                metrics.observe(
+                    "guardrails_service_request_duration_seconds", time.perf_counter() - start_time, path=path
+                )
+                metrics.increment("guardrails_service_requests_total", path=path, status=str(status))
+                await self.write_response(writer, status, content, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            # the client went away or sent something we can't parse; there's no one to respond to
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        content: dict | list | str,
+        keep_alive: bool,
+    ) -> None:
+        if isinstance(content, str):
+            body = content.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(content).encode("utf-8")
+            content_type = "application/json"
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_STATUS_PHRASES.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n"
+            ).encode("latin-1")
+            + body,
+        )
+        await writer.drain()
+
+    async def serve(self, sock: socket.socket, stop_event: asyncio.Event) -> None:
+        """Accept connections on the listening socket until stop_event is set."""
+        server = await asyncio.start_server(self.handle_connection, sock=sock)
+        async with server:
+            await stop_event.wait()
+        await moderation.close_async_openai_client()
+
+
+def create_service_cache(cache_path: str) -> cache.ModerationCache:
+    """A SQLite cache shared by all workers, behind a per-worker in-memory cache if MODERATION_CACHE_MAX_SIZE is set."""
+    persistent_cache = cache.SQLiteModerationCache(cache_path, ttl=moderation.MODERATION_CACHE_TTL)
+    if moderation.MODERATION_CACHE_MAX_SIZE > 0:
+        memory_cache = cache.InMemoryModerationCache(
+            max_size=moderation.MODERATION_CACHE_MAX_SIZE,
+            ttl=moderation.MODERATION_CACHE_TTL,
+        )
+        return cache.TieredModerationCache(memory_cache, persistent_cache)
+    return persistent_cache
+
+
+def run_worker(
+    sock: socket.socket,
+    cache_path: str | None,
+    ready_queue: multiprocessing.Queue,
+    session_state_path: str | None = None,
+    review_token: str | None = None,
+) -> None:
+    """Entry point for a worker process; serves until it receives SIGTERM or SIGINT."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    if cache_path is not None:
+        moderation.set_moderation_cache(create_service_cache(cache_path))
+    if session_state_path is not None:
+        moderation.set_session_state_store(
+            session_state.SQLiteSessionStateStore(
+                session_state_path,
+                max_strikes=moderation.MODERATION_SESSION_MAX_STRIKES,
+                throttle_duration=moderation.MODERATION_SESSION_THROTTLE_DURATION,
+            ),
+        )
+
+    async def run() -> None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, stop_event.set)
+        serve_task = asyncio.create_task(ModerationService(review_token).serve(sock, stop_event))
+        ready_queue.put(os.getpid())
+        await serve_task
+
+    asyncio.run(run())
+
+
+class ModerationServer:
+    """Runs the service in worker processes that share one listening socket; port 0 picks a free port.
+
+    Use as a context manager, or call start() and stop(); serve_forever() also replaces workers that exit.
+    review_token defaults to MODERATION_SESSION_REVIEW_TOKEN, see ModerationService.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        workers: int = 1,
+        cache_path: str | None = None,
+        backlog: int = 1024,
+        session_state_path: str | None = None,
+        review_token: str | None = moderation.MODERATION_SESSION_REVIEW_TOKEN,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache_path = cache_path
+        self.session_state_path = session_state_path
+        self.review_token = review_token
+        self.backlog = backlog
+        # spawn rather than fork, so workers don't inherit clients, threads, or locks from the parent
+        self._context = multiprocessing.get_context("spawn")
+        self._ready_queue = self._context.Queue()
+        self._socket: socket.socket | None = None
+        self._processes: list[multiprocessing.Process] = []
+        self._stopping = False
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 60) -> str:
+        """Start the workers and wait until they're all accepting connections; returns base_url."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(self.backlog)
+        self.port = self._socket.getsockname()[1]
+        for _ in range(self.workers):
+            self._start_worker()
+        for _ in range(self.workers):
+            self._ready_queue.get(timeout=timeout)
+        logger.info(f"Serving moderation at {self.base_url} with {self.workers} workers.")
+        return self.base_url
+
+    def _start_worker(self) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(self._socket, self.cache_path, self._ready_queue, self.session_state_path, self.review_token),
+            name="moderation-service-worker",
+            daemon=True,
+        )
+        process.start()
+        self._processes.append(process)
+
+    def serve_forever(self, poll_interval: float = 1.0) -> None:
+        """Block until stopped, replacing any worker that exits unexpectedly."""
+        while not self._stopping:
+            for process in list(self._processes):
+                if not process.is_alive() and not self._stopping:
+                    logger.warning(f"Worker {process.pid} exited with code {process.exitcode}; replacing it.")
+                    self._processes.remove(process)
+                    self._start_worker()
+            time.sleep(poll_interval)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Ask the workers to finish in-flight requests and exit; kill any that don't within the timeout."""
+        self._stopping = True
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self._processes = []
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self) -> "ModerationServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve moderation over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--cache-path",
+        default=moderation.MODERATION_CACHE_SQLITE_PATH or "moderation-cache.sqlite3",
+        help="SQLite file for the result cache shared by the workers.",
+    )
+    parser.add_argument(
+        "--session-state-path",
+        default=moderation.MODERATION_SESSION_STATE_SQLITE_PATH,
+        help="SQLite file for the session state shared by the workers; by default, session state is not kept.",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+    server = ModerationServer(
+        args.host,
+        args.port,
+        args.workers,
+        args.cache_path,
+        session_state_path=args.session_state_path,
+    )
+    server.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
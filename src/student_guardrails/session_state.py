@@ -0,0 +1,227 @@
+"""Per-session moderation state: which sessions are blocked pending review, and how many strikes each has.
+
+Once a message ends the conversation, the student has been told that Rori won't reply until someone has reviewed it,
+so later messages from that session can be answered without moderating them (see pipeline.SessionStateStage).
+Sessions are keyed by activity session or by user, see moderation.get_session_key().
+
+A session's state is a dict:
+    blocked (bool): True from an end_conversation action until mark_reviewed() is called.
+    review_status (str): "none", "pending" (blocked and awaiting review), or "reviewed".
+    strikes (int): the number of try_again actions caused by a message's content, over the session's lifetime.
+    throttled_until (float | None): time at which a throttle ends; every max_strikes strikes start a throttle.
+    updated_at (float): time of the last change.
+Times come from the store's clock, time.time() by default, so that they are comparable between processes.
+"""
+
+import copy
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+from student_guardrails import moderation_responses
+
+SESSION_STATUS_BLOCKED = "blocked"
+SESSION_STATUS_THROTTLED = "throttled"
+REVIEW_STATUS_NONE = "none"
+REVIEW_STATUS_PENDING = "pending"
+REVIEW_STATUS_REVIEWED = "reviewed"
+
+
+def get_new_state(now: float) -> dict:
+    return {
+        "blocked": False,
+        "review_status": REVIEW_STATUS_NONE,
+        "strikes": 0,
+        "throttled_until": None,
+        "updated_at": now,
+    }
+
+
+def get_session_status(state: dict | None, now: float) -> str | None:
+    """ "blocked", "throttled", or None if the session's messages should be moderated as usual."""
+    if state is None:
+        return None
+    if state["blocked"]:
+        return SESSION_STATUS_BLOCKED
+    if state["throttled_until"] is not None and now < state["throttled_until"]:
+        return SESSION_STATUS_THROTTLED
+    return None
+
+
+class SessionStateStore:
+    """Interface for session state stores.
+
+    Subclasses implement _get(), _update(), and _delete(); _update() must apply its function atomically.
+    Throttling is disabled unless max_strikes is positive.
+    """
+
+    def __init__(self, max_strikes: int = 0, throttle_duration: float = 300, clock: Callable[[], float] = time.time):
+        self.max_strikes = max_strikes
+        self.throttle_duration = throttle_duration
+        self.clock = clock
+
+    def get(self, key: str) -> dict | None:
+        return self._get(key)
+
+    def get_status(self, key: str) -> str | None:
+        """A single lookup by key; see get_session_status()."""
+        return get_session_status(self._get(key), self.clock())
+
+    def record_action(self, key: str, action: str) -> dict:
+        """Record the action taken on one of the session's messages; returns the new state."""
+        now = self.clock()
+
+        def update(state: dict) -> None:
+            if action == moderation_responses.ACTION_END_CONVERSATION:
+                state["blocked"] = True
+                state["review_status"] = REVIEW_STATUS_PENDING
+            elif action == moderation_responses.ACTION_TRY_AGAIN:
+                state["strikes"] += 1
+                if self.max_strikes > 0 and state["strikes"] % self.max_strikes == 0:
+                    state["throttled_until"] = now + self.throttle_duration
+            state["updated_at"] = now
+
+        return self._update(key, update, now)
+
+    def mark_reviewed(self, key: str) -> dict:
+        """Unblock the session after someone has reviewed it; strikes are kept."""
+        now = self.clock()
+
+        def update(state: dict) -> None:
+            state["blocked"] = False
+            state["review_status"] = REVIEW_STATUS_REVIEWED
+            state["throttled_until"] = None
+            state["updated_at"] = now
+
+        return self._update(key, update, now)
+
+    def delete(self, key: str) -> None:
+        self._delete(key)
+
+    def _get(self, key: str) -> dict | None:
+        raise NotImplementedError()
+
+    def _update(self, key: str, update: Callable[[dict], None], now: float) -> dict:
+        raise NotImplementedError()
+
+    def _delete(self, key: str) -> None:
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+
+class InMemorySessionStateStore(SessionStateStore):
+    """Thread-safe store for a single process, keeping at most max_size sessions.
+
+    The least-recently-updated sessions are forgotten first, which unblocks them;
+    their messages are then moderated as usual.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        max_strikes: int = 0,
+        throttle_duration: float = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(max_strikes, throttle_duration, clock)
+        self.max_size = max_size
+        self._states: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> dict | None:
+        state = self._states.get(key)
+        return copy.copy(state) if state is not None else None
+
+    def _update(self, key: str, update: Callable[[dict], None], now: float) -> dict:
+        with self._lock:
+            state = copy.copy(self._states.get(key)) or get_new_state(now)
+            update(state)
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+            return copy.copy(state)
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+class SQLiteSessionStateStore(SessionStateStore):
+    """Persistent store that can be shared by multiple worker processes on the same host.
+
+    Uses one connection per thread. Updates run in an immediate transaction, so concurrent updates from different
+    processes are serialized rather than lost.
+    """
+
+    COLUMNS = ["blocked", "review_status", "strikes", "throttled_until", "updated_at"]
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_strikes: int = 0,
+        throttle_duration: float = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(max_strikes, throttle_duration, clock)
+        self.path = str(path)
+        self._local = threading.local()
+        self._get_connection().execute(
+            "CREATE TABLE IF NOT EXISTS session_state (key TEXT PRIMARY KEY, blocked INTEGER NOT NULL, "
+            "review_status TEXT NOT NULL, strikes INTEGER NOT NULL, throttled_until REAL, updated_at REAL NOT NULL)",
+        )
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # autocommit, so that _update() can begin its own immediate transaction
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get(self, key: str) -> dict | None:
+        row = (
+            self._get_connection()
+            .execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM session_state WHERE key = ?",
+                (key,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        state = dict(zip(self.COLUMNS, row))
+        state["blocked"] = bool(state["blocked"])
+        return state
+
+    def _update(self, key: str, update: Callable[[dict], None], now: float) -> dict:
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._get(key) or get_new_state(now)
+            update(state)
+            connection.execute(
+                f"INSERT OR REPLACE INTO session_state (key, {', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, *[state[column] for column in self.COLUMNS]),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return state
+
+    def _delete(self, key: str) -> None:
+        self._get_connection().execute("DELETE FROM session_state WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        return self._get_connection().execute("SELECT COUNT(*) FROM session_state").fetchone()[0]
@@ -0,0 +1,168 @@
+import logging
+import re
+
+from student_guardrails import moderation, moderation_responses, resilience, word_matcher
+
+logger = logging.getLogger(__name__)
+
+# a segment ends after sentence-ending punctuation or a line break, followed by whitespace
+SEGMENT_BOUNDARY_PATTERN = re.compile(r"[.!?\n][\"')\]]*\s+")
+
+
+class StreamingOutputModerator:
+    """Moderates an LLM generation as it is streamed, so approved text can be shown before the generation finishes.
+
+    Chunks are buffered until a segment boundary (the end of a sentence or line),
+    then the segment is scored and passed through apply_output_moderation_rules():
+    disallowed words are redacted, and if any score crosses OPENAI_MODERATION_CATEGORY_OUTPUT_THRESHOLD
+    the generation is aborted. After an abort, no more text is approved and get_generation()
+    returns BAD_GENERATION_RESPONSE; the caller should replace any text it has already shown.
+
+    The last max_term_length characters of the buffer are always held back, so a disallowed word
+    split across chunks is redacted once it is complete (and "ass" is not redacted if the next chunk makes it "assert").
+
+    Each segment is scored on its own, which is less context than get_output_moderation_data() has
+    for the complete generation.
+
+    Usage:
+        moderator = StreamingOutputModerator()
+        for chunk in llm_stream:
+            send_to_student(moderator.feed(chunk))
+        send_to_student(moderator.finish())
+        if moderator.aborted:
+            replace_message(moderator.get_generation())
+    """
+
+    def __init__(self, min_segment_length: int = 40, max_segment_length: int = 1000):
+        self.min_segment_length = min_segment_length
+        # segments are cut at whitespace (or at any word boundary, as a last resort) if no boundary is found within
+        # this length; a single word longer than this is held until it ends
+        self.max_segment_length = max_segment_length
+        self.matcher = moderation.get_disallowed_output_matcher()
+        self.buffer = ""
+        self.approved_segments: list[str] = []
+        self.moderation_results: list[dict] = []
+        self.disallowed_words: set[str] = set()
+        self.aborted = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of the generation.
+
+        Returns:
+            str: Newly-approved text, possibly empty.
+        """
+        self.buffer += chunk
+        approved = []
+        while not self.aborted and (segment := self._next_segment(final=False)) is not None:
+            approved.append(self._apply_rules(segment, self._score(segment)))
+        return "".join(approved)
+
+    def finish(self) -> str:
+        """Moderate the rest of the generation; returns newly-approved text."""
+        segment = self._next_segment(final=True)
+        if self.aborted or segment is None:
+            return ""
+        if segment.strip() == "":
+            self.approved_segments.append(segment)
+            return segment
+        return self._apply_rules(segment, self._score(segment))
+
+    async def feed_async(self, chunk: str) -> str:
+        """Async version of feed()."""
+        self.buffer += chunk
+        approved = []
+        while not self.aborted and (segment := self._next_segment(final=False)) is not None:
+            approved.append(self._apply_rules(segment, await self._score_async(segment)))
+        return "".join(approved)
+
+    async def finish_async(self) -> str:
+        """Async version of finish()."""
+        segment = self._next_segment(final=True)
+        if self.aborted or segment is None:
+            return ""
+        if segment.strip() == "":
+            self.approved_segments.append(segment)
+            return segment
+        return self._apply_rules(segment, await self._score_async(segment))
+
+    def get_generation(self) -> str:
+        """The moderated generation so far: all approved text, or BAD_GENERATION_RESPONSE if aborted."""
+        if self.aborted:
+            return moderation_responses.BAD_GENERATION_RESPONSE
+        return "".join(self.approved_segments)
+
+    def _next_segment(self, final: bool) -> str | None:
+        """Remove and return the next segment to moderate from the buffer, or None if it isn't ready yet."""
+        if final:
+            cut = len(self.buffer) if self.buffer != "" else None
+        else:
+            cut = self._find_cut()
+        if cut is None:
+            return None
+        segment, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return segment
+
+    def _find_cut(self) -> int | None:
+        # text after safe_end could still turn out to be part of a disallowed word
+        safe_end = len(self.buffer) - max(self.matcher.max_term_length, 1)
+        if safe_end < self.min_segment_length:
+            return None
+        cut = None
+        for match in SEGMENT_BOUNDARY_PATTERN.finditer(self.buffer, max(self.min_segment_length - 1, 0), safe_end + 1):
+            if match.end() <= safe_end:
+                cut = match.end()
+                break
+        if cut is None:
+            if len(self.buffer) < self.max_segment_length:
+                return None
+            whitespace_index = max(self.buffer.rfind(" ", 0, safe_end), self.buffer.rfind("\n", 0, safe_end))
+            if whitespace_index >= self.min_segment_length:
+                cut = whitespace_index + 1
+            else:
+                # back up to the previous word boundary, since a word's first part could be redacted on its own
+                cut = safe_end
+                while (
+                    cut > 0
+                    and word_matcher.is_word_char(self.buffer[cut - 1])
+                    and word_matcher.is_word_char(self.buffer[cut])
+                ):
+                    cut -= 1
+                if cut == 0:
+                    return None
+        # never cut through a disallowed word
+        for start, end, _ in self.matcher.find_matches(self.buffer):
+            if start < cut < end:
+                cut = end
+        return cut
+
+    def _score(self, segment: str) -> dict | None:
+        try:
+            return moderation.get_openai_moderation_results(segment)
+        except resilience.ModerationUnavailableError as e:
+            logger.warning(f"Moderation scores unavailable for a streamed segment, using the fallback: {e!r}")
+            return None
+
+    async def _score_async(self, segment: str) -> dict | None:
+        try:
+            return await moderation.get_openai_moderation_results_async(segment)
+        except resilience.ModerationUnavailableError as e:
+            logger.warning(f"Moderation scores unavailable for a streamed segment, using the fallback: {e!r}")
+            return None
+
+    def _apply_rules(self, segment: str, moderation_result: dict | None) -> str:
+        """moderation_result is None if scores were unavailable; see moderation.MODERATION_FALLBACK_MODE."""
+        if moderation_result is not None:
+            self.moderation_results.append(moderation_result)
+        disallowed_words = self.matcher.find_terms(segment)
+        self.disallowed_words |= disallowed_words
+        output_moderation_data = {
+            "disallowed_words_in_output": sorted(disallowed_words),
+            "openai_moderation_result": moderation_result,
+        }
+        approved = moderation.apply_output_moderation_rules(segment, output_moderation_data)
+        if approved == moderation_responses.BAD_GENERATION_RESPONSE:
+            self.aborted = True
+            self.buffer = ""
+            return ""
+        self.approved_segments.append(approved)
+        return approved
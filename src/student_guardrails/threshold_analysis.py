@@ -0,0 +1,250 @@
+"""Replay stored moderation scores under candidate threshold configurations.
+
+Example, in a notebook:
+
+    replay = threshold_analysis.ThresholdReplay.from_jsonl("data/derived/moderation.jsonl", label_key="should_moderate")
+    grid = threshold_analysis.get_threshold_grid({"violence": np.linspace(0.05, 0.95, 19), "harassment": [0.3, 0.5]})
+    results = pd.DataFrame(replay.sweep(grid))
+"""
+
+import itertools
+import json
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from student_guardrails import moderation, moderation_responses
+
+# action codes used in the decision arrays
+INPUT_ACTIONS = [
+    moderation_responses.ACTION_NO_ACTION,
+    moderation_responses.ACTION_TRY_AGAIN,
+    moderation_responses.ACTION_END_CONVERSATION,
+]
+NO_ACTION_CODE = INPUT_ACTIONS.index(moderation_responses.ACTION_NO_ACTION)
+
+
+def get_category_action_codes(categories: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Action code and alert flag for each category, matching moderation.get_input_moderation_decision()."""
+    action_codes = np.full(len(categories), NO_ACTION_CODE, dtype=np.int8)
+    alerts = np.zeros(len(categories), dtype=bool)
+    for i, category in enumerate(categories):
+        actions = moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP[category]
+        if moderation_responses.ACTION_TRY_AGAIN in actions:
+            action_codes[i] = INPUT_ACTIONS.index(moderation_responses.ACTION_TRY_AGAIN)
+        elif moderation_responses.ACTION_END_CONVERSATION in actions:
+            action_codes[i] = INPUT_ACTIONS.index(moderation_responses.ACTION_END_CONVERSATION)
+        alerts[i] = moderation_responses.ACTION_EMAIL_ALERT in actions
+    return action_codes, alerts
+
+
+def get_threshold_vector(
+    thresholds: dict[str, float] | None = None,
+    categories: list[str] = moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST,
+) -> np.ndarray:
+    """Thresholds in category order; categories not in thresholds use the configured threshold."""
+    thresholds = {} if thresholds is None else thresholds
+    return np.array(
+        [
+            thresholds.get(category, moderation.OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP[category])
+            for category in categories
+        ],
+        dtype=np.float64,
+    )
+
+
+def get_threshold_grid(
+    category_values: dict[str, Iterable[float]],
+    base_thresholds: dict[str, float] | None = None,
+    categories: list[str] = moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST,
+) -> np.ndarray:
+    """All combinations of the given per-category threshold values, one configuration per row.
+
+    Categories not in category_values keep their threshold from base_thresholds, or the configured threshold.
+    """
+    base_vector = get_threshold_vector(base_thresholds, categories)
+    swept_categories = list(category_values.keys())
+    combinations = list(itertools.product(*[list(values) for values in category_values.values()]))
+    grid = np.tile(base_vector, (len(combinations), 1))
+    for j, category in enumerate(swept_categories):
+        grid[:, categories.index(category)] = [combination[j] for combination in combinations]
+    return grid
+
+
+class ThresholdReplay:
+    """Vectorized replay of the input moderation rules over stored category scores.
+
+    Args:
+        category_scores (np.ndarray): One row per message, one column per category (in `categories` order).
+        has_disallowed_words (np.ndarray | None): Per message, whether the word list matched; this supersedes scores.
+        labels (np.ndarray | None): Per message, 1 if moderation should act, 0 if not, NaN if unlabeled.
+        categories (list[str]): Column order; this is also the priority order in which thresholds are checked.
+    """
+
+    def __init__(
+        self,
+        category_scores: np.ndarray,
+        has_disallowed_words: np.ndarray | None = None,
+        labels: np.ndarray | None = None,
+        categories: list[str] = moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST,
+    ):
+        self.category_scores = np.asarray(category_scores, dtype=np.float64)
+        n_messages = self.category_scores.shape[0]
+        if has_disallowed_words is None:
+            has_disallowed_words = np.zeros(n_messages, dtype=bool)
+        self.has_disallowed_words = np.asarray(has_disallowed_words, dtype=bool)
+        self.labels = None if labels is None else np.asarray(labels, dtype=np.float64)
+        self.categories = list(categories)
+        if len(self.categories) > 20:
+            # the decision lookup tables below have 2 ** (categories + 1) entries
+            raise ValueError("At most 20 categories are supported.")
+        category_action_codes, category_alerts = get_category_action_codes(self.categories)
+        disallowed_words_action_code = INPUT_ACTIONS.index(
+            moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP["disallowed_words"][0],
+        )
+        # Decisions are looked up by a bitmask of the categories over their thresholds, with bit i for column i.
+        # The lowest set bit is the highest-priority category; an extra top bit marks disallowed words.
+        self.words_bit = 1 << len(self.categories)
+        masks = np.arange(self.words_bit * 2)
+        category_masks = masks & (self.words_bit - 1)
+        first_category = np.full(len(masks), -1)
+        for i in reversed(range(len(self.categories))):
+            first_category[(category_masks >> i) & 1 == 1] = i
+        has_words = (masks & self.words_bit) > 0
+        triggered = first_category >= 0
+        self.action_table = np.where(
+            has_words,
+            disallowed_words_action_code,
+            np.where(triggered, category_action_codes[first_category], NO_ACTION_CODE),
+        ).astype(np.int8)
+        self.category_table = np.where(has_words, -1, first_category)
+        self.alert_table = ~has_words & triggered & category_alerts[first_category]
+        self.mask_dtype = np.uint16 if len(self.categories) < 16 else np.uint32
+
+    @classmethod
+    def from_records(
+        cls,
+        records: Iterable[dict],
+        label_key: str | None = None,
+        categories: list[str] = moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST,
+    ) -> "ThresholdReplay":
+        """Build from result rows of bulk_moderation or from input moderation data dicts.
+
+        Records with a "direction" other than input, or without scores, are skipped.
+        """
+        scores = []
+        has_disallowed_words = []
+        labels = []
+        for record in records:
+            if record.get("direction", "I") != "I":
+                continue
+            if "openai_moderation_result" in record:
+                moderation_result = record["openai_moderation_result"]
+                category_scores = moderation_result["category_scores"] if moderation_result is not None else None
+                disallowed_words = record.get("disallowed_words_in_input", [])
+            else:
+                category_scores = record.get("category_scores")
+                disallowed_words = record.get("disallowed_words", [])
+            if category_scores is None:
+                continue
+            scores.append([category_scores.get(category, 0.0) for category in categories])
+            has_disallowed_words.append(len(disallowed_words) > 0)
+            if label_key is not None:
+                label = record.get(label_key)
+                labels.append(np.nan if label is None else float(label))
+        return cls(
+            np.array(scores, dtype=np.float64).reshape(-1, len(categories)),
+            np.array(has_disallowed_words, dtype=bool),
+            np.array(labels, dtype=np.float64) if label_key is not None else None,
+            categories,
+        )
+
+    @classmethod
+    def from_jsonl(cls, path: str | Path, label_key: str | None = None) -> "ThresholdReplay":
+        with open(path) as infile:
+            return cls.from_records((json.loads(line) for line in infile if line.strip() != ""), label_key)
+
+    def get_decisions(self, thresholds: dict[str, float] | np.ndarray | None = None) -> dict[str, np.ndarray]:
+        """Per-message decisions for one threshold configuration (by default, the configured thresholds).
+
+        Returns:
+            dict: "action" (index into INPUT_ACTIONS), "category" (column index, or -1 if no threshold was crossed),
+                and "alert" (whether an alert email would be sent).
+        """
+        if thresholds is None or isinstance(thresholds, dict):
+            thresholds = get_threshold_vector(thresholds, self.categories)
+        decisions = self._get_decisions(np.asarray(thresholds, dtype=np.float64)[None, :])
+        return {key: value[0] for key, value in decisions.items()}
+
+    def _get_masks(self, threshold_matrix: np.ndarray) -> np.ndarray:
+        """Bitmask of the categories over their thresholds, shape (configurations, messages)."""
+        masks = np.zeros((threshold_matrix.shape[0], self.category_scores.shape[0]), dtype=self.mask_dtype)
+        masks[:, self.has_disallowed_words] = self.words_bit
+        for i in range(len(self.categories)):
+            # swept grids repeat each threshold many times, so compare once per distinct threshold
+            thresholds, configuration_indices = np.unique(threshold_matrix[:, i], return_inverse=True)
+            category_bits = (self.category_scores[None, :, i] >= thresholds[:, None]).astype(self.mask_dtype) << i
+            if len(thresholds) == 1:
+                masks |= category_bits[0]
+            else:
+                masks |= category_bits[configuration_indices]
+        return masks
+
+    def _get_decisions(self, threshold_matrix: np.ndarray) -> dict[str, np.ndarray]:
+        masks = self._get_masks(threshold_matrix)
+        return {
+            "action": self.action_table[masks],
+            "category": self.category_table[masks],
+            "alert": self.alert_table[masks],
+        }
+
+    def sweep(self, threshold_matrix: np.ndarray, max_chunk_elements: int = 10_000_000) -> dict[str, np.ndarray]:
+        """Evaluate many threshold configurations at once.
+
+        Args:
+            threshold_matrix (np.ndarray): One configuration per row, one column per category.
+            max_chunk_elements (int): Bounds memory use; configurations are evaluated in chunks of about this many
+                (configuration, message) pairs.
+
+        Returns:
+            dict[str, np.ndarray]: One value per configuration: a count per action in INPUT_ACTIONS, "alerts",
+                and, if labels were given, "precision" and "recall" of taking any action on the labeled messages.
+        """
+        threshold_matrix = np.atleast_2d(np.asarray(threshold_matrix, dtype=np.float64))
+        n_configurations = threshold_matrix.shape[0]
+        chunk_size = max(1, max_chunk_elements // max(1, self.category_scores.shape[0]))
+        results = {action: np.zeros(n_configurations, dtype=np.int64) for action in INPUT_ACTIONS}
+        results["alerts"] = np.zeros(n_configurations, dtype=np.int64)
+        acting = self.action_table != NO_ACTION_CODE
+        # 0 for unlabeled messages, 1 for negative labels, 2 for positive labels
+        label_classes = np.zeros(self.category_scores.shape[0], dtype=np.int64)
+        if self.labels is not None:
+            label_classes[self.labels == 0] = 1
+            label_classes[self.labels > 0] = 2
+            results["precision"] = np.full(n_configurations, np.nan)
+            results["recall"] = np.full(n_configurations, np.nan)
+        for start in range(0, n_configurations, chunk_size):
+            end = min(start + chunk_size, n_configurations)
+            masks = self._get_masks(threshold_matrix[start:end])
+            # every message with the same mask gets the same decision, so count masks rather than decisions
+            mask_counts = self._count_masks(masks, label_classes)
+            total_counts = mask_counts.sum(axis=2)
+            for code, action in enumerate(INPUT_ACTIONS):
+                results[action][start:end] = total_counts[:, self.action_table == code].sum(axis=1)
+            results["alerts"][start:end] = total_counts[:, self.alert_table].sum(axis=1)
+            if self.labels is not None:
+                predicted_positives = mask_counts[:, acting, 1:].sum(axis=(1, 2))
+                true_positives = mask_counts[:, acting, 2].sum(axis=1)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    results["precision"][start:end] = true_positives / predicted_positives
+                    results["recall"][start:end] = true_positives / (label_classes == 2).sum()
+        return results
+
+    def _count_masks(self, masks: np.ndarray, label_classes: np.ndarray) -> np.ndarray:
+        """Number of messages with each mask and label class, shape (configurations, masks, 3)."""
+        n_configurations = masks.shape[0]
+        n_masks = len(self.action_table)
+        keys = (masks + np.arange(n_configurations, dtype=np.int64)[:, None] * n_masks) * 3 + label_classes
+        counts = np.bincount(keys.ravel(), minlength=n_configurations * n_masks * 3)
+        return counts.reshape(n_configurations, n_masks, 3)
@@ -0,0 +1,168 @@
+import os
+import pickle
+from collections import deque
+from collections.abc import Iterable
+from pathlib import Path
+
+# bump when WordListMatcher's internal state changes, to invalidate existing snapshots
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+class WordListMatcher:
+    """Finds and redacts terms from a word list in a single linear scan of the text.
+
+    The terms are compiled into an Aho-Corasick automaton, so scan time depends on the length of the text
+    but not on the number of terms. Matching is case-insensitive, treats any run of whitespace as a single space
+    (so multi-word phrases match across line breaks), and respects word boundaries:
+    "ass" matches in "ass!" but not in "class".
+    Overlapping matches are resolved leftmost-longest.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        # trie transitions, failure links, and (term length, term) outputs for each state
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._outputs: list[tuple[tuple[int, str], ...]] = [()]
+        self.terms: set[str] = set()
+        for term in terms:
+            term = normalize_term(term)
+            if term != "":
+                self._add_term(term)
+        self._build_failure_links()
+        self.max_term_length = max((len(term) for term in self.terms), default=0)
+
+    def get_state(self) -> tuple:
+        """The compiled automaton, as built-in types only; see from_state()."""
+        return self._goto, self._fail, self._outputs, self.terms, self.max_term_length
+
+    @classmethod
+    def from_state(cls, state: tuple) -> "WordListMatcher":
+        """Restore a matcher from get_state() without recompiling it, which is several times faster."""
+        matcher = cls.__new__(cls)
+        matcher._goto, matcher._fail, matcher._outputs, matcher.terms, matcher.max_term_length = state
+        return matcher
+
+    def _add_term(self, term: str) -> None:
+        self.terms.add(term)
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(())
+            state = next_state
+        self._outputs[state] = ((len(term), term),)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state != 0 and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def _scan(self, text: str) -> list[tuple[int, int, str]]:
+        """Returns all word-boundary-respecting matches as (start, end, term), with offsets into text."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = []
+        # original text index of each character fed to the automaton
+        positions = []
+        state = 0
+        previous_was_space = True
+        for index, original_char in enumerate(text):
+            if original_char.isspace():
+                if previous_was_space:
+                    continue
+                folded = " "
+                previous_was_space = True
+            else:
+                folded = original_char.lower()
+                previous_was_space = False
+            for char in folded:
+                positions.append(index)
+                while state != 0 and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                for term_length, term in outputs[state]:
+                    start = positions[len(positions) - term_length]
+                    end = index + 1
+                    if is_word_char(term[0]) and start > 0 and is_word_char(text[start - 1]):
+                        continue
+                    if is_word_char(term[-1]) and end < len(text) and is_word_char(text[end]):
+                        continue
+                    matches.append((start, end, term))
+        return matches
+
+    def find_matches(self, text: str) -> list[tuple[int, int, str]]:
+        """Non-overlapping matches as (start, end, term), in order of position in the text."""
+        if len(self.terms) == 0:
+            return []
+        selected = []
+        last_end = 0
+        for start, end, term in sorted(self._scan(text), key=lambda match: (match[0], -match[1])):
+            if start >= last_end:
+                selected.append((start, end, term))
+                last_end = end
+        return selected
+
+    def find_terms(self, text: str) -> set[str]:
+        return {term for _, _, term in self.find_matches(text)}
+
+    def redact(self, text: str, replacement: str = "") -> tuple[str, set[str]]:
+        """Replace every matched term in text.
+
+        Returns:
+            str: The redacted text.
+            set[str]: The terms that were found.
+        """
+        matches = self.find_matches(text)
+        if len(matches) == 0:
+            return text, set()
+        pieces = []
+        last_end = 0
+        for start, end, _ in matches:
+            pieces.append(text[last_end:start])
+            pieces.append(replacement)
+            last_end = end
+        pieces.append(text[last_end:])
+        return "".join(pieces), {term for _, _, term in matches}
+
+
+def save_snapshot(path: str | Path, matchers: dict[str, WordListMatcher], source_hash: str) -> None:
+    """Save compiled matchers by name, with a hash of the word lists they were compiled from."""
+    snapshot = {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "source_hash": source_hash,
+        "matchers": {name: matcher.get_state() for name, matcher in matchers.items()},
+    }
+    temporary_path = Path(str(path) + ".tmp")
+    with open(temporary_path, "wb") as outfile:
+        pickle.dump(snapshot, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path: str | Path, source_hash: str) -> dict[str, WordListMatcher] | None:
+    """Load matchers saved with save_snapshot(), or None if they were compiled from other word lists.
+
+    Snapshots are pickles, so only load snapshots you wrote.
+    """
+    with open(path, "rb") as infile:
+        snapshot = pickle.load(infile)
+    if snapshot.get("version") != SNAPSHOT_FORMAT_VERSION or snapshot.get("source_hash") != source_hash:
+        return None
+    return {name: WordListMatcher.from_state(state) for name, state in snapshot["matchers"].items()}
@@ -6,7 +6,7 @@ from openai.types.moderation import Categories, CategoryScores, Moderation
 from openai.types.moderation_create_response import ModerationCreateResponse
 
 
-def mock_get_openai_moderation_results(input: str, category_scores: dict | float = 0.0001):
+def mock_get_openai_moderation_results(input: str, category_scores: dict | float = 0.0001, **kwargs):
     from student_guardrails import moderation
 
     openai_moderation_result = {
@@ -23,12 +23,20 @@ def mock_get_openai_moderation_results(input: str, category_scores: dict | float
     return openai_moderation_result
 
 
+async def mock_get_openai_moderation_results_async(input: str, category_scores: dict | float = 0.0001, **kwargs):
+    return mock_get_openai_moderation_results(input, category_scores)
+
+
 @pytest.fixture
 def patch_get_openai_moderation_results(monkeypatch):
     monkeypatch.setattr(
         "student_guardrails.moderation.get_openai_moderation_results",
         mock_get_openai_moderation_results,
     )
+    monkeypatch.setattr(
+        "student_guardrails.moderation.get_openai_moderation_results_async",
+        mock_get_openai_moderation_results_async,
+    )
 
 
 @pytest.fixture
@@ -42,29 +50,46 @@ def patch_send_alert_email(monkeypatch):
     return mock_send_alert_email
 
 
+def mock_moderation_result(input: str) -> Moderation:
+    field_scores = {field: 0.001 for field in CategoryScores.model_json_schema()["required"]}
+    for field in field_scores.keys():
+        if field in input:
+            score_override = re.search(f"{field}=(\\d*.\\d+)", input)
+            if score_override:
+                field_scores[field] = float(score_override.group(1))
+    moderation_fields = {}
+    if "category_applied_input_types" in Moderation.model_fields:
+        moderation_fields["category_applied_input_types"] = {field: ["text"] for field in field_scores}
+    return Moderation(
+        categories=Categories(**{field: False for field in field_scores}),
+        category_scores=CategoryScores(**field_scores),
+        flagged=False,
+        **moderation_fields,
+    )
+
+
 def mock_openai_moderation(*args, **kwargs) -> ModerationCreateResponse:
-    field_scores = {field: 0.001 for field in Categories.model_json_schema()["required"]}
-    if "input" in kwargs:
-        input = kwargs["input"]
-        for field in field_scores.keys():
-            if field in input:
-                score_override = re.search(f"{field}=(\\d*.\\d+)", input)
-                if score_override:
-                    field_scores[field] = float(score_override.group(1))
+    inputs = kwargs.get("input", "")
+    if type(inputs) is str:
+        inputs = [inputs]
     return ModerationCreateResponse(
         id="fake-moderation-response-id",
         model="latest",
-        results=[
-            Moderation(
-                categories=Categories(**{field: False for field in Categories.model_json_schema()["required"]}),
-                category_scores=CategoryScores(**field_scores),
-                flagged=False,
-            ),
-        ],
+        results=[mock_moderation_result(input) for input in inputs],
     )
 
 
+async def mock_async_openai_moderation(*args, **kwargs) -> ModerationCreateResponse:
+    return mock_openai_moderation(*args, **kwargs)
+
+
 @pytest.fixture(scope="function")
 def patch_openai(monkeypatch) -> None:
-    monkeypatch.setenv("OPENAI_API_KEY", "")
+    monkeypatch.setenv("OPENAI_API_KEY", "fake-api-key")
     monkeypatch.setattr("openai.resources.moderations.Moderations.create", mock_openai_moderation)
+
+
+@pytest.fixture(scope="function")
+def patch_async_openai(monkeypatch) -> None:
+    monkeypatch.setenv("OPENAI_API_KEY", "fake-api-key")
+    monkeypatch.setattr("openai.resources.moderations.AsyncModerations.create", mock_async_openai_moderation)
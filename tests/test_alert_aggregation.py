@@ -0,0 +1,116 @@
+from unittest.mock import Mock
+
+import pytest
+
+from student_guardrails import alert_aggregation
+
+
+@pytest.fixture
+def patch_dispatch_alert_email(monkeypatch):
+    mock_dispatch_alert_email = Mock(return_value=True)
+    monkeypatch.setattr("student_guardrails.email_alerts.dispatch_alert_email", mock_dispatch_alert_email)
+    return mock_dispatch_alert_email
+
+
+def get_alert(category: str, activity_session_id: str | None = "session-1") -> dict:
+    return {
+        "input_message": f"Message in {category}",
+        "category": category,
+        "input_moderation_data": {},
+        "activity_session_id": activity_session_id,
+    }
+
+
+def test_alert_aggregator_digest(patch_dispatch_alert_email):
+    now = 0
+
+    def clock():
+        return now
+
+    aggregator = alert_aggregation.AlertAggregator(window=60, clock=clock)
+    assert aggregator.submit(get_alert("violence"))
+    assert patch_dispatch_alert_email.call_count == 1
+    # follow-ups from the same session in the same category are folded
+    assert not aggregator.submit(get_alert("violence"))
+    assert not aggregator.submit(get_alert("violence"))
+    # other sessions are not affected
+    assert aggregator.submit(get_alert("violence", activity_session_id="session-2"))
+    assert patch_dispatch_alert_email.call_count == 2
+
+    assert aggregator.flush_expired() == 0
+    now = 61
+    assert aggregator.flush_expired() == 1
+    assert patch_dispatch_alert_email.call_count == 3
+    subject, content = patch_dispatch_alert_email.call_args.args
+    assert "2 follow-up alerts" in subject
+    assert "violence (2)" in content
+    assert "session-1" in content
+    # session-2 had no follow-ups, so its window closed without a digest
+    assert aggregator.get_stats() == {"immediate": 2, "folded": 2, "digests": 1, "open_groups": 0}
+
+    # after the window, the next alert is sent immediately again
+    assert aggregator.submit(get_alert("violence"))
+
+
+def test_alert_aggregator_escalation(patch_dispatch_alert_email):
+    now = 0
+
+    def clock():
+        return now
+
+    aggregator = alert_aggregation.AlertAggregator(window=60, clock=clock)
+    assert aggregator.submit(get_alert("violence"))
+    assert not aggregator.submit(get_alert("violence"))
+    # a new category isn't held for the window
+    now = 1
+    assert aggregator.submit(get_alert("violence/graphic"))
+    assert not aggregator.submit(get_alert("violence/graphic"))
+    # nor is a category that ends the conversation, even if it repeats
+    assert aggregator.submit(get_alert("self-harm/intent"))
+    assert aggregator.submit(get_alert("self-harm/intent"))
+    assert patch_dispatch_alert_email.call_count == 4
+    subject, _ = patch_dispatch_alert_email.call_args.args
+    assert "self-harm/intent" in subject
+
+    # the window stays open from the first alert, and the digest only has the repeats
+    now = 61
+    assert aggregator.flush_expired() == 1
+    _, content = patch_dispatch_alert_email.call_args.args
+    assert "violence (1), violence/graphic (1)" in content
+    assert aggregator.get_stats() == {"immediate": 4, "folded": 2, "digests": 1, "open_groups": 0}
+
+
+def test_alert_aggregator_rate_limits(patch_dispatch_alert_email):
+    now = 0
+
+    def clock():
+        return now
+
+    aggregator = alert_aggregation.AlertAggregator(
+        window=60,
+        category_rate_limit=1,
+        global_rate_limit=2,
+        rate_limit_period=100,
+        clock=clock,
+    )
+    assert aggregator.submit(get_alert("violence", activity_session_id="session-1"))
+    # per-category limit
+    assert not aggregator.submit(get_alert("violence", activity_session_id="session-2"))
+    assert aggregator.submit(get_alert("self-harm", activity_session_id="session-3"))
+    # global limit
+    assert not aggregator.submit(get_alert("hate/threatening", activity_session_id=None))
+    assert patch_dispatch_alert_email.call_count == 2
+
+    # rate-limited digests wait for the global limit
+    now = 61
+    assert aggregator.flush_expired() == 0
+    now = 101
+    assert aggregator.flush_expired() == 2
+    assert patch_dispatch_alert_email.call_count == 4
+
+    # digests count toward the global limit
+    assert not aggregator._within_global_rate_limit(now)
+    now = 202
+    assert aggregator.submit(get_alert("violence", activity_session_id=None))
+    assert not aggregator.submit(get_alert("violence", activity_session_id=None))
+    assert aggregator.flush() == 1
@@ -0,0 +1,100 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from student_guardrails import batching, cache, moderation
+
+
+def test_moderation_batcher():
+    batch_calls = []
+
+    async def batch_function(inputs: list[str]) -> list[dict]:
+        batch_calls.append(inputs)
+        return [{"input": input} for input in inputs]
+
+    async def submit_all(batcher, inputs):
+        return await asyncio.gather(*[batcher.submit(input) for input in inputs])
+
+    # flushes when the batch is full
+    batcher = batching.ModerationBatcher(batch_function, max_batch_size=3, max_wait=60)
+    outputs = asyncio.run(submit_all(batcher, ["a", "b", "c"]))
+    assert [output["input"] for output in outputs] == ["a", "b", "c"]
+    assert all("request_duration" in output for output in outputs)
+    assert batch_calls == [["a", "b", "c"]]
+
+    # flushes after max_wait, sending duplicates only once
+    batch_calls.clear()
+    batcher = batching.ModerationBatcher(batch_function, max_batch_size=10, max_wait=0.001)
+    outputs = asyncio.run(submit_all(batcher, ["a", "b", "a"]))
+    assert [output["input"] for output in outputs] == ["a", "b", "a"]
+    assert outputs[0] is not outputs[2]
+    assert batch_calls == [["a", "b"]]
+
+
+def test_moderation_batcher_failure():
+    async def batch_function(inputs: list[str]) -> list[dict]:
+        raise ValueError("API unavailable")
+
+    async def submit():
+        batcher = batching.ModerationBatcher(batch_function, max_batch_size=2, max_wait=0.001)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    outputs = asyncio.run(submit())
+    assert all(isinstance(output, ValueError) for output in outputs)
+
+    with pytest.raises(ValueError):
+        batching.ModerationBatcher(batch_function, max_batch_size=0)
+
+
+def test_get_moderation_data_async_batched(patch_async_openai, monkeypatch):
+    monkeypatch.setattr("student_guardrails.moderation.OPENAI_MODERATION_BATCHING", True)
+
+    async def moderate():
+        batcher = moderation.get_moderation_batcher()
+        results = await asyncio.gather(
+            moderation.get_input_moderation_data_async("violence=0.7"),
+            moderation.get_output_moderation_data_async("Let's practice fractions!"),
+        )
+        assert len(batcher._pending) == 0
+        await moderation.close_async_openai_client()
+        return results
+
+    input_moderation_data, output_moderation_data = asyncio.run(moderate())
+    assert input_moderation_data["openai_moderation_result"]["category_scores"]["violence"] == 0.7
+    assert output_moderation_data["openai_moderation_result"]["category_scores"]["violence"] == 0.001
+
+
+def test_batched_results_are_cached_once(patch_async_openai, monkeypatch):
+    monkeypatch.setattr("student_guardrails.moderation.OPENAI_MODERATION_BATCHING", True)
+    moderation_cache = cache.InMemoryModerationCache()
+    cache_get = Mock(wraps=moderation_cache.get)
+    cache_set = Mock(wraps=moderation_cache.set)
+    monkeypatch.setattr(moderation_cache, "get", cache_get)
+    monkeypatch.setattr(moderation_cache, "set", cache_set)
+    monkeypatch.setattr(moderation, "_moderation_cache", moderation_cache)
+    monkeypatch.setattr(moderation, "_moderation_cache_initialized", True)
+
+    async def moderate():
+        results = await asyncio.gather(
+            moderation.get_openai_moderation_results_async("violence=0.7", check_cache=False),
+            moderation.get_openai_moderation_results_async("hate=0.2"),
+        )
+        await moderation.close_async_openai_client()
+        return results
+
+    results = asyncio.run(moderate())
+    assert results[0]["category_scores"]["violence"] == 0.7
+    assert not results[0]["cache_hit"]
+    # only the caller that asked for it checks the cache, and each result is stored once
+    assert cache_get.call_count == 1
+    assert cache_set.call_count == 2
+    assert moderation.get_cached_moderation_results("hate=0.2")["cache_hit"]
+
+
+def test_get_openai_moderation_results_batch(patch_openai):
+    outputs = moderation.get_openai_moderation_results_batch(["violence=0.7", "hate=0.2", "Hi!"])
+    assert len(outputs) == 3
+    assert outputs[0]["category_scores"]["violence"] == 0.7
+    assert outputs[1]["category_scores"]["hate"] == 0.2
+    assert outputs[2]["category_scores"]["hate"] == 0.001
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from student_guardrails import bulk_moderation, moderation_responses
+
+
+def write_messages(path, count: int):
+    with open(path, "w") as outfile:
+        outfile.write(json.dumps({"model": "content.user", "pk": 1, "fields": {"properties": {}}}) + "\n")
+        for i in range(count):
+            direction = "O" if i % 2 == 1 else "I"
+            text = "violence=0.9" if i == 2 else f"What is {i} + {i}?"
+            fields = {"text": text, "direction": direction, "activity_session": i // 4}
+            outfile.write(json.dumps({"model": "content.message", "pk": i, "fields": fields}) + "\n")
+        # empty messages are skipped
+        outfile.write(json.dumps({"model": "content.message", "pk": count, "fields": {"text": "", "direction": "I"}}))
+        outfile.write("\n")
+
+
+def test_parse_message_record():
+    assert bulk_moderation.parse_message_record({"model": "content.user", "pk": 1, "fields": {"text": "x"}}) is None
+    assert bulk_moderation.parse_message_record({"id": 3, "text": "Hi", "direction": "O"}) == {
+        "id": 3,
+        "activity_session": None,
+        "direction": "O",
+        "text": "Hi",
+    }
+
+
+def test_run_bulk_moderation(patch_async_openai, tmp_path):
+    input_path = tmp_path / "messages.jsonl"
+    output_path = tmp_path / "moderation.jsonl"
+    write_messages(input_path, 10)
+
+    # simulate an interrupted run by stopping early, then resume
+    bulk_moderation.main([str(input_path), str(output_path), "--batch-size", "2", "--max-messages", "3"])
+    with open(output_path) as infile:
+        assert len(infile.readlines()) == 3
+    bulk_moderation.main([str(input_path), str(output_path), "--batch-size", "2", "--concurrency", "2"])
+
+    with open(output_path) as infile:
+        rows = [json.loads(line) for line in infile]
+    assert [row["id"] for row in rows] == list(range(10))
+    assert rows[2]["action"] == moderation_responses.ACTION_TRY_AGAIN
+    assert rows[2]["category"] == "violence"
+    assert rows[2]["max_moderation_score"] == 0.9
+    assert all(row["action"] == moderation_responses.ACTION_NO_ACTION for row in rows if row["id"] != 2)
+    with open(tmp_path / "moderation.jsonl.checkpoint.json") as infile:
+        assert json.load(infile)["messages_processed"] == 10
+
+    # re-running after completion does nothing, unless restarted
+    bulk_moderation.main([str(input_path), str(output_path)])
+    with open(output_path) as infile:
+        assert len(infile.readlines()) == 10
+    bulk_moderation.main([str(input_path), str(output_path), "--restart", "--max-messages", "4"])
+    with open(output_path) as infile:
+        assert len(infile.readlines()) == 4
+
+
+def test_remove_parts(tmp_path):
+    for name in ["part-000000.parquet", "part-000001.parquet", "part-000002.parquet", "notes.txt", "part-x.parquet"]:
+        (tmp_path / name).touch()
+    bulk_moderation.remove_parts(tmp_path, 1)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["notes.txt", "part-000000.parquet", "part-x.parquet"]
+    # e.g. --restart
+    bulk_moderation.remove_parts(tmp_path, 0)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["notes.txt", "part-x.parquet"]
+    bulk_moderation.remove_parts(tmp_path / "missing", 0)
+
+
+def test_parquet_output_requires_pyarrow(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(bulk_moderation.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(SystemExit):
+        bulk_moderation.main([str(tmp_path / "messages.jsonl"), str(tmp_path / "moderation.parquet")])
+    assert "requires pyarrow" in capsys.readouterr().err
+    assert not (tmp_path / "moderation.parquet").exists()
+
+
+def test_run_bulk_moderation_parquet_restart(patch_async_openai, tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    input_path = tmp_path / "messages.jsonl"
+    output_path = tmp_path / "moderation.parquet"
+    write_messages(input_path, 10)
+    bulk_moderation.main([str(input_path), str(output_path), "--batch-size", "2", "--concurrency", "1"])
+    assert len(list(output_path.iterdir())) == 5
+    bulk_moderation.main([str(input_path), str(output_path), "--restart", "--batch-size", "4", "--concurrency", "1"])
+    assert len(list(output_path.iterdir())) == 3
+    assert pyarrow_parquet.read_table(output_path).num_rows == 10
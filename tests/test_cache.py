@@ -0,0 +1,75 @@
+from student_guardrails import cache, moderation
+
+
+def test_get_cache_key():
+    assert cache.normalize_text("  Hi \n there ") == "hi there"
+    assert cache.get_cache_key("Hi there", "model") == cache.get_cache_key(" hi  THERE", "model")
+    assert cache.get_cache_key("Hi there", "model") != cache.get_cache_key("Hi there", "other-model")
+    assert cache.get_cache_key("Hi there", "model") != cache.get_cache_key("Hi where", "model")
+
+
+def test_in_memory_moderation_cache():
+    now = 0
+
+    def clock():
+        return now
+
+    moderation_cache = cache.InMemoryModerationCache(max_size=2, ttl=10, clock=clock)
+    assert moderation_cache.get("a") is None
+    moderation_cache.set("a", {"value": 1})
+    moderation_cache.set("b", {"value": 2})
+    value = moderation_cache.get("a")
+    assert value == {"value": 1}
+    # modifying a returned value doesn't modify the cache
+    value["value"] = 100
+    assert moderation_cache.get("a") == {"value": 1}
+
+    # "b" is least-recently used, so it is evicted
+    moderation_cache.set("c", {"value": 3})
+    assert moderation_cache.get("b") is None
+    assert moderation_cache.get("c") == {"value": 3}
+
+    now = 11
+    assert moderation_cache.get("c") is None
+    assert moderation_cache.get_stats() == {"hits": 3, "misses": 3, "evictions": 2, "size": 1}
+
+
+def test_sqlite_moderation_cache(tmp_path):
+    path = tmp_path / "moderation_cache.sqlite"
+    moderation_cache = cache.SQLiteModerationCache(path)
+    moderation_cache.set("a", {"value": 1})
+    assert moderation_cache.get("a") == {"value": 1}
+    assert moderation_cache.get("b") is None
+
+    # a second instance (e.g. in another worker process) shares the entries
+    other_cache = cache.SQLiteModerationCache(path)
+    assert other_cache.get("a") == {"value": 1}
+
+    expired_cache = cache.SQLiteModerationCache(path, ttl=-1)
+    expired_cache.set("c", {"value": 3})
+    assert expired_cache.get("c") is None
+    assert expired_cache.get_stats()["evictions"] == 1
+
+    tiered_cache = cache.TieredModerationCache(cache.InMemoryModerationCache(), cache.SQLiteModerationCache(path))
+    assert tiered_cache.get("a") == {"value": 1}
+    assert tiered_cache.memory_cache.get("a") == {"value": 1}
+    assert tiered_cache.get_stats()["hits"] == 1
+
+
+def test_get_openai_moderation_results_cached(patch_openai, monkeypatch):
+    moderation_cache = cache.InMemoryModerationCache()
+    monkeypatch.setattr("student_guardrails.moderation._moderation_cache", moderation_cache)
+    monkeypatch.setattr("student_guardrails.moderation._moderation_cache_initialized", True)
+
+    output = moderation.get_openai_moderation_results("violence=0.7")
+    assert not output["cache_hit"]
+    cached_output = moderation.get_openai_moderation_results("violence=0.7 ")
+    assert cached_output["cache_hit"]
+    assert cached_output["category_scores"] == output["category_scores"]
+    assert cached_output["cached_request_duration"] == output["request_duration"]
+    assert moderation_cache.get_stats()["hits"] == 1
+
+    outputs = moderation.get_openai_moderation_results_batch(["violence=0.7", "hate=0.2"])
+    assert outputs[0]["cache_hit"]
+    assert not outputs[1]["cache_hit"]
+    assert outputs[1]["category_scores"]["hate"] == 0.2
@@ -0,0 +1,69 @@
+import dataclasses
+import logging
+
+import pytest
+
+from student_guardrails import config, moderation
+
+
+def test_parse_threshold_overrides(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert config.parse_threshold_overrides("") == {}
+        assert caplog.records == []
+        assert config.parse_threshold_overrides(" violence = 0.3; ;hate=0.4;") == {"violence": 0.3, "hate": 0.4}
+        assert caplog.records == []
+        assert config.parse_threshold_overrides("violence=high;hate=0.4;sexual") == {"hate": 0.4}
+    assert len(caplog.records) == 2
+
+
+def test_get_category_thresholds(caplog):
+    thresholds = config.get_category_thresholds("violence=0.3;made-up=0.1")
+    assert thresholds["violence"] == 0.3
+    assert thresholds["hate"] == config.DEFAULT_CATEGORY_THRESHOLDS["hate"]
+    assert "made-up" not in thresholds
+    assert "made-up" in caplog.text
+    with pytest.raises(TypeError):
+        thresholds["violence"] = 0.9
+    # the defaults are unchanged
+    assert config.DEFAULT_CATEGORY_THRESHOLDS["violence"] == 0.5
+
+
+def test_moderation_config_from_environ():
+    assert config.ModerationConfig.from_environ({}) == config.ModerationConfig()
+    moderation_config = config.ModerationConfig.from_environ(
+        {
+            "OVERRIDE_MODERATION_THRESHOLDS": "violence=0.2",
+            "MODERATION_DEADLINE": "2.5",
+            "MODERATION_CIRCUIT_MIN_CALLS": "3",
+            "OPENAI_MODERATION_BATCHING": "Yes",
+            "MODERATION_CACHE_SQLITE_PATH": "",
+            "MODERATION_WORD_LIST_SNAPSHOT_PATH": "/tmp/word_lists.pickle",
+            "GUARDRAILS_METRICS_ENABLED": "on",
+            "ALERT_EMAIL_BACKGROUND_DELIVERY": "false",
+            "ALERT_EMAIL_QUEUE_SIZE": "10",
+            "ALERT_AGGREGATION_WINDOW": "0",
+            "SENDGRID_API_KEY": "secret-key",
+        },
+    )
+    assert moderation_config.category_thresholds["violence"] == 0.2
+    assert moderation_config.deadline == 2.5
+    assert moderation_config.circuit_min_calls == 3
+    assert moderation_config.batching
+    assert moderation_config.cache_sqlite_path is None
+    assert moderation_config.word_list_snapshot_path == "/tmp/word_lists.pickle"
+    assert moderation_config.metrics_enabled
+    assert not moderation_config.alert_email_background_delivery
+    assert moderation_config.alert_email_queue_size == 10
+    assert moderation_config.alert_aggregation_window == 0
+    assert moderation_config.alert_rate_limit_period == config.ModerationConfig().alert_rate_limit_period
+    assert moderation_config.sendgrid_api_key == "secret-key"
+    assert "secret-key" not in repr(moderation_config)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        moderation_config.deadline = 10
+
+
+def test_get_moderation_threshold_overrides(monkeypatch):
+    monkeypatch.setenv("OVERRIDE_MODERATION_THRESHOLDS", "violence=0.3;hate=0.4")
+    assert moderation.get_moderation_threshold_overrides() == {"violence": 0.3, "hate": 0.4}
+    monkeypatch.delenv("OVERRIDE_MODERATION_THRESHOLDS")
+    assert moderation.get_moderation_threshold_overrides() == {}
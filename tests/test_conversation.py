@@ -0,0 +1,62 @@
+import asyncio
+
+from conftest import mock_get_openai_moderation_results
+
+from student_guardrails import conversation, moderation, moderation_responses
+
+
+def test_conversation_moderation_session(monkeypatch):
+    moderated_inputs = []
+
+    def get_openai_moderation_results(input: str, **kwargs) -> dict:
+        moderated_inputs.append(input)
+        category_scores = 0.9 if "violent" in input else 0.0001
+        return mock_get_openai_moderation_results(input, category_scores)
+
+    monkeypatch.setattr("student_guardrails.moderation.get_openai_moderation_results", get_openai_moderation_results)
+
+    session = conversation.ConversationModerationSession(context_budget=20)
+    moderation_data = session.get_input_moderation_data("violent")
+    assert moderation_data["context_message_count"] == 0
+    action, _ = moderation.apply_input_moderation_rules("violent", moderation_data)
+    assert action != moderation_responses.ACTION_NO_ACTION
+
+    session.add_message("What is 2 + 2?")
+    moderation_data = session.get_input_moderation_data("4")
+    # only the tutor message fits in the budget alongside the new message
+    assert moderated_inputs[-1] == "What is 2 + 2?\n4"
+    assert moderation_data["context_message_count"] == 1
+    action, _ = moderation.apply_input_moderation_rules("4", moderation_data)
+    assert action == moderation_responses.ACTION_NO_ACTION
+
+    # the context sent per turn stays bounded as the conversation grows
+    for i in range(10):
+        session.add_message(f"What is {i} + 1?")
+        session.get_input_moderation_data(str(i + 1))
+    assert len(moderated_inputs[-1]) <= session.context_budget + len("\n")
+    assert len(session.turn_category_scores) == 12
+    assert session.history_max_scores["violence"] == 0.9
+
+
+def test_conversation_moderation_session_history_weight(patch_get_openai_moderation_results):
+    session = conversation.ConversationModerationSession(context_budget=10, history_weight=0.5)
+    session.add_message("Long evicted message", category_scores={"violence": 0.9})
+    assert len(session.context_messages) == 0
+
+    moderation_data = asyncio.run(session.get_input_moderation_data_async("Hi"))
+    moderation_result = moderation_data["openai_moderation_result"]
+    assert moderation_result["window_category_scores"]["violence"] == 0.0001
+    assert moderation_result["category_scores"]["violence"] == 0.45
+    assert moderation_result["category_scores"]["hate"] == 0.0001
+
+
+def test_conversation_moderation_session_long_input(patch_get_openai_moderation_results):
+    session = conversation.ConversationModerationSession(context_budget=30, history_weight=1.0)
+    session.add_message("Earlier message", category_scores={"violence": 0.9})
+    session.add_message("Hi")
+    assert len(session.get_context_window("A short input")) == 2
+    # the earlier message doesn't fit alongside a long input, so it's evicted and its scores kept
+    moderation_data = session.get_input_moderation_data("A much longer input message")
+    assert moderation_data["context_message_count"] == 1
+    assert session.history_max_scores == {"violence": 0.9}
+    assert moderation_data["openai_moderation_result"]["category_scores"]["violence"] == 0.9
@@ -1,5 +1,8 @@
+import threading
 from unittest.mock import Mock
 
+import sendgrid
+
 from student_guardrails import email_alerts
 
 
@@ -22,15 +25,66 @@ def test_send_alert_email(monkeypatch):
     )
     response_mock = Mock(status_code=200)
     api_object_mock = Mock(
-        spec=email_alerts.SendGridAPIClient,
+        spec=sendgrid.SendGridAPIClient,
         **{"send.return_value": response_mock},
     )
     api_mock = Mock(return_value=api_object_mock)
-    monkeypatch.setattr(
-        "student_guardrails.email_alerts.SendGridAPIClient",
-        api_mock,
-    )
+    monkeypatch.setattr(sendgrid, "SendGridAPIClient", api_mock)
+    email_alerts.get_sendgrid_client.cache_clear()
     assert email_alerts.send_alert_email("TestSubject", "TestContent")
     api_mock.assert_called_once()
     api_object_mock.send.assert_called_once()
     # TODO could inspect the Mail to api_mock's send() method, verifying that all of rori_generative_api.config.ALERT_EMAIL_RECIPIENTS are in the to field
+
+    # the client is reused
+    assert email_alerts.send_alert_email("TestSubject", "TestContent")
+    api_mock.assert_called_once()
+    email_alerts.get_sendgrid_client.cache_clear()
+
+
+def test_alert_dispatcher(patch_send_alert_email):
+    dispatcher = email_alerts.AlertDispatcher(max_queue_size=10)
+    for i in range(3):
+        assert dispatcher.dispatch(f"Subject {i}", "Content")
+    dispatcher.join()
+    assert patch_send_alert_email.call_count == 3
+    stats = dispatcher.get_stats()
+    assert stats["queue_depth"] == 0
+    assert stats["delivered"] == 3
+    assert stats["delivery_latency_max"] >= stats["delivery_latency_mean"] > 0
+    dispatcher.shutdown()
+
+
+def test_alert_dispatcher_retries(monkeypatch):
+    mock_send_alert_email = Mock(side_effect=[ConnectionError("SendGrid unavailable"), True, ConnectionError()] * 2)
+    monkeypatch.setattr("student_guardrails.email_alerts.send_alert_email", mock_send_alert_email)
+    dispatcher = email_alerts.AlertDispatcher(max_attempts=2, initial_backoff=0.001)
+    dispatcher.dispatch("Retried", "Content")
+    dispatcher.dispatch("Failed", "Content")
+    dispatcher.shutdown()
+    stats = dispatcher.get_stats()
+    assert stats["delivered"] == 1
+    assert stats["failed"] == 1
+    assert stats["retries"] == 2
+
+
+def test_alert_dispatcher_drops(monkeypatch):
+    sending = threading.Event()
+    release = threading.Event()
+
+    def blocking_send_alert_email(subject, content):
+        sending.set()
+        release.wait(timeout=5)
+        return True
+
+    monkeypatch.setattr("student_guardrails.email_alerts.send_alert_email", blocking_send_alert_email)
+    dispatcher = email_alerts.AlertDispatcher(max_queue_size=1)
+    assert dispatcher.dispatch("In progress", "Content")
+    assert sending.wait(timeout=5)
+    assert dispatcher.dispatch("Queued", "Content")
+    assert not dispatcher.dispatch("Dropped", "Content")
+    assert dispatcher.get_stats()["queue_depth"] == 1
+    release.set()
+    dispatcher.shutdown()
+    assert dispatcher.get_stats()["delivered"] == 2
+    assert dispatcher.get_stats()["dropped"] == 1
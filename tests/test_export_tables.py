@@ -0,0 +1,108 @@
+import json
+
+import pandas as pd
+import pytest
+
+from student_guardrails import export_tables
+
+RECORDS = [
+    {"model": "content.user", "pk": 1, "fields": {"properties": {"turn_author_id": "a", "topic": "fractions"}}},
+    {"model": "content.user", "pk": 2, "fields": {"properties": None}},
+    {"model": "content.user", "pk": 3, "fields": {"properties": {"turn_author_id": "b", "api_version": 2}}},
+    {
+        "model": "content.message",
+        "pk": 10,
+        "fields": {"text": "hi", "direction": "I", "activity_session": 5, "created_at": "2023-12-13T13:23:35.123Z"},
+    },
+    {
+        "model": "content.message",
+        "pk": 11,
+        "fields": {"text": "hello", "direction": "O", "activity_session": 5, "created_at": "2023-12-13T13:23:36Z"},
+    },
+    {"not": "a django record"},
+]
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    path = tmp_path / "export.jsonl"
+    with open(path, "w") as outfile:
+        for record in RECORDS:
+            outfile.write(json.dumps(record) + "\n")
+        outfile.write("\n")
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_read_export_tables(export_path, chunk_size):
+    tables = export_tables.read_export_tables(export_path, chunk_size=chunk_size)
+    assert set(tables.keys()) == {"user", "message"}
+    user_df = tables["user"]
+    assert list(user_df.pk) == [1, 2, 3]
+    assert "properties" not in user_df.columns
+    assert set(user_df.columns) == {"pk", "properties_turn_author_id", "properties_topic", "properties_api_version"}
+    assert user_df.properties_turn_author_id.tolist()[0] == "a"
+    assert pd.isna(user_df.properties_turn_author_id[1])
+    assert pd.isna(user_df.properties_topic[2])
+    assert user_df.properties_api_version[2] == 2
+
+    message_df = tables["message"]
+    assert message_df.pk.dtype == "int64"
+    assert message_df.activity_session.dtype == "int64"
+    assert message_df.text.tolist() == ["hi", "hello"]
+    # unflattened models and unparsed datetimes are left as-is
+    assert message_df.created_at[0] == "2023-12-13T13:23:35.123Z"
+
+
+def test_flatten_column_matches_apply():
+    df = pd.DataFrame({"pk": [1, 2, 3], "properties": [{"a": 1, "b": "x"}, {}, {"b": "y"}]})
+    expected_df = df.merge(
+        df.properties.apply(pd.Series).rename(columns=lambda column: "properties_" + column),
+        left_index=True,
+        right_index=True,
+    ).drop(columns="properties")
+    pd.testing.assert_frame_equal(export_tables.flatten_column(df, "properties"), expected_df)
+
+    # missing values become missing in every flattened column, rather than a column of their own
+    df.loc[1, "properties"] = float("nan")
+    flat_df = export_tables.flatten_column(df, "properties")
+    assert list(flat_df.columns) == ["pk", "properties_a", "properties_b"]
+    assert flat_df.iloc[1, 1:].isna().all()
+
+
+def test_parse_datetimes(export_path):
+    tables = export_tables.read_export_tables(export_path, parse_datetimes=True)
+    created_at = tables["message"].created_at
+    assert str(created_at.dtype) == "datetime64[ns, UTC]"
+    assert created_at[1] == pd.Timestamp("2023-12-13T13:23:36Z")
+
+
+def test_load_export_tables_without_pyarrow(export_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_tables, "is_parquet_available", lambda: False)
+    cache_dir = tmp_path / "cache"
+    tables = export_tables.load_export_tables(export_path, cache_dir=cache_dir)
+    assert len(tables["user"]) == 3
+    assert not cache_dir.exists()
+
+
+def test_load_export_tables_cache(export_path, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    cache_dir = tmp_path / "cache"
+    tables = export_tables.load_export_tables(export_path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the export should have been loaded from the cache")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(export_tables, "read_export_tables", fail)
+        cached_tables = export_tables.load_export_tables(export_path, cache_dir=cache_dir)
+    for model, df in tables.items():
+        pd.testing.assert_frame_equal(cached_tables[model], df)
+
+    # different contents or options get a new cache entry
+    export_tables.load_export_tables(export_path, cache_dir=cache_dir, parse_datetimes=True)
+    with open(export_path, "a") as outfile:
+        outfile.write(json.dumps({"model": "content.user", "pk": 4, "fields": {"properties": {}}}) + "\n")
+    assert len(export_tables.load_export_tables(export_path, cache_dir=cache_dir)["user"]) == 4
+    assert len(list(cache_dir.iterdir())) == 3
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from student_guardrails import fake_moderation_server, moderation
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    with fake_moderation_server.FakeModerationServer(seed=0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-api-key")
+        moderation.reset_openai_clients()
+        yield server
+    moderation.reset_openai_clients()
+
+
+def post_moderation_request(base_url: str, input: str | list[str]) -> dict:
+    request = urllib.request.Request(
+        base_url + "/moderations",
+        data=json.dumps({"input": input}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_fake_moderation_server(fake_server):
+    output = moderation.get_openai_moderation_results("violence=0.9 is parsed from the input", check_cache=False)
+    assert output["category_scores"]["violence"] == 0.9
+    assert output["category_scores"]["sexual"] == fake_moderation_server.DEFAULT_SCORE
+    assert output["categories"]["violence"]
+
+    outputs = moderation.get_openai_moderation_results_batch(["first", "hate=0.7"])
+    assert [output["category_scores"]["hate"] for output in outputs] == [fake_moderation_server.DEFAULT_SCORE, 0.7]
+
+    async def moderate_async() -> dict:
+        try:
+            return await moderation.get_openai_moderation_results_async("harassment=0.6", check_cache=False)
+        finally:
+            await moderation.close_async_openai_client()
+
+    assert asyncio.run(moderate_async())["category_scores"]["harassment"] == 0.6
+    assert fake_server.status_counts == {200: 3}
+
+
+def test_fake_moderation_server_failures(fake_server):
+    fake_server.rate_limit_rate = 1.0
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        post_moderation_request(fake_server.base_url, "hi")
+    assert exc_info.value.code == 429
+    assert exc_info.value.headers["Retry-After"] == "0.1"
+
+    fake_server.rate_limit_rate = 0.0
+    fake_server.error_rate = 1.0
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        post_moderation_request(fake_server.base_url, "hi")
+    assert exc_info.value.code == 500
+
+    fake_server.error_rate = 0.0
+    assert len(post_moderation_request(fake_server.base_url, ["a", "b"])["results"]) == 2
@@ -0,0 +1,159 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from conftest import mock_get_openai_moderation_results
+
+from student_guardrails import cache, local_provider, moderation, moderation_responses
+
+BENIGN_MESSAGES = [
+    "can you help me with fractions",
+    "what is 3/4 plus 5/8",
+    "how do I solve 2x + 3 = 7",
+    "is 7 a prime number",
+    "explain long division please",
+]
+VIOLENT_MESSAGES = [
+    "i will kill you",
+    "i want to hurt someone with a knife",
+    "go punch him in the face",
+]
+
+
+def get_training_data(n_examples: int = 2000) -> tuple[list[str], list[dict]]:
+    rng = np.random.default_rng(0)
+    texts = []
+    category_scores = []
+    for i in range(n_examples):
+        if rng.random() < 0.2:
+            texts.append(f"{VIOLENT_MESSAGES[i % len(VIOLENT_MESSAGES)]} {i}")
+            category_scores.append(
+                {category: 0.001 for category in moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST}
+            )
+            category_scores[-1]["violence"] = 0.9
+        else:
+            texts.append(f"{BENIGN_MESSAGES[i % len(BENIGN_MESSAGES)]} {i}")
+            category_scores.append(
+                {category: 0.0001 for category in moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST}
+            )
+    return texts, category_scores
+
+
+@pytest.fixture(scope="module")
+def trained_provider() -> local_provider.LocalModerationProvider:
+    return local_provider.LocalModerationProvider.train(*get_training_data(), n_features=2**12, epochs=5)
+
+
+def test_get_feature_matrix():
+    indptr, indices, values = local_provider.get_feature_matrix(["Hi there", "", "hi THERE!"], n_features=2**12)
+    assert list(np.diff(indptr)) == [len(indices) // 2, 0, len(indices) // 2]
+    # case and punctuation don't matter, and features are scaled to unit length
+    assert np.array_equal(indices[: indptr[1]], indices[indptr[2] :])
+    assert np.isclose(np.linalg.norm(values[: indptr[1]]), 1)
+    assert indices.max() < 2**12
+
+    weights = np.arange(2**12, dtype=np.float32).reshape(-1, 1)
+    product = local_provider.get_sparse_product(indptr, indices, values, weights)
+    assert product.shape == (3, 1)
+    assert product[1, 0] == 0
+    assert np.isclose(product[0, 0], (values[: indptr[1]] * indices[: indptr[1]]).sum())
+
+
+def test_local_provider(trained_provider, tmp_path):
+    assert trained_provider.categories == moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST
+    benign_result = trained_provider.score("what is 5/8 minus 1/4")
+    violent_result = trained_provider.score("i will kill him")
+    assert set(benign_result.keys()) >= {"flagged", "categories", "category_scores", "request_duration"}
+    assert max(benign_result["category_scores"].values()) < 0.01
+    assert violent_result["category_scores"]["violence"] > 0.5
+    assert violent_result["flagged"]
+    # the result has the shape the moderation rules expect
+    action, _, category = moderation.get_input_moderation_decision(
+        {"disallowed_words_in_input": [], "openai_moderation_result": violent_result},
+    )
+    assert action == moderation_responses.ACTION_TRY_AGAIN
+    assert category == "violence"
+
+    batch_results = trained_provider.score_batch(["what is 5/8 minus 1/4", "i will kill him"])
+    assert batch_results[1]["category_scores"] == pytest.approx(violent_result["category_scores"])
+    assert asyncio.run(trained_provider.score_async("i will kill him"))["category_scores"] == pytest.approx(
+        violent_result["category_scores"],
+    )
+
+    model_path = tmp_path / "model.npz"
+    trained_provider.save(model_path)
+    loaded_provider = local_provider.LocalModerationProvider.load(model_path)
+    assert loaded_provider.model == trained_provider.model
+    assert loaded_provider.score("i will kill him")["category_scores"] == violent_result["category_scores"]
+
+
+def test_read_training_examples():
+    scores = {"violence": 0.5}
+    texts, category_scores = local_provider.read_training_examples(
+        [
+            {"text": "a", "category_scores": scores},
+            {"text": "b", "openai_moderation_result": {"category_scores": scores}},
+            {"input_message": "c", "input_moderation_data": {"openai_moderation_result": {"category_scores": scores}}},
+            {"text": "decided by a word list", "openai_moderation_result": None},
+            {"id": 1, "category_scores": scores},
+        ],
+    )
+    assert texts == ["a", "b", "c"]
+    assert category_scores == [scores] * 3
+
+
+def test_train_cli(tmp_path):
+    input_path = tmp_path / "scored.jsonl"
+    with open(input_path, "w") as outfile:
+        for text, category_scores in zip(*get_training_data(200)):
+            outfile.write(json.dumps({"text": text, "category_scores": category_scores}) + "\n")
+    model_path = tmp_path / "model.npz"
+    local_provider.main([str(input_path), str(model_path), "--n-features", "1024", "--epochs", "2"])
+    assert local_provider.LocalModerationProvider.load(model_path).n_features == 1024
+
+
+@pytest.fixture
+def local_tier(trained_provider, monkeypatch):
+    monkeypatch.setattr(moderation, "MODERATION_LOCAL_TIER", True)
+    monkeypatch.setattr(moderation, "get_local_moderation_provider", lambda: trained_provider)
+    moderation.get_input_moderation_pipeline.cache_clear()
+    moderation.get_output_moderation_pipeline.cache_clear()
+    yield trained_provider
+    moderation.get_input_moderation_pipeline.cache_clear()
+    moderation.get_output_moderation_pipeline.cache_clear()
+
+
+def test_local_tier(local_tier, monkeypatch):
+    mock_score = Mock(side_effect=mock_get_openai_moderation_results)
+    monkeypatch.setattr("student_guardrails.moderation.get_openai_moderation_results", mock_score)
+
+    input_moderation_data = moderation.get_input_moderation_data("is 11 a prime number")
+    assert input_moderation_data["moderation_stage"] == "local"
+    assert input_moderation_data["openai_moderation_result"]["model"] == local_tier.model
+    mock_score.assert_not_called()
+
+    # uncertain messages are still scored remotely
+    input_moderation_data = moderation.get_input_moderation_data("i want to hurt him")
+    assert input_moderation_data["moderation_stage"] == "remote"
+    mock_score.assert_called_once()
+
+    output_moderation_data = moderation.get_output_moderation_data("how do I solve 3x = 12")
+    assert output_moderation_data["moderation_stage"] == "local"
+
+
+def test_set_moderation_provider(trained_provider, monkeypatch):
+    moderation_cache = cache.InMemoryModerationCache()
+    monkeypatch.setattr(moderation, "_moderation_cache", moderation_cache)
+    monkeypatch.setattr(moderation, "_moderation_cache_initialized", True)
+    moderation.set_moderation_provider(trained_provider)
+    try:
+        output = moderation.get_openai_moderation_results("i will kill him")
+        assert output["model"] == trained_provider.model
+        assert moderation_cache.get(cache.get_cache_key("i will kill him", trained_provider.model)) is not None
+        outputs = asyncio.run(moderation.get_openai_moderation_results_batch_async(["is 7 prime", "i will kill him"]))
+        assert outputs[1]["cache_hit"]
+    finally:
+        moderation.set_moderation_provider(None)
+    assert isinstance(moderation.get_moderation_provider(), moderation.OpenAIModerationProvider)
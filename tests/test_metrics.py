@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from student_guardrails import email_alerts, metrics, moderation, moderation_responses
+
+
+@pytest.fixture
+def enable_metrics():
+    metrics.reset()
+    metrics.enable()
+    yield metrics.get_registry()
+    metrics.disable()
+    metrics.reset()
+
+
+def test_metrics_disabled():
+    metrics.reset()
+    assert not metrics.is_enabled()
+    metrics.increment("test_total")
+    metrics.observe("test_seconds", 1.0)
+    with metrics.timer("test_seconds"):
+        pass
+    assert metrics.get_snapshot() == {"counters": {}, "histograms": {}}
+
+
+def test_metrics_registry_and_prometheus_text(enable_metrics, tmp_path):
+    metrics.increment("test_total", stage="a")
+    metrics.increment("test_total", 2, stage="a")
+    metrics.increment("test_total", stage='quote"d')
+    for value in [0.0001, 0.003, 0.003, 100.0]:
+        metrics.observe("test_seconds", value)
+    with pytest.raises(ValueError):
+        with metrics.timer("timed_seconds", error_counter="timed_errors_total", kind="x"):
+            raise ValueError()
+
+    assert enable_metrics.get_counter_value("test_total", {"stage": "a"}) == 3
+    assert enable_metrics.get_counter_value("timed_errors_total", {"kind": "x", "error": "ValueError"}) == 1
+    snapshot = metrics.get_snapshot()
+    histogram = snapshot["histograms"]["test_seconds"][0]
+    assert histogram["count"] == 4
+    assert histogram["sum"] == pytest.approx(100.0061)
+    assert sum(histogram["bucket_counts"]) == 4
+    assert histogram["bucket_counts"][histogram["buckets"].index(0.0001)] == 1
+    assert histogram["bucket_counts"][-1] == 1
+    assert snapshot["histograms"]["timed_seconds"][0]["labels"] == {"kind": "x"}
+
+    exporter = metrics.PrometheusTextExporter()
+    metrics.register_exporter(exporter)
+    try:
+        metrics.export_metrics()
+    finally:
+        metrics.unregister_exporter(exporter)
+    lines = exporter.text.splitlines()
+    assert "# TYPE test_total counter" in lines
+    assert 'test_total{stage="a"} 3' in lines
+    assert 'test_total{stage="quote\\"d"} 1' in lines
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{le="0.0001"} 1' in lines
+    assert 'test_seconds_bucket{le="0.005"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_count 4" in lines
+
+    # written to a file for the node_exporter textfile collector, replacing any previous export
+    path = tmp_path / "guardrails.prom"
+    path.write_text("stale")
+    metrics.PrometheusTextExporter(str(path)).export(snapshot)
+    assert path.read_text() == exporter.text
+    assert [file.name for file in tmp_path.iterdir()] == ["guardrails.prom"]
+
+
+def test_moderation_metrics(enable_metrics, patch_get_openai_moderation_results, patch_send_alert_email):
+    input_moderation_data = moderation.get_input_moderation_data("A bad word: ~specialDisallowedInputWord~")
+    moderation.apply_input_moderation_rules("", input_moderation_data)
+    input_moderation_data = asyncio.run(moderation.get_input_moderation_data_async("violence=0.9"))
+    input_moderation_data["openai_moderation_result"]["category_scores"]["violence"] = 0.9
+    action, _ = moderation.apply_input_moderation_rules("violence=0.9", input_moderation_data)
+    assert action == moderation_responses.ACTION_TRY_AGAIN
+    email_alerts.get_alert_dispatcher().join()
+    moderation.apply_output_moderation_rules("Fine.", moderation.get_output_moderation_data("Fine."))
+
+    assert (
+        enable_metrics.get_counter_value(
+            "guardrails_moderation_decisions_total",
+            {"pipeline": "input", "stage": "word_list"},
+        )
+        == 1
+    )
+    assert (
+        enable_metrics.get_counter_value(
+            "guardrails_moderation_decisions_total",
+            {"pipeline": "input", "stage": "remote"},
+        )
+        == 1
+    )
+    assert (
+        enable_metrics.get_counter_value(
+            "guardrails_input_moderation_actions_total",
+            {"action": moderation_responses.ACTION_TRY_AGAIN},
+        )
+        == 2
+    )
+    for category in ["violence", "disallowed_words"]:
+        assert (
+            enable_metrics.get_counter_value(
+                "guardrails_input_moderation_category_triggers_total",
+                {"category": category},
+            )
+            == 1
+        )
+    assert (
+        enable_metrics.get_counter_value(
+            "guardrails_output_moderation_actions_total",
+            {"action": moderation_responses.ACTION_NO_ACTION},
+        )
+        == 1
+    )
+    assert enable_metrics.get_counter_value("guardrails_alert_emails_total", {"result": "delivered"}) == 1
+    stage_histograms = metrics.get_snapshot()["histograms"]["guardrails_moderation_stage_duration_seconds"]
+    assert {(sample["labels"]["pipeline"], sample["labels"]["stage"]) for sample in stage_histograms} >= {
+        ("input", "word_list"),
+        ("input", "remote"),
+        ("output", "remote"),
+    }
@@ -1,4 +1,8 @@
-from student_guardrails import moderation, moderation_responses
+import asyncio
+import subprocess
+import sys
+
+from student_guardrails import email_alerts, moderation, moderation_responses
 
 
 def test_get_openai_moderation_results(patch_get_openai_moderation_results):
@@ -9,6 +13,17 @@ def test_get_openai_moderation_results(patch_get_openai_moderation_results):
     assert output["category_scores"]["sexual"] == 0.0001
 
 
+def test_import_is_lazy():
+    # heavy dependencies are imported on first use, not when moderation is imported
+    code = (
+        "import sys\n"
+        "from student_guardrails import moderation\n"
+        "print(sorted({'openai', 'sendgrid', 'numpy'} & set(sys.modules)))"
+    )
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert process.stdout.strip() == "[]"
+
+
 def test_get_disallowed_words():
     disallowed_words = moderation.get_disallowed_words_all()
     assert len(disallowed_words) >= 1
@@ -70,4 +85,31 @@ def test_apply_input_moderation_rules(patch_get_openai_moderation_results, patch
     input_moderation_data["openai_moderation_result"]["category_scores"][category] = 1
     action, message = moderation.apply_input_moderation_rules("", input_moderation_data)
     assert message == moderation_responses.OPENAI_MODERATION_CATEGORY_RESPONSE_MAP[category]
+    # alert emails are sent in the background
+    email_alerts.get_alert_dispatcher().join()
     patch_send_alert_email.assert_called_once()
+
+
+def test_get_openai_client_is_shared(patch_openai):
+    assert moderation.get_openai_client() is moderation.get_openai_client()
+    output = moderation.get_openai_moderation_results("Test input violence=0.7")
+    assert output["category_scores"]["violence"] == 0.7
+    assert "request_duration" in output
+
+
+def test_get_moderation_data_async(patch_async_openai):
+    async def moderate():
+        assert moderation.get_async_openai_client() is moderation.get_async_openai_client()
+        input_moderation_data, output_moderation_data = await asyncio.gather(
+            moderation.get_input_moderation_data_async("violence=0.7"),
+            moderation.get_output_moderation_data_async("Let's practice fractions!"),
+        )
+        await moderation.close_async_openai_client()
+        return input_moderation_data, output_moderation_data
+
+    input_moderation_data, output_moderation_data = asyncio.run(moderate())
+    assert input_moderation_data["disallowed_words_in_input"] == []
+    assert input_moderation_data["openai_moderation_result"]["category_scores"]["violence"] == 0.7
+    assert output_moderation_data["disallowed_words_in_output"] == []
+    action, _ = moderation.apply_input_moderation_rules("", input_moderation_data)
+    assert action == moderation_responses.ACTION_TRY_AGAIN
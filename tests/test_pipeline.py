@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from unittest.mock import Mock
+
+from conftest import mock_get_openai_moderation_results
+
+from student_guardrails import cache, moderation, moderation_responses, pipeline
+
+
+def test_input_moderation_short_circuit(monkeypatch):
+    mock_score = Mock(side_effect=mock_get_openai_moderation_results)
+    monkeypatch.setattr("student_guardrails.moderation.get_openai_moderation_results", mock_score)
+
+    input_moderation_data = moderation.get_input_moderation_data("A bad word: ~specialDisallowedInputWord~")
+    mock_score.assert_not_called()
+    assert input_moderation_data["moderation_stage"] == "word_list"
+    assert input_moderation_data["openai_moderation_result"] is None
+    action, message = moderation.apply_input_moderation_rules("", input_moderation_data)
+    assert action == moderation_responses.ACTION_TRY_AGAIN
+    assert message == moderation_responses.BAD_WORD_RESPONSE
+
+    input_moderation_data = moderation.get_input_moderation_data("No bad words here.")
+    mock_score.assert_called_once()
+    assert input_moderation_data["moderation_stage"] == "remote"
+
+    # disallowed output words are redacted, so the scores are still needed
+    output_moderation_data = moderation.get_output_moderation_data("~specialDisallowedOutputWord~")
+    assert mock_score.call_count == 2
+    assert output_moderation_data["disallowed_words_in_output"] == ["~specialdisallowedoutputword~"]
+    assert output_moderation_data["openai_moderation_result"] is not None
+
+
+def test_input_moderation_cache_stage(patch_openai, monkeypatch):
+    moderation_cache = cache.InMemoryModerationCache()
+    monkeypatch.setattr("student_guardrails.moderation._moderation_cache", moderation_cache)
+    monkeypatch.setattr("student_guardrails.moderation._moderation_cache_initialized", True)
+
+    assert moderation.get_input_moderation_data("hi")["moderation_stage"] == "remote"
+    input_moderation_data = moderation.get_input_moderation_data("Hi")
+    assert input_moderation_data["moderation_stage"] == "cache"
+    assert input_moderation_data["openai_moderation_result"]["cache_hit"]
+    assert moderation_cache.get_stats()["hits"] == 1
+    assert moderation_cache.get_stats()["misses"] == 1
+
+
+def test_background_remote_scoring():
+    background_results = []
+    background_scored = threading.Event()
+
+    def background_callback(context, moderation_result):
+        background_results.append((context.decided_by, moderation_result))
+        background_scored.set()
+
+    async def score_async(text):
+        return mock_get_openai_moderation_results(text)
+
+    remote_stage = pipeline.RemoteStage(mock_get_openai_moderation_results, score_async)
+    moderation_pipeline = pipeline.ModerationPipeline(
+        [pipeline.WordListStage(lambda text: {"bad"} if "bad" in text else set(), decisive=True), remote_stage],
+        background_scoring_stage=remote_stage,
+        background_callback=background_callback,
+    )
+    context = moderation_pipeline.run("bad")
+    assert context.decided_by == "word_list"
+    assert context.moderation_result is None
+    assert background_scored.wait(timeout=5)
+    assert background_results[0][0] == "word_list"
+    assert "category_scores" in background_results[0][1]
+
+    async def run_async():
+        context = await moderation_pipeline.run_async("bad again")
+        await asyncio.gather(*moderation_pipeline._background_tasks)
+        return context
+
+    context = asyncio.run(run_async())
+    assert context.decided_by == "word_list"
+    assert len(background_results) == 2
+
+    # messages that were scored aren't scored again in the background
+    context = moderation_pipeline.run("fine")
+    assert context.decided_by == "remote"
+    assert len(background_results) == 2
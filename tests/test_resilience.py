@@ -0,0 +1,259 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from student_guardrails import fake_moderation_server, moderation, moderation_responses, resilience
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def get_status_error(status_code: int) -> openai.APIStatusError:
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://api.openai.com/v1/moderations"))
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def test_is_retryable_openai_error():
+    assert moderation.is_retryable_openai_error(get_status_error(429))
+    assert moderation.is_retryable_openai_error(get_status_error(503))
+    assert not moderation.is_retryable_openai_error(get_status_error(400))
+    assert not moderation.is_retryable_openai_error(get_status_error(401))
+    assert moderation.is_retryable_openai_error(openai.APITimeoutError(request=httpx.Request("POST", "https://x")))
+    assert not moderation.is_retryable_openai_error(ValueError())
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(
+        failure_rate_threshold=0.5,
+        minimum_calls=4,
+        window=10,
+        open_duration=5,
+        clock=clock,
+    )
+    for _ in range(3):
+        breaker.record_failure()
+    # not enough calls yet
+    assert breaker.state == resilience.CIRCUIT_CLOSED
+    # failures outside the window don't count
+    clock.now = 20
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.get_stats()["calls_in_window"] == 2
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == resilience.CIRCUIT_OPEN
+    assert not breaker.allow_request()
+
+    clock.now = 25
+    assert breaker.allow_request()
+    assert breaker.state == resilience.CIRCUIT_HALF_OPEN
+    # only one trial call at a time
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == resilience.CIRCUIT_OPEN
+
+    clock.now = 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == resilience.CIRCUIT_CLOSED
+    assert breaker.get_stats()["rejected"] == 2
+
+
+def test_retry_policy():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(minimum_calls=100, clock=clock)
+    policy = resilience.RetryPolicy(
+        deadline=10,
+        attempt_timeout=3,
+        initial_backoff=1,
+        max_backoff=4,
+        is_retryable=lambda e: isinstance(e, ConnectionError),
+        circuit_breaker=breaker,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    timeouts = []
+
+    def flaky(timeout: float) -> str:
+        timeouts.append(timeout)
+        if len(timeouts) < 3:
+            raise ConnectionError()
+        return "ok"
+
+    assert policy.call(flaky) == "ok"
+    assert len(timeouts) == 3
+    assert timeouts[0] == 3
+    # backoff is jittered but bounded
+    assert 0 <= clock.now <= 1 + 2
+
+    def not_retryable(timeout: float) -> str:
+        timeouts.append(timeout)
+        raise ValueError()
+
+    timeouts.clear()
+    with pytest.raises(ValueError):
+        policy.call(not_retryable)
+    assert len(timeouts) == 1
+
+    def always_failing(timeout: float) -> str:
+        clock.now += timeout
+        raise ConnectionError()
+
+    start_time = clock.now
+    with pytest.raises(resilience.DeadlineExceededError):
+        policy.call(always_failing)
+    assert clock.now - start_time <= 10
+
+    # the breaker opens after the first failure, so the retry is rejected
+    breaker.minimum_calls = 1
+    with pytest.raises(resilience.CircuitOpenError):
+        policy.call(always_failing)
+    assert breaker.state == resilience.CIRCUIT_OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        policy.call(flaky)
+
+
+def test_retry_policy_async():
+    policy = resilience.RetryPolicy(deadline=0.2, attempt_timeout=0.05, initial_backoff=0.01, max_backoff=0.01)
+    attempts = []
+
+    async def hanging(timeout: float) -> str:
+        attempts.append(timeout)
+        await asyncio.sleep(10)
+        return "never"
+
+    with pytest.raises(resilience.DeadlineExceededError):
+        asyncio.run(policy.call_async(hanging))
+    # each attempt is cut off at attempt_timeout, then retried until the deadline
+    assert len(attempts) >= 2
+
+    async def succeeding(timeout: float) -> str:
+        return "ok"
+
+    assert asyncio.run(policy.call_async(succeeding)) == "ok"
+
+
+def get_half_open_policy(clock: FakeClock) -> resilience.RetryPolicy:
+    breaker = resilience.CircuitBreaker(minimum_calls=1, open_duration=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 10
+    return resilience.RetryPolicy(
+        deadline=10,
+        is_retryable=lambda e: isinstance(e, ConnectionError),
+        circuit_breaker=breaker,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+
+def test_retry_policy_half_open_cancelled():
+    clock = FakeClock()
+    policy = get_half_open_policy(clock)
+
+    async def cancelled(timeout: float) -> str:
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(policy.call_async(cancelled))
+    # the cancelled trial releases its half-open slot, rather than holding it forever
+    assert policy.circuit_breaker.state == resilience.CIRCUIT_HALF_OPEN
+    assert policy.call(lambda timeout: "ok") == "ok"
+    assert policy.circuit_breaker.state == resilience.CIRCUIT_CLOSED
+
+    def interrupted(timeout: float) -> str:
+        raise KeyboardInterrupt()
+
+    policy = get_half_open_policy(clock)
+    with pytest.raises(KeyboardInterrupt):
+        policy.call(interrupted)
+    assert policy.circuit_breaker.state == resilience.CIRCUIT_HALF_OPEN
+    assert policy.call(lambda timeout: "ok") == "ok"
+
+
+def test_retry_policy_closed_cancelled():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(minimum_calls=4, clock=clock)
+    policy = resilience.RetryPolicy(deadline=10, circuit_breaker=breaker, clock=clock, sleep=clock.sleep)
+
+    async def cancelled(timeout: float) -> str:
+        raise asyncio.CancelledError()
+
+    # the caller cancelling isn't a failure of the service, so it can't open the circuit
+    for _ in range(10):
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(policy.call_async(cancelled))
+    assert breaker.state == resilience.CIRCUIT_CLOSED
+    assert breaker.get_stats()["failures_in_window"] == 0
+    assert policy.call(lambda timeout: "ok") == "ok"
+
+
+def test_retry_policy_half_open_not_retryable():
+    clock = FakeClock()
+    policy = get_half_open_policy(clock)
+
+    def unauthorized(timeout: float) -> str:
+        raise ValueError("401")
+
+    with pytest.raises(ValueError):
+        policy.call(unauthorized)
+    # not a success, so the circuit stays half-open, but the trial slot is released
+    assert policy.circuit_breaker.state == resilience.CIRCUIT_HALF_OPEN
+    assert policy.call(lambda timeout: "ok") == "ok"
+    assert policy.circuit_breaker.state == resilience.CIRCUIT_CLOSED
+
+
+@pytest.fixture
+def failing_server(monkeypatch):
+    with fake_moderation_server.FakeModerationServer(error_rate=1.0) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-api-key")
+        monkeypatch.setattr(moderation, "MODERATION_DEADLINE", 0.5)
+        monkeypatch.setattr(moderation, "MODERATION_RETRY_INITIAL_BACKOFF", 0.01)
+        monkeypatch.setattr(moderation, "MODERATION_RETRY_MAX_BACKOFF", 0.05)
+        monkeypatch.setattr(moderation, "MODERATION_CIRCUIT_MIN_CALLS", 4)
+        moderation.reset_openai_clients()
+        yield server
+    moderation.reset_openai_clients()
+
+
+def test_moderation_fallback(failing_server, monkeypatch):
+    input_moderation_data = moderation.get_input_moderation_data("Is 7 a prime number?")
+    assert input_moderation_data["moderation_unavailable"]
+    assert input_moderation_data["openai_moderation_result"] is None
+    assert failing_server.request_count >= 2
+    action, response = moderation.apply_input_moderation_rules("Is 7 a prime number?", input_moderation_data)
+    assert action == moderation_responses.ACTION_TRY_AGAIN
+    assert response == moderation_responses.TRY_AGAIN_RESPONSE
+
+    output_moderation_data = moderation.get_output_moderation_data("Yes, 7 is prime.")
+    assert output_moderation_data["moderation_unavailable"]
+    generation = moderation.apply_output_moderation_rules("Yes, 7 is prime.", output_moderation_data)
+    assert generation == moderation_responses.BAD_GENERATION_RESPONSE
+
+    # the circuit is open, so later calls fail fast without contacting the API
+    assert moderation.get_circuit_breaker().state == resilience.CIRCUIT_OPEN
+    request_count = failing_server.request_count
+    input_moderation_data = asyncio.run(moderation.get_input_moderation_data_async("Another question"))
+    assert input_moderation_data["moderation_unavailable"]
+    assert failing_server.request_count == request_count
+
+    monkeypatch.setattr(moderation, "MODERATION_FALLBACK_MODE", moderation.MODERATION_FALLBACK_LOCAL_ONLY)
+    action, response = moderation.apply_input_moderation_rules("Another question", input_moderation_data)
+    assert action == moderation_responses.ACTION_NO_ACTION
+    assert response is None
+    output_moderation_data = moderation.get_output_moderation_data("~specialDisallowedOutputWord~ is redacted.")
+    generation = moderation.apply_output_moderation_rules(
+        "~specialDisallowedOutputWord~ is redacted.", output_moderation_data
+    )
+    assert generation == " is redacted."
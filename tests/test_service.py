@@ -0,0 +1,222 @@
+import asyncio
+import http.client
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from student_guardrails import fake_moderation_server, moderation, moderation_responses, service, session_state
+
+
+def handle_request(method: str, path: str, content=None, headers=None, **kwargs) -> tuple[int, dict | list | str]:
+    body = json.dumps(content).encode("utf-8") if content is not None else b""
+    return asyncio.run(service.ModerationService(**kwargs).handle_request(method, path, body, headers))
+
+
+def test_handle_request(patch_get_openai_moderation_results, patch_send_alert_email):
+    status, content = handle_request("POST", "/v1/moderation/input", {"input_text": "What is 3/4 + 5/8?"})
+    assert status == 200
+    assert content["moderation_stage"] == "remote"
+    assert content["openai_moderation_result"] is not None
+
+    status, content = handle_request(
+        "POST",
+        "/v1/moderation/input",
+        [{"input_text": "Hi", "previous_messages": ["Hello"]}, {"input_text": "~specialDisallowedInputWord~"}],
+    )
+    assert status == 200
+    assert [data["moderation_stage"] for data in content] == ["remote", "word_list"]
+
+    status, content = handle_request(
+        "POST", "/v1/rules/input", {"input_message": "x", "input_moderation_data": content[1]}
+    )
+    assert status == 200
+    assert content == {
+        "action": moderation_responses.ACTION_TRY_AGAIN,
+        "response": moderation_responses.BAD_WORD_RESPONSE,
+    }
+
+    status, output_moderation_data = handle_request(
+        "POST", "/v1/moderation/output", {"output": "Yes, ~specialDisallowedOutputWord~."}
+    )
+    assert status == 200
+    status, content = handle_request(
+        "POST",
+        "/v1/rules/output",
+        {"generation": "Yes, ~specialDisallowedOutputWord~.", "output_moderation_data": output_moderation_data},
+    )
+    assert status == 200
+    assert content == {"generation": "Yes, ."}
+
+    status, content = handle_request("GET", "/health")
+    assert status == 200
+    assert content["status"] == "ok"
+
+
+def test_handle_request_errors():
+    assert handle_request("GET", "/v1/unknown")[0] == 404
+    assert handle_request("GET", "/v1/moderation/input")[0] == 405
+    assert handle_request("POST", "/v1/moderation/input", {"text": "wrong field"})[0] == 400
+    assert handle_request("POST", "/v1/moderation/input", "not an object")[0] == 400
+    assert handle_request("POST", "/v1/moderation/input", [{"input_text": "x"}] * 1000)[0] == 400
+    assert handle_request("POST", "/v1/rules/input", {"input_message": "x", "input_moderation_data": {}})[0] == 400
+    status, content = asyncio.run(service.ModerationService().handle_request("POST", "/v1/moderation/input", b"{"))
+    assert status == 400
+    assert "error" in content
+
+
+def test_handle_batch_request_errors(patch_get_openai_moderation_results, monkeypatch):
+    submit_alert = Mock(return_value=True)
+    monkeypatch.setattr("student_guardrails.alert_aggregation.submit_alert", submit_alert)
+    status, input_moderation_data = handle_request("POST", "/v1/moderation/input", {"input_text": "I feel awful"})
+    input_moderation_data["openai_moderation_result"]["category_scores"]["self-harm"] = 1
+    valid_item = {"input_message": "I feel awful", "input_moderation_data": input_moderation_data}
+
+    # an invalid item fails the batch before any item is handled, so no alert is sent
+    status, content = handle_request("POST", "/v1/rules/input", [valid_item, {"input_message": "x"}])
+    assert status == 400
+    status, content = handle_request(
+        "POST",
+        "/v1/rules/input",
+        [valid_item, {"input_message": "x", "input_moderation_data": {}}],
+    )
+    assert status == 400
+    assert "disallowed_words_in_input" in content["error"]
+    assert submit_alert.call_count == 0
+
+    # an item that fails while being handled gets an error in place of its result
+    apply_input_moderation_rules = moderation.apply_input_moderation_rules
+
+    def fail_on_x(input_message: str, input_moderation_data: dict, **kwargs) -> tuple[str, str | None]:
+        if input_message == "x":
+            raise RuntimeError("failed")
+        return apply_input_moderation_rules(input_message, input_moderation_data, **kwargs)
+
+    monkeypatch.setattr(moderation, "apply_input_moderation_rules", fail_on_x)
+    status, content = handle_request(
+        "POST",
+        "/v1/rules/input",
+        [valid_item, {"input_message": "x", "input_moderation_data": input_moderation_data}],
+    )
+    assert status == 200
+    assert content[0]["action"] == moderation_responses.ACTION_END_CONVERSATION
+    assert "RuntimeError" in content[1]["error"]
+    assert submit_alert.call_count == 1
+
+
+def test_apply_input_rules_category_is_reserved(patch_get_openai_moderation_results, monkeypatch):
+    submit_alert = Mock(return_value=True)
+    monkeypatch.setattr("student_guardrails.alert_aggregation.submit_alert", submit_alert)
+    status, input_moderation_data = handle_request("POST", "/v1/moderation/input", {"input_text": "I feel awful"})
+    input_moderation_data["openai_moderation_result"]["category_scores"]["self-harm"] = 1
+    item = {"input_message": "I feel awful", "input_moderation_data": input_moderation_data, "user_id": 7}
+    assert handle_request("POST", "/v1/rules/input", {**item, "category": "violence"})[0] == 400
+    assert submit_alert.call_count == 0
+    assert handle_request("POST", "/v1/rules/input", item)[0] == 200
+    assert submit_alert.call_args.args[0]["category"] == "self-harm"
+    assert submit_alert.call_args.args[0]["user_id"] == 7
+
+
+def test_handle_connection_invalid_content_length():
+    async def send(request: bytes) -> bytes:
+        server = await asyncio.start_server(service.ModerationService().handle_connection, "127.0.0.1", 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+
+    for content_length in ["abc", "-1"]:
+        response = asyncio.run(
+            send(f"POST /v1/moderation/input HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n{{}}".encode()),
+        )
+        assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+        assert b"Connection: close" in response
+        assert response.endswith(b'{"error": "Invalid Content-Length."}')
+
+
+def test_handle_session_requests(patch_get_openai_moderation_results, monkeypatch):
+    authorization = {"authorization": "Bearer secret"}
+    assert handle_request("POST", "/v1/sessions/review", {"user_id": 7}, authorization, review_token="secret")[0] == 400
+    session_state_store = session_state.InMemorySessionStateStore()
+    monkeypatch.setattr(moderation, "_session_state_store", session_state_store)
+    monkeypatch.setattr(moderation, "_session_state_store_initialized", True)
+    session_state_store.record_action("user:7", moderation_responses.ACTION_END_CONVERSATION)
+
+    status, content = handle_request("POST", "/v1/moderation/input", {"input_text": "hello?", "user_id": 7})
+    assert status == 200
+    assert content["session_status"] == session_state.SESSION_STATUS_BLOCKED
+    status, content = handle_request(
+        "POST", "/v1/rules/input", {"input_message": "hello?", "input_moderation_data": content}
+    )
+    assert content["action"] == moderation_responses.ACTION_END_CONVERSATION
+
+    # session review is disabled without a token, and requires it otherwise
+    assert handle_request("POST", "/v1/sessions/review", {"user_id": 7}, authorization)[0] == 403
+    for headers in [None, {"authorization": "Bearer wrong"}, {"authorization": "secret"}]:
+        assert handle_request("POST", "/v1/sessions/review", {"user_id": 7}, headers, review_token="secret")[0] == 401
+    assert session_state_store.get_status("user:7") == session_state.SESSION_STATUS_BLOCKED
+
+    assert handle_request("POST", "/v1/sessions/review", {}, authorization, review_token="secret")[0] == 400
+    assert (
+        handle_request("POST", "/v1/sessions/review", {"user_id": [7]}, authorization, review_token="secret")[0] == 400
+    )
+    status, content = handle_request(
+        "POST", "/v1/sessions/review", {"user_id": 7}, authorization, review_token="secret"
+    )
+    assert status == 200
+    assert content["session_state"]["review_status"] == session_state.REVIEW_STATUS_REVIEWED
+    status, content = handle_request("POST", "/v1/moderation/input", {"input_text": "hello?", "user_id": 7})
+    assert content["session_status"] is None
+
+
+def post_json(connection: http.client.HTTPConnection, path: str, content) -> tuple[int, dict | list]:
+    connection.request("POST", path, body=json.dumps(content), headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    with fake_moderation_server.FakeModerationServer() as server:
+        # workers are separate processes, so they're configured through the environment
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-api-key")
+        yield server
+
+
+def test_moderation_server(fake_api, tmp_path):
+    with service.ModerationServer(port=0, workers=2, cache_path=str(tmp_path / "cache.sqlite3")) as server:
+        # several requests on one kept-alive connection
+        connection = http.client.HTTPConnection(server.host, server.port, timeout=10)
+        status, input_moderation_data = post_json(connection, "/v1/moderation/input", {"input_text": "violence=0.9"})
+        assert status == 200
+        assert input_moderation_data["openai_moderation_result"]["category_scores"]["violence"] == 0.9
+        status, content = post_json(
+            connection,
+            "/v1/rules/input",
+            {"input_message": "violence=0.9", "input_moderation_data": input_moderation_data},
+        )
+        assert content["action"] == moderation_responses.ACTION_TRY_AGAIN
+        status, content = post_json(connection, "/v1/moderation/output", [{"output": f"Output {i}"} for i in range(5)])
+        assert status == 200
+        assert len(content) == 5
+        assert fake_api.request_count == 6
+        connection.close()
+
+        # whichever worker handles a repeated message, the result comes from the shared cache
+        for _ in range(6):
+            connection = http.client.HTTPConnection(server.host, server.port, timeout=10)
+            status, input_moderation_data = post_json(
+                connection, "/v1/moderation/input", {"input_text": "Violence=0.9 "}
+            )
+            assert input_moderation_data["moderation_stage"] == "cache"
+            connection.close()
+        assert fake_api.request_count == 6
+
+        connection = http.client.HTTPConnection(server.host, server.port, timeout=10)
+        connection.request("GET", "/health")
+        assert json.loads(connection.getresponse().read())["status"] == "ok"
+        connection.close()
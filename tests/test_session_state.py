@@ -0,0 +1,162 @@
+import threading
+from unittest.mock import Mock
+
+import pytest
+from conftest import mock_get_openai_moderation_results
+
+from student_guardrails import moderation, moderation_responses, pipeline, resilience, session_state
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def create_store(request, tmp_path):
+    def create_store(**kwargs) -> session_state.SessionStateStore:
+        if request.param == "memory":
+            return session_state.InMemorySessionStateStore(**kwargs)
+        return session_state.SQLiteSessionStateStore(tmp_path / "session-state.sqlite3", **kwargs)
+
+    return create_store
+
+
+def test_session_state_store(create_store):
+    now = 1000.0
+    store = create_store(max_strikes=2, throttle_duration=60, clock=lambda: now)
+    assert store.get("a") is None
+    assert store.get_status("a") is None
+
+    # every second strike starts a throttle
+    assert store.record_action("a", moderation_responses.ACTION_TRY_AGAIN)["strikes"] == 1
+    assert store.get_status("a") is None
+    store.record_action("a", moderation_responses.ACTION_TRY_AGAIN)
+    assert store.get_status("a") == session_state.SESSION_STATUS_THROTTLED
+    now += 61
+    assert store.get_status("a") is None
+
+    state = store.record_action("a", moderation_responses.ACTION_END_CONVERSATION)
+    assert state["blocked"]
+    assert state["review_status"] == session_state.REVIEW_STATUS_PENDING
+    assert state["strikes"] == 2
+    assert store.get("a") == state
+    assert store.get_status("a") == session_state.SESSION_STATUS_BLOCKED
+    # other sessions are unaffected
+    assert store.get_status("b") is None
+
+    state = store.mark_reviewed("a")
+    assert not state["blocked"]
+    assert state["review_status"] == session_state.REVIEW_STATUS_REVIEWED
+    assert store.get_status("a") is None
+    assert len(store) == 1
+    store.delete("a")
+    assert store.get("a") is None
+
+
+def test_session_state_store_concurrent_updates(create_store):
+    store = create_store()
+
+    def record_strikes():
+        for _ in range(50):
+            store.record_action("a", moderation_responses.ACTION_TRY_AGAIN)
+
+    threads = [threading.Thread(target=record_strikes) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get("a")["strikes"] == 200
+
+
+def test_sqlite_session_state_store_is_shared(tmp_path):
+    # e.g. in two worker processes
+    store = session_state.SQLiteSessionStateStore(tmp_path / "session-state.sqlite3")
+    other_store = session_state.SQLiteSessionStateStore(tmp_path / "session-state.sqlite3")
+    store.record_action("a", moderation_responses.ACTION_END_CONVERSATION)
+    assert other_store.get_status("a") == session_state.SESSION_STATUS_BLOCKED
+    other_store.mark_reviewed("a")
+    assert store.get_status("a") is None
+
+
+def test_in_memory_session_state_store_max_size():
+    store = session_state.InMemorySessionStateStore(max_size=2)
+    for key in ["a", "b", "c"]:
+        store.record_action(key, moderation_responses.ACTION_END_CONVERSATION)
+    assert len(store) == 2
+    assert store.get("a") is None
+
+
+@pytest.fixture
+def session_state_store(monkeypatch):
+    store = session_state.InMemorySessionStateStore()
+    monkeypatch.setattr(moderation, "_session_state_store", store)
+    monkeypatch.setattr(moderation, "_session_state_store_initialized", True)
+    return store
+
+
+def test_blocked_session_short_circuits(session_state_store, patch_send_alert_email, monkeypatch):
+    get_results = Mock(side_effect=mock_get_openai_moderation_results)
+    monkeypatch.setattr(moderation, "get_openai_moderation_results", get_results)
+
+    input_moderation_data = moderation.get_input_moderation_data("I feel awful", activity_session_id="session-1")
+    assert input_moderation_data["session_status"] is None
+    input_moderation_data["openai_moderation_result"]["category_scores"]["self-harm"] = 1
+    action, _ = moderation.apply_input_moderation_rules(
+        "I feel awful",
+        input_moderation_data,
+        activity_session_id="session-1",
+    )
+    assert action == moderation_responses.ACTION_END_CONVERSATION
+    assert session_state_store.get("activity_session:session-1")["blocked"]
+    assert get_results.call_count == 1
+
+    # later messages from the session aren't moderated, even if they contain disallowed words
+    for text in ["hello?", "~specialDisallowedInputWord~"]:
+        input_moderation_data = moderation.get_input_moderation_data(text, activity_session_id="session-1")
+        assert input_moderation_data["moderation_stage"] == pipeline.SessionStateStage.name
+        assert input_moderation_data["session_status"] == session_state.SESSION_STATUS_BLOCKED
+        assert input_moderation_data["disallowed_words_in_input"] == []
+        action, response = moderation.apply_input_moderation_rules(
+            text,
+            input_moderation_data,
+            activity_session_id="session-1",
+        )
+        assert action == moderation_responses.ACTION_END_CONVERSATION
+        assert response == moderation_responses.END_CONVERSATION_RESPONSE
+    assert get_results.call_count == 1
+    # other sessions, and messages without a session, are moderated as usual
+    assert moderation.get_input_moderation_data("hello?", user_id="user-1")["moderation_stage"] == "remote"
+    assert moderation.get_input_moderation_data("hello?")["moderation_stage"] == "remote"
+
+    session_state_store.mark_reviewed("activity_session:session-1")
+    input_moderation_data = moderation.get_input_moderation_data("hello?", activity_session_id="session-1")
+    assert input_moderation_data["moderation_stage"] == "remote"
+
+
+def test_throttled_session(session_state_store, patch_get_openai_moderation_results):
+    session_state_store.max_strikes = 2
+    for _ in range(2):
+        input_moderation_data = moderation.get_input_moderation_data("~specialDisallowedInputWord~", user_id="user-1")
+        action, _ = moderation.apply_input_moderation_rules("", input_moderation_data, user_id="user-1")
+        assert action == moderation_responses.ACTION_TRY_AGAIN
+    input_moderation_data = moderation.get_input_moderation_data("what is 3/4 + 5/8?", user_id="user-1")
+    assert input_moderation_data["session_status"] == session_state.SESSION_STATUS_THROTTLED
+    action, response = moderation.apply_input_moderation_rules("", input_moderation_data, user_id="user-1")
+    assert action == moderation_responses.ACTION_TRY_AGAIN
+    assert response == moderation_responses.THROTTLED_RESPONSE
+    # answering a throttled message isn't another strike
+    assert session_state_store.get("user:user-1")["strikes"] == 2
+
+
+def test_unavailable_moderation_is_not_a_strike(session_state_store, monkeypatch):
+    session_state_store.max_strikes = 3
+    monkeypatch.setattr(moderation, "MODERATION_FALLBACK_MODE", moderation.MODERATION_FALLBACK_FAIL_CLOSED)
+
+    def unavailable(input: str, **kwargs) -> dict:
+        raise resilience.DeadlineExceededError("unavailable")
+
+    monkeypatch.setattr(moderation, "get_openai_moderation_results", unavailable)
+    for _ in range(4):
+        input_moderation_data = moderation.get_input_moderation_data("what is 2+2?", user_id="user-1")
+        assert input_moderation_data["moderation_unavailable"]
+        assert input_moderation_data["session_status"] is None
+        action, response = moderation.apply_input_moderation_rules("", input_moderation_data, user_id="user-1")
+        assert action == moderation_responses.ACTION_TRY_AGAIN
+        assert response == moderation_responses.TRY_AGAIN_RESPONSE
+    assert session_state_store.get("user:user-1") is None
@@ -0,0 +1,86 @@
+import asyncio
+from unittest.mock import Mock
+
+from conftest import mock_get_openai_moderation_results
+
+from student_guardrails import moderation, moderation_responses, streaming
+
+
+def stream(moderator: streaming.StreamingOutputModerator, text: str, chunk_size: int) -> list[str]:
+    approved = [moderator.feed(text[i : i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    approved.append(moderator.finish())
+    return approved
+
+
+def test_streaming_output_moderation(monkeypatch):
+    mock_score = Mock(side_effect=mock_get_openai_moderation_results)
+    monkeypatch.setattr("student_guardrails.moderation.get_openai_moderation_results", mock_score)
+
+    generation = (
+        "Here is the first sentence, which is long enough to be a segment. "
+        "The word ~specialDisallowedOutputWord~ is redacted even when split across chunks! "
+        "A second line follows.\nAnd the generation ends without punctuation"
+    )
+    for chunk_size in [1, 3, 7, 50, len(generation)]:
+        mock_score.reset_mock()
+        moderator = streaming.StreamingOutputModerator(min_segment_length=20)
+        approved = stream(moderator, generation, chunk_size)
+        expected = moderation.get_disallowed_output_matcher().redact(generation)[0]
+        assert "".join(approved) == expected == moderator.get_generation()
+        assert "~specialDisallowedOutputWord~" not in expected
+        assert moderator.disallowed_words == {"~specialdisallowedoutputword~"}
+        assert not moderator.aborted
+        # scored one segment at a time
+        assert mock_score.call_count == len(moderator.moderation_results) == 4
+        if chunk_size < 50:
+            # text was approved before the generation finished
+            assert approved[-1] != expected
+
+    # "fuck" is held back until the next chunk shows it's part of a longer word
+    moderator = streaming.StreamingOutputModerator(min_segment_length=0)
+    assert moderator.feed("Fuck") == ""
+    assert moderator.feed("sia are flowering shrubs. " + "x" * 40) == "Fucksia are flowering shrubs. "
+
+
+def test_streaming_output_moderation_long_segment(patch_get_openai_moderation_results):
+    # without a boundary or whitespace within max_segment_length, the cut backs up to the previous word boundary
+    # rather than splitting "Fucksia" after "Fuck"
+    moderator = streaming.StreamingOutputModerator(min_segment_length=10, max_segment_length=50)
+    held_back = moderator.matcher.max_term_length
+    text = "a-" * 25 + "Fucksia" + "-" * (held_back - 3)
+    assert moderator.feed(text) == "a-" * 25
+    assert moderator.finish() == "Fucksia" + "-" * (held_back - 3)
+    assert moderator.get_generation() == text
+
+    # a single word longer than max_segment_length is held until a word boundary arrives
+    moderator = streaming.StreamingOutputModerator(min_segment_length=10, max_segment_length=50)
+    assert moderator.feed("x" * 100) == ""
+    assert moderator.feed("-" * held_back) == "x" * 100
+
+
+def test_streaming_output_moderation_abort(monkeypatch):
+    def mock_score(input: str, **kwargs) -> dict:
+        return mock_get_openai_moderation_results(input, 0.9999 if "violent" in input else 0.0001)
+
+    monkeypatch.setattr("student_guardrails.moderation.get_openai_moderation_results", mock_score)
+    moderator = streaming.StreamingOutputModerator(min_segment_length=10)
+    approved = moderator.feed(
+        "This sentence is perfectly fine. This sentence is violent. This one is fine, and it is long enough. "
+    )
+    assert approved == "This sentence is perfectly fine. "
+    assert moderator.aborted
+    assert moderator.feed("More text. " * 20) == ""
+    assert moderator.finish() == ""
+    assert moderator.get_generation() == moderation_responses.BAD_GENERATION_RESPONSE
+
+
+def test_streaming_output_moderation_async(patch_get_openai_moderation_results):
+    async def run() -> list[str]:
+        moderator = streaming.StreamingOutputModerator(min_segment_length=5)
+        chunks = ["One sentence. Two sent", "ences that keep going for a while. Three"]
+        approved = [await moderator.feed_async(chunk) for chunk in chunks]
+        approved.append(await moderator.finish_async())
+        return approved
+
+    approved = asyncio.run(run())
+    assert approved == ["", "One sentence. ", "Two sentences that keep going for a while. Three"]
@@ -0,0 +1,85 @@
+import numpy as np
+
+from student_guardrails import moderation, moderation_responses, threshold_analysis
+
+
+def get_random_records(n_messages: int, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    categories = moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST
+    # mostly low scores, with some over the thresholds
+    scores = rng.random((n_messages, len(categories))) ** 8
+    return [
+        {
+            "direction": "I",
+            "disallowed_words": ["bad"] if i % 17 == 0 else [],
+            "category_scores": dict(zip(categories, scores[i].tolist())),
+            "label": i % 3 == 0,
+        }
+        for i in range(n_messages)
+    ]
+
+
+def get_expected_decisions(records: list[dict]) -> list[tuple[str, str | None]]:
+    decisions = []
+    for record in records:
+        action, _, category = moderation.get_input_moderation_decision(
+            {
+                "disallowed_words_in_input": record["disallowed_words"],
+                "openai_moderation_result": {"category_scores": record["category_scores"]},
+            },
+        )
+        decisions.append((action, category))
+    return decisions
+
+
+def test_threshold_replay_matches_moderation_rules(monkeypatch):
+    records = get_random_records(500)
+    # bulk moderation output rows for output messages are ignored
+    replay = threshold_analysis.ThresholdReplay.from_records(records + [{**records[0], "direction": "O"}])
+    assert replay.category_scores.shape == (500, len(moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST))
+
+    lower_thresholds = {category: 0.2 for category in moderation.OPENAI_MODERATION_CATEGORY_PRIORITY_LIST}
+    for thresholds in [None, lower_thresholds]:
+        if thresholds is not None:
+            monkeypatch.setattr(moderation, "OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP", thresholds)
+        decisions = replay.get_decisions(thresholds)
+        expected_decisions = get_expected_decisions(records)
+        actions = [threshold_analysis.INPUT_ACTIONS[code] for code in decisions["action"]]
+        categories = [replay.categories[i] if i >= 0 else None for i in decisions["category"]]
+        assert list(zip(actions, categories)) == expected_decisions
+        expected_alerts = [
+            category is not None
+            and moderation_responses.ACTION_EMAIL_ALERT
+            in moderation_responses.INPUT_MODERATION_CATEGORY_ACTION_MAP[category]
+            for _, category in expected_decisions
+        ]
+        assert decisions["alert"].tolist() == expected_alerts
+
+
+def test_threshold_replay_sweep():
+    records = get_random_records(300, seed=1)
+    replay = threshold_analysis.ThresholdReplay.from_records(records, label_key="label")
+    grid = threshold_analysis.get_threshold_grid({"violence": [0.0, 0.5, 1.1], "harassment": [0.1, 0.9]})
+    assert grid.shape == (6, len(replay.categories))
+    assert set(grid[:, replay.categories.index("violence")]) == {0.0, 0.5, 1.1}
+    assert (
+        grid[:, replay.categories.index("sexual")] == moderation.OPENAI_MODERATION_CATEGORY_THRESHOLD_MAP["sexual"]
+    ).all()
+
+    # small chunks give the same results as a single chunk
+    results = replay.sweep(grid, max_chunk_elements=1)
+    single_chunk_results = replay.sweep(grid)
+    for key, values in results.items():
+        assert np.array_equal(values, single_chunk_results[key], equal_nan=True)
+    for i in range(len(grid)):
+        decisions = replay.get_decisions(grid[i])
+        assert results["alerts"][i] == decisions["alert"].sum()
+        for code, action in enumerate(threshold_analysis.INPUT_ACTIONS):
+            assert results[action][i] == (decisions["action"] == code).sum()
+        predicted = decisions["action"] != threshold_analysis.NO_ACTION_CODE
+        labels = replay.labels > 0
+        assert results["precision"][i] == (predicted & labels).sum() / predicted.sum()
+        assert results["recall"][i] == (predicted & labels).sum() / labels.sum()
+    # a violence threshold of 0 acts on every message
+    assert results[moderation_responses.ACTION_NO_ACTION][0] == 0
+    assert results["recall"][0] == 1.0
@@ -0,0 +1,85 @@
+from student_guardrails import compile_word_lists, moderation, word_matcher
+
+
+def test_word_list_matcher():
+    matcher = word_matcher.WordListMatcher(["ass", "Bad Phrase", "~special~", "he", "hers", "", "  "])
+    assert matcher.terms == {"ass", "bad phrase", "~special~", "he", "hers"}
+    assert matcher.max_term_length == len("bad phrase")
+
+    # case-insensitive, respecting word boundaries and punctuation
+    assert matcher.find_terms("What a class!") == set()
+    assert matcher.find_terms("ASS! what a bad\n   PHRASE.") == {"ass", "bad phrase"}
+    assert matcher.find_terms("x~special~y") == {"~special~"}
+    # leftmost-longest
+    assert matcher.find_matches("hers") == [(0, 4, "hers")]
+    assert matcher.find_terms("he said hers") == {"he", "hers"}
+
+    redacted, terms = matcher.redact("Ass, that is a Bad Phrase for a class.", replacement="***")
+    assert redacted == "***, that is a *** for a class."
+    assert terms == {"ass", "bad phrase"}
+    assert matcher.redact("Nothing here.") == ("Nothing here.", set())
+
+    assert word_matcher.WordListMatcher([]).find_matches("anything") == []
+
+
+def test_word_list_matcher_large_list():
+    terms = [f"term{i}" for i in range(20000)] + ["multi word phrase"]
+    matcher = word_matcher.WordListMatcher(terms)
+    assert matcher.find_terms("term1 term19999 term20000 multi word phrase") == {
+        "term1",
+        "term19999",
+        "multi word phrase",
+    }
+
+
+def test_word_list_matcher_snapshot(tmp_path):
+    matcher = word_matcher.WordListMatcher(["ass", "bad phrase"])
+    snapshot_path = tmp_path / "word_lists.pickle"
+    word_matcher.save_snapshot(snapshot_path, {"input": matcher}, "hash")
+    assert word_matcher.load_snapshot(snapshot_path, "other-hash") is None
+    loaded_matcher = word_matcher.load_snapshot(snapshot_path, "hash")["input"]
+    assert loaded_matcher.terms == matcher.terms
+    assert loaded_matcher.find_matches("Ass, a BAD phrase; class") == matcher.find_matches("Ass, a BAD phrase; class")
+
+
+def test_disallowed_words_snapshot(tmp_path, monkeypatch):
+    snapshot_path = tmp_path / "word_lists.pickle"
+    compile_word_lists.main([str(snapshot_path)])
+    monkeypatch.setattr(moderation, "MODERATION_WORD_LIST_SNAPSHOT_PATH", str(snapshot_path))
+    moderation.get_word_list_snapshot.cache_clear()
+    moderation.get_disallowed_input_matcher.cache_clear()
+    try:
+        assert moderation.get_word_list_snapshot() is not None
+        assert moderation.get_disallowed_input_matcher() is moderation.get_word_list_snapshot()["input"]
+        assert moderation.get_disallowed_words_in_input("~specialDisallowedInputWord~") == {
+            "~specialdisallowedinputword~",
+        }
+
+        # a snapshot of other word lists is ignored
+        monkeypatch.setattr(moderation, "get_word_lists_hash", lambda: "other-hash")
+        moderation.get_word_list_snapshot.cache_clear()
+        assert moderation.get_word_list_snapshot() is None
+    finally:
+        moderation.get_word_list_snapshot.cache_clear()
+        moderation.get_disallowed_input_matcher.cache_clear()
+
+
+def test_disallowed_words_matching():
+    assert moderation.get_disallowed_words_in_input("Punctuated ~specialDisallowedInputWord~!") == {
+        "~specialdisallowedinputword~",
+    }
+    assert moderation.get_disallowed_words_in_output("~specialDisallowedOutputWord~") == {
+        "~specialdisallowedoutputword~",
+    }
+
+    generation = "This is fucking ~specialDisallowedOutputWord~ great, as is the word Fuck."
+    output_moderation_data = {
+        "disallowed_words_in_output": sorted(moderation.get_disallowed_words_in_output(generation)),
+        "openai_moderation_result": {"category_scores": {"violence": 0.01}},
+    }
+    assert output_moderation_data["disallowed_words_in_output"] == ["fuck", "~specialdisallowedoutputword~"]
+    # "fucking" is not a listed word, so it is not partially redacted
+    assert (
+        moderation.apply_output_moderation_rules(generation, output_moderation_data)
+        == "This is fucking  great, as is the word ."
+    )